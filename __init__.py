@@ -1,53 +1,59 @@
+import collections
 import itertools
+import logging
+import os
 
-from flask import Blueprint
+from flask import Blueprint, current_app
 from sqlalchemy import event
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.attributes import get_history
 
-from CTFd.models import Challenges, Solves, Awards, Users, Teams, db
+from CTFd.api import CTFd_API_v1
+from CTFd.models import Challenges, Solves, Users, Teams, db
 from CTFd.plugins import register_plugin_assets_directory
 from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
+from CTFd.plugins.migrations import upgrade
+from CTFd.utils import get_config, set_config
+from CTFd.utils.config.visibility import accounts_visible, scores_visible
+from CTFd.utils.dates import unix_time_to_utc
 from CTFd.utils.modes import get_model
 from CTFd.utils.humanize.numbers import ordinalize
 from CTFd.utils.plugins import register_stylesheet, register_admin_stylesheet
+from CTFd.utils.user import get_ip, is_admin
 
+from .allocator import (
+    RankAllocator,
+    mark_rank_counters_stale,
+    rank_drifted,
+    rank_solve,
+    reset_stale_rank_counters,
+    serialize_ranking,
+)
+from .api import first_blood_namespace
+from .archive import archive_challenges
+from .brackets import account_bracket, bracket_column, bracket_field, bracket_value
+from .bulk import delete_award_rows, hooks_suppressed
+from .cli import first_blood_cli
+from .eligibility import check_rules, eligibility_attributes, solver_eligibility_attributes
+from .eventlog import collect_award_events, write_award_events
+from .leases import acquire_lease, pop_dirty, release_leases
+from .models import FirstBloodChallenge, FirstBloodAward, FirstBloodAwardArchive, SolveRecord, award_text, ensure_columns, ensure_indexes
+from .notifications import FirstBloodAnnouncer, announce_first_blood
+from .profiling import profiled
+from .queries import (
+    account_first_blood_solves,
+    challenge_award_accounts,
+    challenge_awards,
+    challenge_solves,
+    solve_awards,
+)
+from .ranking import RankingCache, get_ranking, invalidate_rankings, invalidate_stale_rankings, mark_rankings_stale
+from .replica import discard_written, mark_written, read_session
+from .static import AssetBundle, static_blueprint
+from .summary import award_account_id, mark_accounts_for_refresh, refresh_summaries
 
-class FirstBloodChallenge(Challenges):
-    __mapper_args__ = {"polymorphic_identity": "firstblood"}
-    id = db.Column(
-        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), primary_key=True
-    )
-    first_blood_bonus = db.Column(db.JSON)
+log = logging.getLogger(__name__)
 
-    def __init__(self, *args, **kwargs):
-        # This is kind of a hack because serializeJSON in CTFd does not support arrays
-        first_blood_bonus = None
-        for attr, value in kwargs.items():
-            if attr.startswith('first_blood_bonus'):
-                first_blood_bonus = []
-        if first_blood_bonus is not None:
-            for i in itertools.count():
-                attr = 'first_blood_bonus[{0}]'.format(i)
-                if attr not in kwargs:
-                    break
-                first_blood_bonus.append(int(kwargs[attr]) if kwargs[attr] != '' else None)
-                del kwargs[attr]
-            while first_blood_bonus[-1] is None:
-                first_blood_bonus.pop()
-            kwargs['first_blood_bonus'] = first_blood_bonus
-    
-        super(FirstBloodChallenge, self).__init__(**kwargs)
-
-class FirstBloodAward(Awards):
-    __mapper_args__ = {"polymorphic_identity": "firstblood"}
-    id = db.Column(
-        db.Integer, db.ForeignKey("awards.id", ondelete="CASCADE"), primary_key=True
-    )
-    solve_id = db.Column(db.Integer, db.ForeignKey("solves.id", ondelete="RESTRICT"))  # It doesn't seem possible to do this well on the database level (FirstBloodAward always gets removed without the base Awards entry), so we do it on the application level
-    solve_num = db.Column(db.Integer, nullable=False)
-    
-    solve = db.relationship("Solves", foreign_keys="FirstBloodAward.solve_id", lazy="select")
 
 class FirstBloodValueChallenge(BaseChallenge):
     id = "firstblood"  # Unique identifier used to register challenges
@@ -58,6 +64,7 @@ class FirstBloodValueChallenge(BaseChallenge):
         "view": "/plugins/CTFd_first_blood/assets/view.html",
     }
     scripts = {  # Scripts that are loaded when a template is loaded
+        # (load() replaces them with their fingerprinted URLs)
         "create": "/plugins/CTFd_first_blood/assets/create.js",
         "update": "/plugins/CTFd_first_blood/assets/update.js",
         "view": "/plugins/CTFd_first_blood/assets/view.js",
@@ -83,6 +90,19 @@ class FirstBloodValueChallenge(BaseChallenge):
         """
         data = super().read(challenge)
         data['first_blood_bonus'] = challenge.first_blood_bonus
+        # The ranked solvers, for the solves list - cached, so that this doesn't query the solves on every view.
+        # Like the solves list itself, they are only shown when scores and accounts are visible, and not past the freeze.
+        data['first_blood_ranks'] = []
+        if not (scores_visible() and accounts_visible()):
+            return data
+        freeze = get_config("freeze")
+        frozen = unix_time_to_utc(int(freeze)) if freeze and not is_admin() else None
+        bonus_count = len(challenge.first_blood_bonus or [])
+        data['first_blood_ranks'] = [
+            {'account_id': solve.account_id, 'solve_num': solve.solve_num, 'label': ordinalize(solve.solve_num), 'bracket': solve.bracket}
+            for solve in get_ranking(challenge)
+            if solve.solve_num <= bonus_count and (frozen is None or solve.date < frozen)
+        ]
         return data
 
     @classmethod
@@ -96,6 +116,8 @@ class FirstBloodValueChallenge(BaseChallenge):
         """
         
         data = request.form or request.get_json()
+
+        hiding = challenge.state == 'visible' and data.get('state', 'visible') != 'visible'
         
         # This is kind of a hack because serializeJSON in CTFd does not support arrays
         first_blood_bonus = None
@@ -114,6 +136,12 @@ class FirstBloodValueChallenge(BaseChallenge):
                 first_blood_bonus.pop()
             setattr(challenge, 'first_blood_bonus', first_blood_bonus)
 
+        # Hiding a challenge removes its awards - with FIRST_BLOOD_ARCHIVE_ON_HIDE, they are archived first instead.
+        # Only once the update is applied, as archiving commits it
+        archive_on_hide = str(current_app.config.get("FIRST_BLOOD_ARCHIVE_ON_HIDE") or False).lower() not in ("0", "false", "no")
+        if hiding and archive_on_hide and not challenge.first_blood_archived:
+            archive_challenges([challenge.id])
+
         FirstBloodValueChallenge.recalculate_awards(challenge)
         db.session.commit()
         return challenge
@@ -125,117 +153,251 @@ class FirstBloodValueChallenge(BaseChallenge):
         :param challenge:
         :return:
         """
-        solve_ids = Solves.query.with_entities(Solves.id).filter_by(challenge_id=challenge.id).subquery()
-        award_ids = FirstBloodAward.query.with_entities(FirstBloodAward.id).filter(FirstBloodAward.solve_id.in_(solve_ids)).subquery()
-        Awards.query.filter(Awards.id.in_(award_ids)).delete(synchronize_session='fetch')
+        # Delete the awards in small batches, committing in between, so that we never hold locks on the awards
+        # table for long - a heavily solved challenge can have a lot of them
+        batch_size = int(current_app.config.get("FIRST_BLOOD_DELETE_BATCH_SIZE", 500))
+        awards = challenge_award_accounts(db.session, challenge.id, batch_size)
+        while True:
+            batch = awards.all()
+            if not batch:
+                break
+            delete_award_rows(db.session, [award.id for award in batch])
+            refresh_summaries(db.session, {award_account_id(award) for award in batch} - {None})
+            db.session.commit()
+        FirstBloodAwardArchive.query.filter_by(challenge_id=challenge.id).delete()
         super().delete(challenge)
+        invalidate_rankings([challenge.id])
     
     @classmethod
-    def _can_get_award(cls, challenge, solve):
-        # No awards for hidden challenges
-        if challenge.state != 'visible':
-            return False
-
-        # No awards for hidden users
-        Model = get_model()
-        solver = Model.query.filter_by(id=solve.account_id).first()
-        if solver.hidden or solver.banned:
-            return False
-        
-        return True
-    
-    @classmethod
-    def _gen_award_data(cls, challenge, solve, solve_num):
+    def _gen_award_data(cls, challenge, solve, solve_num, bracket=None):
         award_points = challenge.first_blood_bonus[solve_num - 1] if (solve_num - 1) < len(challenge.first_blood_bonus) else None
         if award_points is None:
             return None
 
+        name, description, icon = award_text(challenge.name, solve_num, bracket)
         return {
-            'user_id': solve.user.id if solve.user is not None else None,
-            'team_id': solve.team.id if solve.team is not None else None,
-            'name': '{0} blood for {1}'.format(ordinalize(solve_num), challenge.name),
-            'description': 'Bonus points for being the {0} to solve the challenge'.format(ordinalize(solve_num)),
+            'user_id': solve.user_id,
+            'team_id': solve.team_id,
+            'name': name,
+            'description': description,
             'category': 'First Blood',
             'date': solve.date,
             'value': award_points,
-            'icon': 'medal-{0}'.format(ordinalize(solve_num)) if solve_num <= 3 else 'medal',
+            'icon': icon,
             'solve_id': solve.id,
             'solve_num': solve_num,
+            'bracket': bracket,
         }
 
+    @classmethod
+    def _solve_records(cls, challenge, session=None):
+        """
+        The solves of the challenge that can get an award in solve order, as SolveRecords.
+        The eligibility rules are applied by the query (see eligibility.py) - only visible challenges that are not
+        archived give out awards.
+        """
+        if challenge.state != 'visible' or challenge.first_blood_archived:
+            return []
+        Model = get_model()
+
+        solves = challenge_solves(session or db.session, Model, bracket_column(Model), challenge.id)
+        return [
+            SolveRecord(id, user_id, team_id, date, bracket_value(bracket))
+            for id, user_id, team_id, date, bracket in solves
+        ]
+
     @classmethod
     def solve(cls, user, team, challenge, request):
-        super().solve(user, team, challenge, request)
-        
-        # Get the Solve object that was just inserted by solve() (that method should really return it :<)
-        solve = Solves.query.filter(Solves.challenge_id == challenge.id)
-        if user is not None:
-            solve = solve.filter(Solves.user_id == user.id)
-        if team is not None:
-            solve = solve.filter(Solves.team_id == team.id)
-        solve = solve.first()
-        
-        if FirstBloodValueChallenge._can_get_award(challenge, solve):
-            # Figure out the solve number
+        # Same as BaseChallenge.solve(), but the solve and its award are committed together, in one transaction
+        data = request.form or request.get_json()
+        submission = data["submission"].strip()
+        # No awards for hidden or archived challenges
+        ranked = challenge.state == 'visible' and not challenge.first_blood_archived
+        if ranked:
+            # Before the solve is written, so that solve ids follow the order in which the solves are ranked
+            serialize_ranking(db.session, challenge.id)
+        solve = Solves(
+            user_id=user.id,
+            team_id=team.id if team else None,
+            challenge_id=challenge.id,
+            ip=get_ip(req=request),
+            provided=submission,
+        )
+        db.session.add(solve)
+        # Flush to get the solve id (and date) for ranking it
+        db.session.flush()
+
+        award = None
+        solve_num = None
+        if ranked:
+            # Figure out the solve number (within the solver's bracket)
             Model = get_model()
 
-            solve_count = (
-                Solves.query.join(Model, Solves.account_id == Model.id)
-                .filter(
-                    Solves.id <= solve.id,
-                    Solves.challenge_id == challenge.id,
-                    Model.hidden == False,
-                    Model.banned == False,
-                )
-                .count()
-            )
+            bracket = None
+            raw_bracket = None
+            if bracket_field() is not None:
+                account = team if team is not None else user
+                bracket = account_bracket(account)
+                raw_bracket = getattr(account, bracket_field())
+            solve_num = rank_solve(db.session, Model, bracket_column(Model), challenge.id, solve.id, raw_bracket)
             
             # Insert the award into the database
-            award_data = FirstBloodValueChallenge._gen_award_data(challenge, solve, solve_count)
+            award_data = None
+            if solve_num is not None:
+                award_data = FirstBloodValueChallenge._gen_award_data(challenge, solve, solve_num, bracket)
             if award_data is not None:
                 award = FirstBloodAward(**award_data)
                 db.session.add(award)
-                db.session.commit()
+
+        db.session.commit()
+        if award is not None:
+            announce_first_blood(current_app, challenge, award)
+        # Make sure that the rank allocator (if any) agreed with the database
+        if solve_num is not None and rank_drifted(
+            db.session, Model, bracket_column(Model), challenge.id, solve.id, solve_num,
+            len(challenge.first_blood_bonus or []), raw_bracket
+        ):
+            # Recalculating also reseeds the counters
+            recalculate_awards_once(db.session, challenge)
+            db.session.commit()
 
     @classmethod
-    def recalculate_awards(cls, challenge):
+    @profiled("recalculate_awards")
+    def recalculate_awards(cls, challenge, session=None):
         """
         Recalculate all of the awards after challenge has been edited or solves/users were removed
         You have to call db.session.commit() manually after this!
         """
-        Model = get_model()
-        
-        solves = (
-            Solves.query.join(Model, Solves.account_id == Model.id)
-            .filter(Solves.challenge_id == challenge.id)
-            .order_by(Solves.id)
-            .all()
-        )
+        session = session or db.session
+        mark_rankings_stale(session, [challenge.id])
+        mark_rank_counters_stale(session, [challenge.id])
 
-        i = 0
-        for solve in solves:
-            award = FirstBloodAward.query.filter(FirstBloodAward.solve_id == solve.id).first()
+        # All the existing awards at once, instead of one query per solve
+        awards = {award.solve_id: award for award in challenge_awards(session, challenge.id)}
 
-            if FirstBloodValueChallenge._can_get_award(challenge, solve):
-                award_data = FirstBloodValueChallenge._gen_award_data(challenge, solve, i + 1)
-                i += 1
-            else:
-                award_data = None
+        # A single ordered scan ranks every bracket at once
+        solve_nums = collections.Counter()
+        for solve in FirstBloodValueChallenge._solve_records(challenge, session):
+            award = awards.pop(solve.id, None)
+
+            solve_nums[solve.bracket] += 1
+            award_data = FirstBloodValueChallenge._gen_award_data(challenge, solve, solve_nums[solve.bracket], solve.bracket)
 
             if award_data is not None:
                 if award is not None:
                     for k,v in award_data.items():
-                        setattr(award, k, v)
+                        # Only touch what changed, so unchanged awards don't show up as dirty
+                        if getattr(award, k) != v:
+                            setattr(award, k, v)
                 else:
                     award = FirstBloodAward(**award_data)
-                    db.session.add(award)
+                    session.add(award)
             else:
                 if award:
-                    db.session.delete(award)
+                    session.delete(award)
+
+        # Awards of solves that are not eligible (anymore), or by accounts that no longer exist
+        for award in awards.values():
+            session.delete(award)
+
+    @classmethod
+    def verify_awards(cls, challenge):
+        """
+        Check that the awards for this challenge match what recalculate_awards() would produce.
+        Returns a list of human readable problems (empty if everything is fine).
+        """
+        # A read-only scan, so it can run on the replica
+        with read_session() as session:
+            solves = FirstBloodValueChallenge._solve_records(challenge, session)
+            awards = challenge_awards(session, challenge.id).all()
+
+        problems = []
+        bonus = challenge.first_blood_bonus or []
+        solve_nums_by_bracket = collections.defaultdict(list)
+        for award in awards:
+            solve_nums_by_bracket[award.bracket].append(award.solve_num)
+        for bracket, solve_nums in solve_nums_by_bracket.items():
+            where = " in bracket {0}".format(bracket) if bracket is not None else ""
+            if len(solve_nums) != len(set(solve_nums)):
+                problems.append("duplicate solve_num values{0}: {1}".format(where, sorted(solve_nums)))
+            # The awards should hold the first ranks that have a bonus - ranks without one have no award
+            expected = [n for n, points in enumerate(bonus, 1) if points is not None][:len(solve_nums)]
+            if sorted(solve_nums) != expected:
+                problems.append("solve_num values have gaps{0}: {1}, expected {2}".format(where, sorted(solve_nums), expected))
+
+        awards_by_solve = {award.solve_id: award for award in awards}
+        solve_nums = collections.Counter()
+        for solve in solves:
+            bracket = solve.bracket
+            award = awards_by_solve.pop(solve.id, None)
+            solve_nums[bracket] += 1
+            expected = FirstBloodValueChallenge._gen_award_data(challenge, solve, solve_nums[bracket], bracket)
+            if expected is None:
+                if award is not None:
+                    problems.append("solve {0} should not have an award".format(solve.id))
+            elif award is None:
+                problems.append("solve {0} is missing its {1} blood award".format(solve.id, ordinalize(solve_nums[bracket])))
+            elif award.bracket != expected["bracket"]:
+                problems.append("solve {0} has an award in bracket {1}, expected {2}".format(solve.id, award.bracket, expected["bracket"]))
+            elif award.solve_num != expected["solve_num"] or award.value != expected["value"]:
+                problems.append("solve {0} has award #{1} ({2} points), expected #{3} ({4} points)".format(
+                    solve.id, award.solve_num, award.value, expected["solve_num"], expected["value"]))
+        for solve_id in awards_by_solve:
+            problems.append("award for solve {0} does not belong to any eligible solve".format(solve_id))
+        return problems
+
+
+# How many times a recalculation goes again when its challenges were marked dirty while it recalculated them
+DIRTY_ROUNDS = 3
+
+
+def recalculate_awards_once(session, challenge):
+    """
+    Recalculate the awards of a challenge, unless another worker is recalculating it right now - in that case the
+    challenge is only marked dirty, and the worker holding the lease recalculates it again once it's done
+    """
+    if not acquire_lease(session, challenge.id):
+        return False
+    FirstBloodValueChallenge.recalculate_awards(challenge, session)
+    for _ in range(DIRTY_ROUNDS):
+        if not pop_dirty(challenge.id):
+            break
+        FirstBloodValueChallenge.recalculate_awards(challenge, session)
+    return True
+
+
+def recalculate_dirty(challenge_ids):
+    """
+    Recalculate challenges that changed after (or while) they were last recalculated, each round in a transaction of
+    its own - release_leases() hands them out when a transaction ends, and no SQL can be run on that session then.
+    Anything left dirty is picked up by the next recalculation of the challenge.
+    """
+    for _ in range(DIRTY_ROUNDS):
+        if not challenge_ids:
+            return
+        session = db.session.session_factory()
+        session.first_blood_dirty_round = True
+        try:
+            for challenge in session.query(FirstBloodChallenge).filter(FirstBloodChallenge.id.in_(challenge_ids)):
+                recalculate_awards_once(session, challenge)
+            session.commit()
+            challenge_ids = getattr(session, 'first_blood_dirty', [])
+        except Exception:
+            session.rollback()
+            log.exception("Could not recalculate the first blood awards of challenges %s", challenge_ids)
+            return
+        finally:
+            session.close()
+
+
+# Maximum number of ids in one IN (...) when deleting the awards of deleted solves
+DELETED_SOLVES_CHUNK_SIZE = 500
 
 
 @event.listens_for(Session, "after_bulk_delete")
 def after_bulk_delete(delete_context):
+    if hooks_suppressed(delete_context.session):
+        return
     if delete_context.primary_table.name == "solves":
         # A batch delete of solves just occured
         # This usually means that CTFd is removing a user account
@@ -243,63 +405,194 @@ def after_bulk_delete(delete_context):
         
         # Mark ALL first blood challenges for recalculation
         # TODO: It would probably be better to detect which solves got removed and which challenges are affected - but before_bulk_delete doesn't seem to be a thing and the rows are already removed by now
-        for challenge in Challenges.query.filter_by(type="firstblood").all():
-            FirstBloodValueChallenge.recalculate_awards(challenge)
+        # One challenge at a time, writing its changes out before the next one: an unflushed award is held by the
+        # session, so with every challenge recalculated first, all the changed awards of the event are in memory at once
+        session = delete_context.session
+        challenge_ids = [challenge_id for challenge_id, in session.query(Challenges.id).filter_by(type="firstblood")]
+        for challenge_id in challenge_ids:
+            recalculate_awards_once(session, session.query(Challenges).get(challenge_id))
+            session.flush()
 
 @event.listens_for(Session, "before_flush")
+@profiled("before_flush")
 def before_flush(session, flush_context, instances):
+    if hooks_suppressed(session):
+        return
     Model = get_model()
 
+    # Keep the per-account summaries in sync with the awards changed by this flush
+    for instance in itertools.chain(session.new, session.deleted, session.dirty):
+        if isinstance(instance, FirstBloodAward):
+            mark_accounts_for_refresh(session, [award_account_id(instance)])
+
+    # Any added or removed solve can change the cached ranking of its challenge
+    mark_rankings_stale(session, [
+        instance.challenge_id for instance in itertools.chain(session.new, session.deleted) if isinstance(instance, Solves)
+    ])
+
+    # Solves have been deleted - delete the awards associated with them, all at once
+    deleted_solves = {instance.id: instance for instance in session.deleted if isinstance(instance, Solves)}
+    if deleted_solves:
+        awarded = {}
+        solve_ids = list(deleted_solves)
+        for i in range(0, len(solve_ids), DELETED_SOLVES_CHUNK_SIZE):
+            chunk = solve_ids[i:i + DELETED_SOLVES_CHUNK_SIZE]
+            awarded.update(solve_awards(session, chunk))
+        award_ids = list(awarded)
+        for i in range(0, len(award_ids), DELETED_SOLVES_CHUNK_SIZE):
+            delete_award_rows(session, award_ids[i:i + DELETED_SOLVES_CHUNK_SIZE])
+        # Mark the awards of the affected challenges for recalculation. Ranks without a bonus (gaps in the bonus
+        # list) have no award to find the solve by, so a removed solve may also have held one of those - and the
+        # solves after it move up
+        solves = [deleted_solves[solve_id] for solve_id in set(awarded.values())]
+        awarded_challenge_ids = {solve.challenge_id for solve in solves}
+        affected = [
+            challenge
+            for challenge in FirstBloodChallenge.query.filter(
+                FirstBloodChallenge.id.in_({solve.challenge_id for solve in deleted_solves.values()})
+            )
+            if challenge.id in awarded_challenge_ids or None in (challenge.first_blood_bonus or [])
+        ]
+        if affected:
+            if not hasattr(session, 'requires_award_recalculation'):
+                session.requires_award_recalculation = set()
+            session.requires_award_recalculation.update(affected)
+        mark_accounts_for_refresh(session, [solve.account_id for solve in solves])
+
     for instance in session.deleted:
-        if isinstance(instance, Solves):
-            # A solve has been deleted - delete any awards associated with this solve
-            award_ids = FirstBloodAward.query.with_entities(FirstBloodAward.id).filter(FirstBloodAward.solve_id == instance.id).subquery()
-            rowcount = Awards.query.filter(Awards.id.in_(award_ids)).delete(synchronize_session='fetch')
-            if rowcount > 0:
-                # Mark the awards for this challenge for recalculation
-                if not hasattr(session, 'requires_award_recalculation'):
-                    session.requires_award_recalculation = set()
-                session.requires_award_recalculation.add(Challenges.query.get(instance.challenge_id))
-        if isinstance(instance, Users):
-            # A user has been deleted - mark all challenges where this user had awards for recalculation
-            # NOTE: This doesn't seem to be used by CTFd - see after_bulk_delete
-            for award in FirstBloodAward.query.join(Users, FirstBloodAward.user_id == Users.id).filter(Users.id == instance.id).all():
-                if not hasattr(session, 'requires_award_recalculation'):
-                    session.requires_award_recalculation = set()
-                session.requires_award_recalculation.add(award.solve.challenge)
-                session.delete(award)
-        if isinstance(instance, Teams):
-            # A team has been deleted - mark all challenges where this team had awards for recalculation
-            for award in FirstBloodAward.query.join(Teams, FirstBloodAward.team_id == Teams.id).filter(Teams.id == instance.id).all():
+        if isinstance(instance, (Users, Teams)):
+            # A user or team has been deleted - remove its awards and mark their challenges for recalculation. Only the
+            # ids are loaded, not the awards and their solves and challenges
+            # NOTE: Deleting users this way doesn't seem to be used by CTFd - see after_bulk_delete
+            column = FirstBloodAward.user_id if isinstance(instance, Users) else FirstBloodAward.team_id
+            awards = (
+                session.query(FirstBloodAward.id, FirstBloodAward.user_id, FirstBloodAward.team_id, Solves.challenge_id)
+                .join(Solves, FirstBloodAward.solve_id == Solves.id)
+                .filter(column == instance.id)
+                .all()
+            )
+            if awards:
+                delete_award_rows(session, [award.id for award in awards])
                 if not hasattr(session, 'requires_award_recalculation'):
                     session.requires_award_recalculation = set()
-                session.requires_award_recalculation.add(award.solve.challenge)
-                session.delete(award)
+                session.requires_award_recalculation.update(
+                    Challenges.query.filter(Challenges.id.in_({award.challenge_id for award in awards})).all()
+                )
+                mark_accounts_for_refresh(session, [award_account_id(award) for award in awards])
 
+    # The account attributes that eligibility and brackets depend on
+    watched = {attribute for attribute in eligibility_attributes() if hasattr(Model, attribute)}
+    if bracket_field() is not None:
+        watched.add(bracket_field())
+    # And the attributes of the user who submitted a solve - in teams mode, those of a team member
+    solver_watched = solver_eligibility_attributes()
+    if Model is Users:
+        watched |= solver_watched
+        solver_watched = set()
     for instance in session.dirty:
         if session.is_modified(instance):
+            account_id = None
             if isinstance(instance, Model):
-                if get_history(instance, "hidden").has_changes() or get_history(instance, "banned").has_changes():
-                    # The user/team hidden state has changed - update awards on all challenges this user has solved
-                    for solve in Solves.query.join(Challenges, Solves.challenge_id == Challenges.id).filter(Solves.account_id == instance.id, Challenges.type == "firstblood"):
-                        if not hasattr(session, 'requires_award_recalculation'):
-                            session.requires_award_recalculation = set()
-                        session.requires_award_recalculation.add(solve.challenge)
+                if any(get_history(instance, attribute).has_changes() for attribute in watched):
+                    # The user/team eligibility or bracket has changed - update awards on all challenges this user has solved
+                    account_id = instance.id
+            elif isinstance(instance, Users) and instance.team_id is not None:
+                if any(get_history(instance, attribute).has_changes() for attribute in solver_watched):
+                    # A team member's eligibility has changed - update awards on all challenges the team has solved
+                    account_id = instance.team_id
+            if account_id is not None:
+                for solve in account_first_blood_solves(session, account_id):
+                    if not hasattr(session, 'requires_award_recalculation'):
+                        session.requires_award_recalculation = set()
+                    session.requires_award_recalculation.add(solve.challenge)
+
+    # Log all awards granted, shifted or revoked through the session (including the ones deleted above)
+    collect_award_events(session)
 
 @event.listens_for(Session, "after_flush_postexec")
+@profiled("after_flush_postexec")
 def after_flush_postexec(session, flush_context):
+    if hooks_suppressed(session):
+        return
     if hasattr(session, 'requires_award_recalculation') and session.requires_award_recalculation:
         # Recalculate any challenges whose awards were invalidated by this commit
         for challenge in session.requires_award_recalculation:
-            FirstBloodValueChallenge.recalculate_awards(challenge)
+            recalculate_awards_once(session, challenge)
         del session.requires_award_recalculation
+    if hasattr(session, 'requires_summary_refresh') and session.requires_summary_refresh:
+        # Rebuild the summaries of accounts whose awards were changed by this flush
+        refresh_summaries(session, session.requires_summary_refresh)
+        del session.requires_summary_refresh
+    write_award_events(session)
+
+
+@event.listens_for(Session, "after_commit")
+def note_committed_writes(session):
+    # Before the rankings are invalidated below, so that the writer doesn't re-read them from a replica that lags behind
+    mark_written(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def discard_rolled_back_writes(session):
+    discard_written(session)
+
+
+def release_recalculation_leases(session, committed):
+    dirty = release_leases(session, committed)
+    invalidate_stale_rankings(session)
+    reset_stale_rank_counters(session)
+    if getattr(session, 'first_blood_dirty_round', False):
+        # Handed back to the loop of recalculate_dirty() instead of nesting another one
+        session.first_blood_dirty = dirty
+    else:
+        recalculate_dirty(dirty)
+
+
+@event.listens_for(Session, "after_commit")
+def release_committed_leases(session):
+    release_recalculation_leases(session, committed=True)
+
+
+@event.listens_for(Session, "after_rollback")
+def release_rolled_back_leases(session):
+    release_recalculation_leases(session, committed=False)
+
+
+# The newest revision in migrations/ - bump this whenever a migration is added
+SCHEMA_REVISION = "c5d2e8a4b193"
+PLUGIN_NAME = os.path.basename(os.path.dirname(__file__))
+
 
 def load(app):
-    app.db.create_all()
+    check_rules(app)
+    # Only touch the schema if it is not current already - with many workers starting at once against a remote
+    # database, running DDL or reflecting the schema on every boot is expensive
+    version_key = "{0}_alembic_version".format(PLUGIN_NAME)
+    if get_config(version_key) != SCHEMA_REVISION:
+        upgrade(plugin_name=PLUGIN_NAME)
+        # CTFd only runs create_all() on SQLite instead of the migrations (which doesn't add columns or indexes to
+        # existing tables), and doesn't record the version then
+        if get_config(version_key) != SCHEMA_REVISION:
+            ensure_columns(db.engine)
+            ensure_indexes(db.engine)
+            set_config(version_key, SCHEMA_REVISION)
     app.jinja_env.filters.update(ordinalize=ordinalize)
+    app.extensions["first_blood_announcer"] = FirstBloodAnnouncer.from_config(app)
+    app.extensions["first_blood_rankings"] = RankingCache.from_config(app)
+    app.extensions["first_blood_rank_allocator"] = RankAllocator.from_config(app)
+    if app.extensions["first_blood_rank_allocator"] is not None:
+        # Reseed all rank counters from the database, whatever happened while CTFd was down
+        app.extensions["first_blood_rank_allocator"].start()
+    CTFd_API_v1.add_namespace(first_blood_namespace, "/firstblood")
+    app.cli.add_command(first_blood_cli)
     CHALLENGE_CLASSES["firstblood"] = FirstBloodValueChallenge
     register_plugin_assets_directory(
         app, base_path="/plugins/CTFd_first_blood/assets/"
     )
-    register_stylesheet("/plugins/CTFd_first_blood/assets/award-icons.css")
-    register_admin_stylesheet("/plugins/CTFd_first_blood/assets/award-icons.css")
+    # The scripts and stylesheet are loaded from fingerprinted URLs that browsers cache for good. The templates keep
+    # their paths, CTFd renders them on the server through its template loader.
+    assets = app.extensions["first_blood_assets"] = AssetBundle()
+    app.register_blueprint(static_blueprint)
+    FirstBloodValueChallenge.scripts = {page: assets.url(page + ".js") for page in ("create", "update", "view")}
+    register_stylesheet(assets.url("award-icons.css"))
+    register_admin_stylesheet(assets.url("award-icons.css"))
@@ -0,0 +1,193 @@
+import logging
+import threading
+import uuid
+
+from flask import current_app
+
+from CTFd.cache import cache
+
+from .queries import count_eligible_solves, is_eligible_solve, lock_challenge, session_of
+
+log = logging.getLogger(__name__)
+
+# Counters that aren't used for this long are dropped, and reseeded from the database when they are needed again
+COUNTER_TIMEOUT = 24 * 60 * 60
+
+EPOCH_KEY = "first_blood_rank_epoch"
+
+
+def _generation_key(challenge_id):
+    return "first_blood_rank_generation_{0}".format(challenge_id)
+
+
+class LocalCounters(object):
+    """
+    In-process stand-in for the cache operations the allocator uses, for a single worker and for tests
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, *keys):
+        with self._lock:
+            return [self._values.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._values[key] = value
+        return True
+
+    def add(self, key, value, timeout=None):
+        with self._lock:
+            if key in self._values:
+                return False
+            self._values[key] = value
+        return True
+
+    def has(self, key):
+        with self._lock:
+            return key in self._values
+
+    def inc(self, key, delta=1):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + delta
+            return self._values[key]
+
+
+class RankAllocator(object):
+    """
+    Hands out the solve numbers of a challenge (per bracket) from an atomic counter, instead of counting the earlier
+    solves in the database for every submission. With the CTFd cache on Redis, the counter is shared by all workers.
+
+    A counter is seeded from the database the first time it is used. The counter keys contain an epoch, which is
+    renewed when CTFd starts, and a per-challenge generation, which is renewed whenever the challenge's awards are
+    recalculated - either way the counters are reseeded, so they can't drift from the database for long.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    @classmethod
+    def from_config(cls, app):
+        """
+        FIRST_BLOOD_RANK_ALLOCATOR is "cache" (the CTFd cache - Redis with multiple workers), "local" (in-process,
+        only for a single worker) or unset, to always count in the database
+        """
+        kind = app.config.get("FIRST_BLOOD_RANK_ALLOCATOR")
+        if not kind:
+            return None
+        if kind == "cache":
+            return cls(cache)
+        if kind == "local":
+            return cls(LocalCounters())
+        raise ValueError("Unknown FIRST_BLOOD_RANK_ALLOCATOR: {0}".format(kind))
+
+    def start(self):
+        self.store.set(EPOCH_KEY, uuid.uuid4().hex, timeout=0)
+
+    def reset(self, challenge_ids):
+        for challenge_id in challenge_ids:
+            self.store.set(_generation_key(challenge_id), uuid.uuid4().hex, timeout=0)
+
+    def _counter_key(self, challenge_id, bracket):
+        epoch, generation = self.store.get_many(EPOCH_KEY, _generation_key(challenge_id))
+        return "first_blood_rank_{0}_{1}_{2}_{3}".format(epoch, challenge_id, generation, bracket)
+
+    def allocate(self, challenge_id, bracket, seed):
+        """
+        The next solve number of the challenge in the bracket. seed() is the number of solves ranked so far
+        according to the database, and is only called if the counter doesn't exist yet.
+        """
+        key = self._counter_key(challenge_id, bracket)
+        if not self.store.has(key):
+            # If another worker seeds the counter at the same time, only one of them sets it
+            self.store.add(key, seed(), timeout=COUNTER_TIMEOUT)
+        return self.store.inc(key)
+
+    def claim_check(self, challenge_id, bracket):
+        """
+        True only for the first caller for the current counter of the challenge in the bracket
+        """
+        return self.store.add(self._counter_key(challenge_id, bracket) + "_checked", True, timeout=COUNTER_TIMEOUT)
+
+
+def _allocator():
+    return current_app.extensions.get("first_blood_rank_allocator")
+
+
+def serialize_ranking(session, challenge_id):
+    """
+    Called before a solve of the challenge is written. Without a rank allocator, the solve is ranked by counting the
+    earlier solves in the database, which doesn't see the solves of transactions that haven't committed yet - two
+    concurrent solves would get the same rank. So the challenge row is locked until the end of the transaction, and
+    the solves of a challenge are written, ranked and committed one at a time. SQLite ignores the lock, but it only
+    lets one transaction write at a time anyway. The allocator hands out ranks atomically, so it needs no lock.
+    """
+    if _allocator() is None:
+        lock_challenge(session, challenge_id)
+
+
+def rank_solve(session, Model, bracket, challenge_id, solve_id, bracket_value=None):
+    """
+    The solve number of a freshly flushed solve within its bracket, or None if it can't get an award.
+    From the rank allocator if one is configured, otherwise (or if the allocator fails) from the database.
+    """
+    allocator = _allocator()
+    if allocator is not None:
+        try:
+            if not is_eligible_solve(session, Model, solve_id):
+                return None
+            # The solves before this one - the database sees our own solve already
+            seed = lambda: count_eligible_solves(session, Model, bracket, challenge_id, solve_id, bracket_value)[0] - 1
+            return allocator.allocate(challenge_id, bracket_value, seed)
+        except Exception:
+            log.exception("Could not allocate a first blood rank for solve %s, counting in the database", solve_id)
+    # After serialize_ranking() waited for the solves before this one to commit - the count has to see them
+    solve_count, last_solve_id = count_eligible_solves(
+        session, Model, bracket, challenge_id, solve_id, bracket_value, locking=True
+    )
+    return solve_count if last_solve_id == solve_id else None
+
+
+def rank_drifted(session, Model, bracket, challenge_id, solve_id, solve_num, max_rank, bracket_value=None):
+    """
+    Whether the database disagrees with the solve number allocated to a committed solve. Concurrent solves can take
+    their numbers in a different order than their solve ids, which recalculating (by solve id) would silently swap,
+    so every solve numbered up to max_rank (the number of bonuses) is checked. Past that, only the first solve per
+    counter is checked, which catches a counter that ran ahead - no rank after that matters. A mismatch can also come
+    from solves that are not committed yet, in which case reconciling is merely unnecessary.
+    """
+    allocator = _allocator()
+    if allocator is None:
+        return False
+    if solve_num > max_rank and not allocator.claim_check(challenge_id, bracket_value):
+        return False
+    solve_count, _ = count_eligible_solves(session, Model, bracket, challenge_id, solve_id, bracket_value)
+    return solve_count != solve_num
+
+
+def mark_rank_counters_stale(session, challenge_ids):
+    """
+    Reseed the rank counters of these challenges now, and again when the transaction ends - until then, other workers
+    can still seed them from the old state
+    """
+    allocator = _allocator()
+    challenge_ids = set(challenge_ids)
+    if allocator is None or not challenge_ids:
+        return
+    session = session_of(session)
+    allocator.reset(challenge_ids)
+    if not hasattr(session, 'stale_rank_counters'):
+        session.stale_rank_counters = set()
+    session.stale_rank_counters.update(challenge_ids)
+
+
+def reset_stale_rank_counters(session):
+    stale = getattr(session, 'stale_rank_counters', None)
+    if not stale:
+        return
+    del session.stale_rank_counters
+    allocator = _allocator()
+    if allocator is not None:
+        allocator.reset(stale)
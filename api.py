@@ -0,0 +1,67 @@
+from flask import Response, abort, request, stream_with_context
+from flask_restx import Namespace, Resource
+
+from CTFd.models import db
+from CTFd.utils.decorators import admins_only
+from CTFd.utils.decorators.visibility import check_account_visibility, check_score_visibility
+from CTFd.utils.modes import get_model
+from CTFd.utils.user import is_admin
+
+from .export import EXPORT_FORMATS, iter_export
+from .models import FirstBloodChallenge
+from .ranking import preview_award_changes
+from .summary import get_summary, rebuild_summaries
+
+first_blood_namespace = Namespace("firstblood", description="Endpoint to retrieve first blood statistics")
+
+
+@first_blood_namespace.route("/accounts/<int:account_id>/summary")
+@first_blood_namespace.param("account_id", "A User ID or Team ID, depending on the user mode")
+class FirstBloodAccountSummary(Resource):
+    @check_account_visibility
+    @check_score_visibility
+    def get(self, account_id):
+        Model = get_model()
+        account = Model.query.filter_by(id=account_id).first_or_404()
+        if (account.banned or account.hidden) and is_admin() is False:
+            abort(404)
+        return {"success": True, "data": get_summary(account.id)}
+
+
+@first_blood_namespace.route("/summary/rebuild")
+class FirstBloodSummaryRebuild(Resource):
+    @admins_only
+    def post(self):
+        rebuild_summaries()
+        db.session.commit()
+        return {"success": True}
+
+
+@first_blood_namespace.route("/export")
+class FirstBloodExport(Resource):
+    @admins_only
+    @first_blood_namespace.doc(params={"format": "csv (default) or jsonl"})
+    def get(self):
+        fmt = request.args.get("format", "csv")
+        if fmt not in EXPORT_FORMATS:
+            return {"success": False, "errors": {"format": "Unknown export format"}}, 400
+        return Response(
+            stream_with_context(iter_export(fmt)),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={"Content-Disposition": "attachment; filename=first_blood.{0}".format(fmt)},
+        )
+
+
+@first_blood_namespace.route("/challenges/<int:challenge_id>/preview")
+@first_blood_namespace.param("challenge_id", "A first blood challenge ID")
+class FirstBloodAwardPreview(Resource):
+    @admins_only
+    def post(self, challenge_id):
+        """Show how the awards would change with another bonus list, without changing anything"""
+        challenge = FirstBloodChallenge.query.filter_by(id=challenge_id).first_or_404()
+        first_blood_bonus = (request.get_json() or {}).get("first_blood_bonus")
+        if not isinstance(first_blood_bonus, list) or not all(
+            bonus is None or (isinstance(bonus, int) and not isinstance(bonus, bool)) for bonus in first_blood_bonus
+        ):
+            return {"success": False, "errors": {"first_blood_bonus": "Expected a list of integers"}}, 400
+        return {"success": True, "data": preview_award_changes(challenge, first_blood_bonus)}
@@ -0,0 +1,156 @@
+from flask import current_app
+
+from CTFd.models import Solves, db
+
+from .bulk import delete_award_rows, insert_awards
+from .models import FirstBloodAwardArchive, FirstBloodChallenge, award_text
+from .queries import challenge_award_rows
+from .ranking import mark_rankings_stale
+from .summary import award_account_id, refresh_summaries
+
+
+def _batch_size():
+    return int(current_app.config.get("FIRST_BLOOD_ARCHIVE_BATCH_SIZE", 500))
+
+
+def _set_archived(session, challenge_ids, archived):
+    challenges = FirstBloodChallenge.__table__
+    session.execute(challenges.update().where(challenges.c.id.in_(challenge_ids)).values(first_blood_archived=archived))
+    # The flush hooks don't see a Core update
+    mark_rankings_stale(session, challenge_ids)
+
+
+def retired_challenge_ids(session=None):
+    """
+    The first blood challenges that are hidden and not archived yet
+    """
+    session = session or db.session
+    return [
+        challenge_id for challenge_id, in session.query(FirstBloodChallenge.id)
+        .filter(FirstBloodChallenge.state != 'visible', FirstBloodChallenge.first_blood_archived == False)
+        .order_by(FirstBloodChallenge.id)
+    ]
+
+
+def archive_challenges(challenge_ids, session=None):
+    """
+    Move the first blood awards of the challenges into first_blood_award_archive, in batches of
+    FIRST_BLOOD_ARCHIVE_BATCH_SIZE (default 500), committing in between so that the awards tables are never locked
+    for long. The challenges are marked archived first, so they don't give out awards until they are restored.
+    Returns the number of archived awards.
+    """
+    session = session or db.session
+    challenge_ids = sorted(set(challenge_ids))
+    if not challenge_ids:
+        return 0
+    _set_archived(session, challenge_ids, True)
+    session.commit()
+
+    archive = FirstBloodAwardArchive.__table__
+    count = 0
+    for challenge_id in challenge_ids:
+        awards = challenge_award_rows(session, challenge_id, _batch_size())
+        while True:
+            batch = awards.all()
+            if not batch:
+                break
+            session.execute(archive.insert(), [
+                {
+                    'challenge_id': challenge_id,
+                    'solve_id': award.solve_id,
+                    'user_id': award.user_id,
+                    'team_id': award.team_id,
+                    'solve_num': award.solve_num,
+                    'bracket': award.bracket,
+                    'value': award.value,
+                    'date': award.date,
+                }
+                for award in batch
+            ])
+            # Nothing is revoked - the event log keeps the awards, and replays skip archived challenges
+            delete_award_rows(session, [award.id for award in batch], log=False)
+            refresh_summaries(session, {award_account_id(award) for award in batch} - {None})
+            session.commit()
+            count += len(batch)
+    return count
+
+
+def restore_challenges(challenge_ids, session=None):
+    """
+    Move the archived awards of the challenges back into the awards tables, in batches like archive_challenges(),
+    and let the challenges give out awards again. Awards whose solve no longer exists are dropped. The challenges
+    are then recalculated, as accounts may have been hidden or banned while they were archived.
+    Hidden challenges give out no awards, so they stay archived until they are made visible.
+    Returns the number of restored awards.
+    """
+    # Imported here to avoid a circular import - the challenge type imports this module
+    from . import FirstBloodValueChallenge
+
+    session = session or db.session
+    challenges = {
+        challenge.id: challenge
+        for challenge in FirstBloodChallenge.query.filter(
+            FirstBloodChallenge.id.in_(set(challenge_ids)),
+            FirstBloodChallenge.state == 'visible',
+            FirstBloodChallenge.first_blood_archived == True,
+        )
+    }
+    if not challenges:
+        return 0
+    names = {challenge_id: challenge.name for challenge_id, challenge in challenges.items()}
+
+    archive = FirstBloodAwardArchive.__table__
+    rows = (
+        session.query(
+            FirstBloodAwardArchive.id,
+            FirstBloodAwardArchive.challenge_id,
+            FirstBloodAwardArchive.solve_id,
+            FirstBloodAwardArchive.user_id,
+            FirstBloodAwardArchive.team_id,
+            FirstBloodAwardArchive.solve_num,
+            FirstBloodAwardArchive.bracket,
+            FirstBloodAwardArchive.value,
+            FirstBloodAwardArchive.date,
+            Solves.id.label("existing_solve_id"),
+        )
+        .outerjoin(Solves, FirstBloodAwardArchive.solve_id == Solves.id)
+        .filter(FirstBloodAwardArchive.challenge_id.in_(challenges))
+        .order_by(FirstBloodAwardArchive.id)
+        .limit(_batch_size())
+    )
+    count = 0
+    while True:
+        batch = rows.all()
+        if not batch:
+            break
+        restored = [award for award in batch if award.existing_solve_id is not None]
+
+        def awards():
+            for award in restored:
+                name, description, icon = award_text(names[award.challenge_id], award.solve_num, award.bracket)
+                yield award.challenge_id, {
+                    'user_id': award.user_id,
+                    'team_id': award.team_id,
+                    'name': name,
+                    'description': description,
+                    'category': 'First Blood',
+                    'date': award.date,
+                    'value': award.value,
+                    'icon': icon,
+                    'solve_id': award.solve_id,
+                    'solve_num': award.solve_num,
+                    'bracket': award.bracket,
+                }
+
+        # The database assigns the award ids, as solves may be creating awards at the same time
+        count += insert_awards(session, awards(), log=False, allocate_ids=False)
+        session.execute(archive.delete().where(archive.c.id.in_([award.id for award in batch])))
+        refresh_summaries(session, {award_account_id(award) for award in restored} - {None})
+        session.commit()
+
+    _set_archived(session, list(challenges), False)
+    session.commit()
+    for challenge in FirstBloodChallenge.query.filter(FirstBloodChallenge.id.in_(challenges)):
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+    session.commit()
+    return count
@@ -11,26 +11,14 @@ CTFd._internal.challenge.render = function (markdown) {
 
 
 CTFd._internal.challenge.postRender = function () {
-    // https://stackoverflow.com/questions/13627308/add-st-nd-rd-and-th-ordinal-suffix-to-a-number/13627586#13627586
-    function ordinalize(i) {
-        var j = i % 10,
-            k = i % 100;
-        if (j == 1 && k != 11) {
-            return i + "st";
-        }
-        if (j == 2 && k != 12) {
-            return i + "nd";
-        }
-        if (j == 3 && k != 13) {
-            return i + "rd";
-        }
-        return i + "th";
-    }
-    
     function getSolves(id) {
       return CTFd.api.get_challenge_solves({ challengeId: id }).then(response => {
         const first_blood_bonus = CTFd._internal.challenge.data.first_blood_bonus;
-        console.log(first_blood_bonus);
+        // The ranks come with their labels ("1st", "2nd", ...) from the server
+        const ranks = {};
+        for (const rank of CTFd._internal.challenge.data.first_blood_ranks) {
+          ranks[rank.account_id] = rank;
+        }
         const data = response.data;
         
         $(".challenge-solves").text(parseInt(data.length) + " Solves");
@@ -47,12 +35,13 @@ CTFd._internal.challenge.postRender = function () {
           
           const tr = $('<tr>');
           const td1 = $('<td style="width: 10%;">');
-          if (i < first_blood_bonus.length) {
-              let text = '<b>' + ordinalize(i + 1) + '</b>';
-              if (first_blood_bonus[i])
-                  text += ' (+' + first_blood_bonus[i] + ')';
-              if (i < 3)
-                  text = '<span class="award-icon award-medal-' + ordinalize(i+1) + '"></span>' + text;
+          const rank = ranks[id];
+          if (rank !== undefined) {
+              let text = '<b>' + rank.label + '</b>';
+              if (first_blood_bonus[rank.solve_num - 1])
+                  text += ' (+' + first_blood_bonus[rank.solve_num - 1] + ')';
+              if (rank.solve_num <= 3)
+                  text = '<span class="award-icon award-medal-' + rank.label + '"></span>' + text;
               else
                   text = '<span class="award-icon award-medal"></span>' + text;
               td1.html(text);
@@ -0,0 +1,24 @@
+from flask import current_app
+
+
+def bracket_field():
+    """
+    The account attribute whose value splits the first blood ranking into brackets (e.g. "bracket_id",
+    "affiliation" or "country"), from the FIRST_BLOOD_BRACKET_FIELD config. None if there is a single ranking.
+    """
+    return current_app.config.get("FIRST_BLOOD_BRACKET_FIELD") or None
+
+
+def bracket_column(Model):
+    field = bracket_field()
+    return getattr(Model, field) if field is not None else None
+
+
+def bracket_value(value):
+    # Brackets are stored as strings, whatever the type of the account attribute is
+    return str(value) if value is not None else None
+
+
+def account_bracket(account):
+    field = bracket_field()
+    return bracket_value(getattr(account, field)) if field is not None else None
@@ -0,0 +1,270 @@
+import contextlib
+import datetime
+
+from sqlalchemy import func, literal, select
+
+from CTFd.models import Awards, Solves, Submissions, db
+from CTFd.utils.modes import get_model
+
+from .allocator import mark_rank_counters_stale
+from .brackets import bracket_column, bracket_value
+from .eligibility import eligible_solve
+from .eventlog import GRANT, log_revoked_awards
+from .models import FirstBloodAward, FirstBloodAwardEvent, FirstBloodChallenge
+from .queries import session_of
+from .ranking import mark_rankings_stale
+from .replica import note_write
+from .summary import rebuild_summaries
+
+# Number of rows sent to the database in a single executemany()
+BATCH_SIZE = 10000
+
+
+@contextlib.contextmanager
+def import_mode(session=None):
+    """
+    Disable the per-solve award hooks for this session, e.g. while importing solves in bulk.
+    Call generate_awards() afterwards to create the awards for everything that was imported.
+    """
+    session = session_of(session or db.session)
+    previous = hooks_suppressed(session)
+    session.first_blood_hooks_suppressed = True
+    try:
+        yield session
+    finally:
+        session.first_blood_hooks_suppressed = previous
+
+
+def hooks_suppressed(session):
+    return getattr(session_of(session), 'first_blood_hooks_suppressed', False)
+
+
+def delete_award_rows(session, award_ids, log=True):
+    """
+    Delete the given first blood awards without loading them into the session
+    """
+    if not award_ids:
+        return
+    note_write(session)
+    if log:
+        log_revoked_awards(session, award_ids)
+    session.execute(FirstBloodAward.__table__.delete().where(FirstBloodAward.__table__.c.id.in_(award_ids)))
+    session.execute(Awards.__table__.delete().where(Awards.__table__.c.id.in_(award_ids)))
+
+
+def _next_id(session, table):
+    return (session.execute(select([func.max(table.c.id)])).scalar() or 0) + 1
+
+
+def _reset_sequence(session, table):
+    # We insert explicit ids, which PostgreSQL sequences don't notice (MySQL and SQLite do)
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), (SELECT MAX(id) FROM {0}))".format(table.name)
+        )
+
+
+def import_solves(rows, session=None):
+    """
+    Insert solves in bulk, without going through the ORM or the award hooks.
+    Every row is a dict with challenge_id, user_id, team_id and optionally ip, provided and date.
+    Ids are allocated here, so nothing else may be inserting submissions at the same time!
+    You have to call generate_awards() and db.session.commit() manually after this!
+    """
+    session = session or db.session
+    submissions = Submissions.__table__
+    solves = Solves.__table__
+
+    count = 0
+    challenge_ids = set()
+    with import_mode(session):
+        next_id = _next_id(session, submissions)
+        submission_rows, solve_rows = [], []
+        for row in rows:
+            challenge_ids.add(row['challenge_id'])
+            submission_rows.append({
+                'id': next_id,
+                'challenge_id': row['challenge_id'],
+                'user_id': row.get('user_id'),
+                'team_id': row.get('team_id'),
+                'ip': row.get('ip'),
+                'provided': row.get('provided'),
+                'type': 'correct',
+                'date': row.get('date') or datetime.datetime.utcnow(),
+            })
+            solve_rows.append({
+                'id': next_id,
+                'challenge_id': row['challenge_id'],
+                'user_id': row.get('user_id'),
+                'team_id': row.get('team_id'),
+            })
+            next_id += 1
+            if len(submission_rows) >= BATCH_SIZE:
+                session.execute(submissions.insert(), submission_rows)
+                session.execute(solves.insert(), solve_rows)
+                count += len(submission_rows)
+                submission_rows, solve_rows = [], []
+        if submission_rows:
+            session.execute(submissions.insert(), submission_rows)
+            session.execute(solves.insert(), solve_rows)
+            count += len(submission_rows)
+        _reset_sequence(session, submissions)
+    # The hooks that would do this are disabled
+    mark_rankings_stale(session, challenge_ids)
+    mark_rank_counters_stale(session, challenge_ids)
+    return count
+
+
+def delete_awards(challenge_ids, session=None, log=True):
+    """
+    Delete all first blood awards of the given challenges in batches
+    """
+    session = session or db.session
+    awards = (
+        session.query(FirstBloodAward.id)
+        .join(Solves, FirstBloodAward.solve_id == Solves.id)
+        .filter(Solves.challenge_id.in_(challenge_ids))
+        .order_by(FirstBloodAward.id)
+        .limit(BATCH_SIZE)
+    )
+    while True:
+        award_ids = [award.id for award in awards]
+        if not award_ids:
+            break
+        delete_award_rows(session, award_ids, log)
+
+
+def insert_awards(session, awards, log=True, allocate_ids=True):
+    """
+    Insert awards in bulk. `awards` yields (challenge_id, award_data) pairs, with award_data in the format of
+    FirstBloodValueChallenge._gen_award_data(). Award ids are allocated here, so nothing else may be inserting
+    awards at the same time! With allocate_ids=False, the database assigns them instead - one awards row at a time,
+    which is slower, but safe while solves are coming in.
+    """
+    note_write(session)
+    count = 0
+    next_id = _next_id(session, Awards.__table__) if allocate_ids else None
+    award_rows, first_blood_rows, event_rows = [], [], []
+
+    def write():
+        if allocate_ids:
+            session.execute(Awards.__table__.insert(), award_rows)
+        else:
+            for award_row, first_blood_row in zip(award_rows, first_blood_rows):
+                first_blood_row['id'] = session.execute(Awards.__table__.insert(), award_row).inserted_primary_key[0]
+        session.execute(FirstBloodAward.__table__.insert(), first_blood_rows)
+        if event_rows:
+            session.execute(FirstBloodAwardEvent.__table__.insert(), event_rows)
+
+    for challenge_id, award_data in awards:
+        award_rows.append({
+            'type': 'firstblood',
+            'user_id': award_data['user_id'],
+            'team_id': award_data['team_id'],
+            'name': award_data['name'],
+            'description': award_data['description'],
+            'category': award_data['category'],
+            'date': award_data['date'],
+            'value': award_data['value'],
+            'icon': award_data['icon'],
+        })
+        first_blood_rows.append({
+            'solve_id': award_data['solve_id'],
+            'solve_num': award_data['solve_num'],
+            'bracket': award_data.get('bracket'),
+        })
+        if log:
+            event_rows.append({
+                'kind': GRANT,
+                'challenge_id': challenge_id,
+                'solve_id': award_data['solve_id'],
+                'user_id': award_data['user_id'],
+                'team_id': award_data['team_id'],
+                'solve_num': award_data['solve_num'],
+                'bracket': award_data.get('bracket'),
+                'value': award_data['value'],
+            })
+        if allocate_ids:
+            award_rows[-1]['id'] = first_blood_rows[-1]['id'] = next_id
+            next_id += 1
+        if len(award_rows) >= BATCH_SIZE:
+            write()
+            count += len(award_rows)
+            award_rows, first_blood_rows, event_rows = [], [], []
+    if award_rows:
+        write()
+        count += len(award_rows)
+    if allocate_ids:
+        _reset_sequence(session, Awards.__table__)
+    return count
+
+
+def generate_awards(challenge_ids=None, session=None):
+    """
+    (Re)generate the first blood awards of all (or the given) first blood challenges in one set-based pass:
+    a single window query ranks the eligible solves of every challenge, and the awards are inserted in bulk.
+    Award ids are allocated here, so nothing else may be inserting awards at the same time!
+    You have to call db.session.commit() manually after this!
+    """
+    # Imported here to avoid a circular import - the challenge type imports this module
+    from . import FirstBloodValueChallenge
+
+    session = session or db.session
+    Model = get_model()
+
+    challenges = FirstBloodChallenge.query
+    if challenge_ids is not None:
+        challenges = challenges.filter(FirstBloodChallenge.id.in_(challenge_ids))
+    challenges = {challenge.id: challenge for challenge in challenges}
+    if not challenges:
+        return 0
+
+    with import_mode(session):
+        mark_rankings_stale(session, challenges)
+        mark_rank_counters_stale(session, challenges)
+        delete_awards(list(challenges), session)
+
+        # Only visible challenges that are not archived give out awards, and never more than their bonus list is long
+        visible_ids = [
+            c.id for c in challenges.values() if c.state == 'visible' and not c.first_blood_archived and c.first_blood_bonus
+        ]
+        max_rank = max([len(challenges[i].first_blood_bonus) for i in visible_ids] or [0])
+        if max_rank == 0:
+            rebuild_summaries(session)
+            return 0
+
+        # With brackets, every bracket of a challenge is ranked separately
+        bracket = bracket_column(Model)
+        partition_by = [Solves.challenge_id] if bracket is None else [Solves.challenge_id, bracket]
+        ranked = (
+            session.query(
+                Solves.id.label("id"),
+                Solves.challenge_id.label("challenge_id"),
+                Solves.user_id.label("user_id"),
+                Solves.team_id.label("team_id"),
+                Solves.date.label("date"),
+                (bracket if bracket is not None else literal(None)).label("bracket"),
+                func.row_number().over(partition_by=partition_by, order_by=Solves.id).label("solve_num"),
+            )
+            .join(Model, Solves.account_id == Model.id)
+            .filter(
+                Solves.challenge_id.in_(visible_ids),
+                eligible_solve(Model),
+            )
+            .subquery()
+        )
+        # Only the first few solves of every challenge are returned, so this is small enough to load at once
+        solves = session.query(ranked).filter(ranked.c.solve_num <= max_rank).all()
+
+        awards = (
+            (solve.challenge_id, FirstBloodValueChallenge._gen_award_data(
+                challenges[solve.challenge_id], solve, solve.solve_num, bracket_value(solve.bracket)
+            ))
+            for solve in solves
+        )
+        count = insert_awards(session, ((challenge_id, data) for challenge_id, data in awards if data is not None))
+
+        rebuild_summaries(session)
+    # Anything loaded before is stale now
+    session.expire_all()
+    return count
@@ -0,0 +1,136 @@
+import datetime
+import json
+
+import click
+from flask.cli import AppGroup
+
+from CTFd.models import db
+
+from .archive import archive_challenges, restore_challenges, retired_challenge_ids
+from .bulk import generate_awards, import_solves
+from .eventlog import EVENT_KINDS, award_history
+from .export import EXPORT_FORMATS, iter_export
+from .replay import create_checkpoint, replay
+from .simulate import SolveHistory, random_schedules, simulate
+
+first_blood_cli = AppGroup("first-blood", help="Maintenance commands of the first blood plugin")
+
+
+@first_blood_cli.command("rebuild-awards")
+@click.option("--challenge", "challenge_ids", type=int, multiple=True, help="Only rebuild this challenge (repeatable)")
+def rebuild_awards_command(challenge_ids):
+    """Regenerate the first blood awards from the solves"""
+    count = generate_awards(list(challenge_ids) or None)
+    db.session.commit()
+    click.echo("Generated {0} first blood awards".format(count))
+
+
+@first_blood_cli.command("import-solves")
+@click.argument("solves_file", type=click.File("r"))
+def import_solves_command(solves_file):
+    """
+    Import solves from a JSON Lines file and generate the first blood awards for them.
+    Every line is an object with challenge_id, user_id, team_id and optionally ip, provided and date (ISO 8601).
+    """
+    def rows():
+        for line in solves_file:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get('date'):
+                row['date'] = datetime.datetime.fromisoformat(row['date'])
+            yield row
+
+    solves = import_solves(rows())
+    awards = generate_awards()
+    db.session.commit()
+    click.echo("Imported {0} solves, generated {1} first blood awards".format(solves, awards))
+
+
+@first_blood_cli.command("export")
+@click.option("--format", "fmt", type=click.Choice(sorted(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Output file (default: stdout)")
+def export_command(fmt, output):
+    """Export the first blood ranks of every challenge"""
+    for chunk in iter_export(fmt):
+        output.write(chunk)
+
+
+@first_blood_cli.command("archive")
+@click.option("--challenge", "challenge_ids", type=int, multiple=True, help="Archive this challenge (repeatable)")
+def archive_command(challenge_ids):
+    """
+    Move the first blood awards of the given challenges (default: all hidden ones) into the archive.
+    Archived challenges give out no awards until they are restored.
+    """
+    challenge_ids = list(challenge_ids) or retired_challenge_ids()
+    count = archive_challenges(challenge_ids)
+    click.echo("Archived {0} first blood awards of {1} challenges".format(count, len(challenge_ids)))
+
+
+@first_blood_cli.command("restore")
+@click.option("--challenge", "challenge_ids", type=int, multiple=True, required=True, help="Restore this challenge (repeatable)")
+def restore_command(challenge_ids):
+    """Move the archived first blood awards of the given (visible) challenges back"""
+    count = restore_challenges(challenge_ids)
+    click.echo("Restored {0} first blood awards".format(count))
+
+
+@first_blood_cli.command("replay")
+@click.option("--challenge", "challenge_ids", type=int, multiple=True, help="Only rebuild this challenge (repeatable)")
+@click.option("--full", is_flag=True, help="Replay the whole event log instead of starting from the last checkpoint")
+def replay_command(challenge_ids, full):
+    """Rebuild the first blood awards from the award event log"""
+    count = replay(list(challenge_ids) or None, from_checkpoint=not full)
+    db.session.commit()
+    click.echo("Restored {0} first blood awards".format(count))
+
+
+@first_blood_cli.command("checkpoint")
+def checkpoint_command():
+    """Snapshot the award event log so that replays can start from here"""
+    click.echo("Created a checkpoint at event {0}".format(create_checkpoint()))
+
+
+@first_blood_cli.command("history")
+@click.option("--challenge", "challenge_id", type=int)
+@click.option("--account", "account_id", type=int)
+@click.option("--limit", type=int, default=50, show_default=True)
+def history_command(challenge_id, account_id, limit):
+    """Show who held which first blood rank and when it changed, newest first"""
+    for e in award_history(challenge_id, account_id, limit):
+        click.echo("{0} {1:6} challenge={2} solve={3} user={4} team={5} rank={6} value={7}".format(
+            e.date.isoformat(), EVENT_KINDS[e.kind], e.challenge_id, e.solve_id, e.user_id, e.team_id,
+            e.solve_num, e.value))
+
+
+@first_blood_cli.command("simulate")
+@click.option("--schedule", "schedules", multiple=True, help="Comma separated bonus points, e.g. 30,20,10 (repeatable)")
+@click.option("--random", "random_count", type=int, default=0, help="Also try this many random schedules")
+@click.option("--max-rank", type=int, default=5, show_default=True, help="Longest random schedule")
+@click.option("--max-bonus", type=int, default=100, show_default=True, help="Highest random bonus")
+@click.option("--seed", type=int, help="Seed for the random schedules")
+@click.option("--until", type=click.DateTime(), help="Only use the solves up to this time")
+@click.option("--top", type=int, default=10, show_default=True, help="Size of the top of the scoreboard to compare")
+def simulate_command(schedules, random_count, max_rank, max_bonus, seed, until, top):
+    """
+    Compare the scoreboard under other bonus schedules with the current one, using the recorded solves.
+    Nothing is written to the database. Needs NumPy.
+    """
+    try:
+        schedules = [[int(points) for points in schedule.split(",")] for schedule in schedules]
+        if random_count:
+            schedules += random_schedules(random_count, max_rank, max_bonus, seed)
+        longest = max([len(schedule) for schedule in schedules] or [0])
+        history = SolveHistory.load(longest, until)
+        results = simulate(history, schedules, top)
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+
+    click.echo("{0:24} {1:>6} {2:>8} {3:>6} {4:>6} {5:>6}  {6}".format(
+        "schedule", "awards", "bonus", "moved", "shift", "top", "leader"))
+    for result in results:
+        schedule = "current" if result["schedule"] is None else ",".join(map(str, result["schedule"]))
+        click.echo("{0:24} {1:>6} {2:>8} {3:>6} {4:>6} {5:>6}  {6}".format(
+            schedule, result["awards"], result["total_bonus"], result["moved"], result["max_shift"],
+            result["top_changed"], result["top"][0] if result["top"] else "-"))
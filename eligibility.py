@@ -0,0 +1,137 @@
+import collections
+import datetime
+
+from flask import current_app
+from sqlalchemy import and_, exists, true
+from sqlalchemy.orm import aliased
+
+from CTFd.models import Solves, Users
+
+# Every rule is a SQL predicate on Solves joined with the account model of the user mode, so that all the rules
+# together filter the solves in the same query that ranks them
+EligibilityRule = collections.namedtuple(
+    "EligibilityRule", ["name", "predicate", "attributes", "solver_attributes", "config"]
+)
+
+_rules = collections.OrderedDict()
+
+DEFAULT_RULES = ["not_hidden", "not_banned", "not_admin", "registered_before_cutoff"]
+
+
+def eligibility_rule(name, attributes=(), solver_attributes=(), config=()):
+    """
+    Register a rule that a solve has to meet to get a first blood award. The decorated function is given the account
+    model (Users or Teams) and returns a SQL predicate, or None if the rule doesn't apply right now.
+    `attributes` are the account attributes the predicate depends on - changing one of them recalculates the awards
+    of the account's challenges. `solver_attributes` are the attributes of the user who submitted the solve it depends
+    on, the same as `attributes` in users mode - in teams mode, changing one recalculates the challenges of the
+    user's team. `config` are the config keys it reads, so that cached queries are rebuilt when they change.
+    """
+    def decorator(f):
+        _rules[name] = EligibilityRule(name, f, tuple(attributes), tuple(solver_attributes), tuple(config))
+        return f
+    return decorator
+
+
+def rule_names(config):
+    """
+    The rule names in FIRST_BLOOD_ELIGIBILITY_RULES (default: DEFAULT_RULES) - a list, or a comma separated string
+    as it comes from config.ini or the environment
+    """
+    names = config.get("FIRST_BLOOD_ELIGIBILITY_RULES")
+    if names is None:
+        return DEFAULT_RULES
+    if isinstance(names, str):
+        names = [name.strip() for name in names.split(",") if name.strip()]
+    return names
+
+
+def check_rules(app):
+    """
+    Fail early on rule names that no rule is registered for - called once when the plugin is loaded
+    """
+    unknown = [name for name in rule_names(app.config) if name not in _rules]
+    if unknown:
+        raise ValueError("Unknown first blood eligibility rules: {0}".format(", ".join(unknown)))
+
+
+def active_rules():
+    """
+    The rules named in FIRST_BLOOD_ELIGIBILITY_RULES, in order
+    """
+    return [_rules[name] for name in rule_names(current_app.config)]
+
+
+def eligible_solve(Model):
+    """
+    The predicate of all active rules - the solves (joined with Model) that can get an award
+    """
+    predicates = [rule.predicate(Model) for rule in active_rules()]
+    predicates = [predicate for predicate in predicates if predicate is not None]
+    return and_(*predicates) if predicates else true()
+
+
+def eligibility_key(Model):
+    """
+    Everything eligible_solve() depends on, as the cache key of baked queries
+    """
+    return (Model,) + tuple(
+        (rule.name, rule.predicate) + tuple(current_app.config.get(key) for key in rule.config)
+        for rule in active_rules()
+    )
+
+
+def eligibility_attributes():
+    """
+    The account attributes that decide whether its solves are eligible
+    """
+    return {attribute for rule in active_rules() for attribute in rule.attributes}
+
+
+def solver_eligibility_attributes():
+    """
+    The user attributes that decide whether the solves the user submitted are eligible
+    """
+    return {attribute for rule in active_rules() for attribute in rule.solver_attributes}
+
+
+def _timestamp(value):
+    # A datetime, a unix timestamp (like CTFd's own start and end settings) or an ISO 8601 date, as naive UTC
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime.datetime):
+        try:
+            return datetime.datetime.utcfromtimestamp(float(value))
+        except ValueError:
+            value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+@eligibility_rule("not_hidden", attributes=["hidden"])
+def not_hidden(Model):
+    return Model.hidden == False
+
+
+@eligibility_rule("not_banned", attributes=["banned"])
+def not_banned(Model):
+    return Model.banned == False
+
+
+@eligibility_rule("not_admin", solver_attributes=["type"])
+def not_admin(Model):
+    # The user who submitted the flag - in teams mode, a team's solves by an admin don't count either
+    # (an alias, so that it's correlated with the solve and not with the joined account in users mode)
+    solver = aliased(Users)
+    return ~exists().where(and_(solver.id == Solves.user_id, solver.type == "admin"))
+
+
+@eligibility_rule("registered_before_cutoff", attributes=["created"], config=["FIRST_BLOOD_REGISTRATION_CUTOFF"])
+def registered_before_cutoff(Model):
+    # Accounts registered after FIRST_BLOOD_REGISTRATION_CUTOFF (UTC unless it has a timezone) can still solve,
+    # but not get awards
+    cutoff = _timestamp(current_app.config.get("FIRST_BLOOD_REGISTRATION_CUTOFF"))
+    if cutoff is None:
+        return None
+    return Model.created <= cutoff
@@ -0,0 +1,105 @@
+from sqlalchemy import literal, select
+from sqlalchemy.orm.attributes import get_history
+
+from CTFd.models import Awards, Solves, Teams
+from CTFd.utils.modes import get_model
+
+from .models import FirstBloodAward, FirstBloodAwardEvent
+from .replica import note_write
+
+GRANT = 1
+SHIFT = 2
+REVOKE = 3
+
+EVENT_KINDS = {GRANT: "grant", SHIFT: "shift", REVOKE: "revoke"}
+
+
+def _event_from_award(session, kind, award):
+    # Pending awards can't lazy load their solve - but it is almost always in the identity map already
+    solve = session.query(Solves).get(award.solve_id)
+    return {
+        'kind': kind,
+        'challenge_id': solve.challenge_id,
+        'solve_id': award.solve_id,
+        'user_id': award.user_id,
+        'team_id': award.team_id,
+        'solve_num': award.solve_num,
+        'bracket': award.bracket,
+        'value': award.value,
+    }
+
+
+def collect_award_events(session):
+    """
+    Queue events for the awards added, changed or removed through the ORM in this flush. Called from before_flush
+    """
+    events = []
+    for instance in session.new:
+        if isinstance(instance, FirstBloodAward):
+            events.append(_event_from_award(session, GRANT, instance))
+    for instance in session.dirty:
+        if isinstance(instance, FirstBloodAward):
+            if any(get_history(instance, key).has_changes() for key in ("solve_num", "bracket", "value")):
+                events.append(_event_from_award(session, SHIFT, instance))
+    for instance in session.deleted:
+        if isinstance(instance, FirstBloodAward):
+            events.append(_event_from_award(session, REVOKE, instance))
+    if events:
+        note_write(session)
+        if not hasattr(session, 'pending_award_events'):
+            session.pending_award_events = []
+        session.pending_award_events.extend(events)
+
+
+def write_award_events(session, events=None):
+    """
+    Write the queued (or the given) events to the log. Called from after_flush_postexec
+    """
+    if events is None:
+        events = getattr(session, 'pending_award_events', None)
+        if hasattr(session, 'pending_award_events'):
+            del session.pending_award_events
+    if events:
+        session.execute(FirstBloodAwardEvent.__table__.insert(), events)
+
+
+def log_revoked_awards(session, award_ids):
+    """
+    Log revokes for awards that are about to be deleted in bulk, without loading them
+    """
+    note_write(session)
+    awards = Awards.__table__
+    first_blood_awards = FirstBloodAward.__table__
+    solves = Solves.__table__
+    events = FirstBloodAwardEvent.__table__
+    session.execute(
+        events.insert().from_select(
+            ['kind', 'challenge_id', 'solve_id', 'user_id', 'team_id', 'solve_num', 'bracket', 'value'],
+            select([
+                literal(REVOKE), solves.c.challenge_id, first_blood_awards.c.solve_id, awards.c.user_id,
+                awards.c.team_id, first_blood_awards.c.solve_num, first_blood_awards.c.bracket, awards.c.value,
+            ])
+            .select_from(
+                first_blood_awards
+                .join(awards, awards.c.id == first_blood_awards.c.id)
+                .join(solves, solves.c.id == first_blood_awards.c.solve_id)
+            )
+            .where(first_blood_awards.c.id.in_(award_ids))
+        )
+    )
+
+
+def award_history(challenge_id=None, account_id=None, limit=None):
+    """
+    Audit query - the events for a challenge and/or account, newest first
+    """
+    query = FirstBloodAwardEvent.query
+    if challenge_id is not None:
+        query = query.filter(FirstBloodAwardEvent.challenge_id == challenge_id)
+    if account_id is not None:
+        column = FirstBloodAwardEvent.team_id if get_model() is Teams else FirstBloodAwardEvent.user_id
+        query = query.filter(column == account_id)
+    query = query.order_by(FirstBloodAwardEvent.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+
+from CTFd.models import Awards, Challenges, Solves, Teams
+from CTFd.utils.modes import get_model
+
+from .models import FirstBloodAward, FirstBloodAwardArchive
+from .replica import read_session
+
+EXPORT_FIELDS = [
+    "challenge_id",
+    "challenge",
+    "category",
+    "solve_num",
+    "bracket",
+    "account_id",
+    "account",
+    "solve_id",
+    "solved_at",
+    "value",
+    "archived",
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def iter_results(session=None, batch_size=1000):
+    """
+    Yields one dict per first blood award, ordered by challenge and rank - first the live awards, then the archived ones.
+    The rows are streamed from the database with a server-side cursor (where supported) instead of being loaded at once.
+    """
+    if session is None:
+        # Exports can tolerate a bit of replication lag
+        with read_session() as session:
+            yield from iter_results(session, batch_size)
+        return
+    Model = get_model()
+
+    live = (
+        session.query(
+            Challenges.id,
+            Challenges.name,
+            Challenges.category,
+            FirstBloodAward.solve_num,
+            FirstBloodAward.bracket,
+            Model.id,
+            Model.name,
+            Solves.id,
+            Solves.date,
+            Awards.value,
+        )
+        .select_from(FirstBloodAward)
+        .join(Solves, FirstBloodAward.solve_id == Solves.id)
+        .join(Challenges, Solves.challenge_id == Challenges.id)
+        .join(Model, Solves.account_id == Model.id)
+        .order_by(Challenges.id, FirstBloodAward.bracket, FirstBloodAward.solve_num)
+    )
+    # The solves and accounts of archived awards may be gone by now, the archive keeps the account ids and dates
+    account_id = FirstBloodAwardArchive.team_id if Model is Teams else FirstBloodAwardArchive.user_id
+    archived = (
+        session.query(
+            Challenges.id,
+            Challenges.name,
+            Challenges.category,
+            FirstBloodAwardArchive.solve_num,
+            FirstBloodAwardArchive.bracket,
+            account_id,
+            Model.name,
+            FirstBloodAwardArchive.solve_id,
+            FirstBloodAwardArchive.date,
+            FirstBloodAwardArchive.value,
+        )
+        .select_from(FirstBloodAwardArchive)
+        .join(Challenges, FirstBloodAwardArchive.challenge_id == Challenges.id)
+        .outerjoin(Model, account_id == Model.id)
+        .order_by(Challenges.id, FirstBloodAwardArchive.bracket, FirstBloodAwardArchive.solve_num)
+    )
+    for query, is_archived in ((live, False), (archived, True)):
+        for row in query.execution_options(stream_results=True).yield_per(batch_size):
+            result = dict(zip(EXPORT_FIELDS, row))
+            result["archived"] = is_archived
+            result["solved_at"] = result["solved_at"].isoformat() + "Z" if result["solved_at"] else None
+            yield result
+
+
+def iter_csv(results):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for result in results:
+        writer.writerow(result)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def iter_jsonl(results):
+    for result in results:
+        yield json.dumps(result) + "\n"
+
+
+def iter_export(fmt, session=None):
+    if fmt == "csv":
+        return iter_csv(iter_results(session))
+    if fmt == "jsonl":
+        return iter_jsonl(iter_results(session))
+    raise ValueError("Unknown export format: {0}".format(fmt))
@@ -0,0 +1,82 @@
+import uuid
+
+from CTFd.cache import cache
+
+from .queries import session_of
+
+# How long a worker may hold a recalculation lease before other workers are allowed to take it over
+LEASE_TIMEOUT = 60
+
+
+def _lease_key(challenge_id):
+    return "first_blood_recalculation_lease_{0}".format(challenge_id)
+
+
+def _dirty_key(challenge_id):
+    return "first_blood_recalculation_dirty_{0}".format(challenge_id)
+
+
+def acquire_lease(session, challenge_id):
+    """
+    Try to become the worker that recalculates this challenge's awards. The lease is stored in the CTFd cache
+    (which has to be Redis for this to work across processes) and held until the session's transaction ends.
+    If another worker holds it, the challenge is marked dirty once this transaction has committed (see
+    release_leases()) - not right away, as the holder wouldn't see the changes of this transaction yet.
+    """
+    session = session_of(session)
+    if not hasattr(session, 'award_recalculation_leases'):
+        session.award_recalculation_leases = {}
+    if challenge_id in session.award_recalculation_leases:
+        return True
+
+    token = uuid.uuid4().hex
+    if cache.add(_lease_key(challenge_id), token, timeout=LEASE_TIMEOUT):
+        session.award_recalculation_leases[challenge_id] = token
+        # We are about to recalculate from the latest state anyway
+        cache.delete(_dirty_key(challenge_id))
+        return True
+
+    if not hasattr(session, 'skipped_recalculations'):
+        session.skipped_recalculations = set()
+    session.skipped_recalculations.add(challenge_id)
+    return False
+
+
+def pop_dirty(challenge_id):
+    """
+    Returns True if another worker marked the challenge dirty since it was last checked
+    """
+    # One atomic check-and-delete (DEL on Redis), so that a mark set in between can't be deleted unseen
+    return bool(cache.delete(_dirty_key(challenge_id)))
+
+
+def release_leases(session, committed):
+    """
+    Called when the session's transaction ends. Releases its leases, marks the challenges it skipped dirty if it
+    committed, and returns the ids of the dirty challenges among the leased and skipped ones, that nobody holds the
+    lease of anymore - they have to be recalculated again, by taking the lease again. Dirty challenges whose lease
+    someone else holds are left to them, they see the dirty mark when they release it.
+    """
+    leases = getattr(session, 'award_recalculation_leases', None) or {}
+    skipped = getattr(session, 'skipped_recalculations', None) or set()
+    if hasattr(session, 'award_recalculation_leases'):
+        del session.award_recalculation_leases
+    if hasattr(session, 'skipped_recalculations'):
+        del session.skipped_recalculations
+
+    for challenge_id, token in leases.items():
+        # Don't release a lease that expired and was taken over by someone else in the meantime. Not atomic - if the
+        # lease expires right in between, the worker that took it over loses it, and another worker may recalculate
+        # at the same time. Both recalculate from the latest state, and a dirty mark missed on the way is caught up
+        # by the next recalculation of the challenge.
+        if cache.get(_lease_key(challenge_id)) == token:
+            cache.delete(_lease_key(challenge_id))
+    if not committed:
+        skipped = set()
+    for challenge_id in skipped:
+        cache.set(_dirty_key(challenge_id), True, timeout=LEASE_TIMEOUT)
+    # Checked after the leases are released, so a mark set while we still held the lease isn't missed
+    return sorted(
+        challenge_id for challenge_id in set(leases) | skipped
+        if cache.get(_dirty_key(challenge_id)) and cache.get(_lease_key(challenge_id)) is None
+    )
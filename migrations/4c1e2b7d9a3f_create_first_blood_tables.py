@@ -0,0 +1,44 @@
+"""Create first blood tables
+
+Revision ID: 4c1e2b7d9a3f
+Revises:
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4c1e2b7d9a3f"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # Older versions of the plugin created these tables with create_all() - leave them alone if they exist
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "first_blood_challenge" not in tables:
+        op.create_table(
+            "first_blood_challenge",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("first_blood_bonus", sa.JSON(), nullable=True),
+            sa.ForeignKeyConstraint(["id"], ["challenges.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+    if "first_blood_award" not in tables:
+        op.create_table(
+            "first_blood_award",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("solve_id", sa.Integer(), nullable=True),
+            sa.Column("solve_num", sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(["id"], ["awards.id"], ondelete="CASCADE"),
+            sa.ForeignKeyConstraint(["solve_id"], ["solves.id"], ondelete="RESTRICT"),
+            sa.PrimaryKeyConstraint("id"),
+        )
+
+
+def downgrade(op=None):
+    op.drop_table("first_blood_award")
+    op.drop_table("first_blood_challenge")
@@ -0,0 +1,39 @@
+"""Add first blood summary table
+
+Revision ID: 9e6f3a1d5b28
+Revises: 4c1e2b7d9a3f
+Create Date: 2026-10-19 10:30:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9e6f3a1d5b28"
+down_revision = "4c1e2b7d9a3f"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    if "first_blood_summary" in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table(
+        "first_blood_summary",
+        sa.Column("account_id", sa.Integer(), nullable=False),
+        sa.Column("solve_num", sa.Integer(), nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("value", sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint("account_id", "solve_num"),
+    )
+    # The summary is derived data - fill it from the existing awards
+    op.execute(
+        "INSERT INTO first_blood_summary (account_id, solve_num, count, value) "
+        "SELECT COALESCE(awards.team_id, awards.user_id), first_blood_award.solve_num, COUNT(*), SUM(awards.value) "
+        "FROM awards JOIN first_blood_award ON awards.id = first_blood_award.id "
+        "GROUP BY COALESCE(awards.team_id, awards.user_id), first_blood_award.solve_num"
+    )
+
+
+def downgrade(op=None):
+    op.drop_table("first_blood_summary")
@@ -0,0 +1,32 @@
+"""Add indexes for the first blood award and solve lookups
+
+Revision ID: a7c4e9d2f813
+Revises: f1a9c3e7b240
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a7c4e9d2f813"
+down_revision = "f1a9c3e7b240"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_first_blood_award_solve_id", "first_blood_award", ["solve_id"]),
+    ("ix_first_blood_solves_user_id", "solves", ["user_id"]),
+    ("ix_first_blood_solves_team_id", "solves", ["team_id"]),
+]
+
+
+def upgrade(op=None):
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name not in [index["name"] for index in inspector.get_indexes(table)]:
+            op.create_index(name, table, columns)
+
+
+def downgrade(op=None):
+    for name, table, columns in INDEXES:
+        op.drop_index(name, table_name=table)
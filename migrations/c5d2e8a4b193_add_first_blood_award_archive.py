@@ -0,0 +1,50 @@
+"""Add the first blood award archive
+
+Revision ID: c5d2e8a4b193
+Revises: a7c4e9d2f813
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c5d2e8a4b193"
+down_revision = "a7c4e9d2f813"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    inspector = sa.inspect(op.get_bind())
+
+    # On SQLite, create_all() may have just created the table with the column already
+    columns = [column["name"] for column in inspector.get_columns("first_blood_challenge")]
+    if "first_blood_archived" not in columns:
+        op.add_column(
+            "first_blood_challenge",
+            sa.Column("first_blood_archived", sa.Boolean(create_constraint=False), nullable=False, server_default=sa.false()),
+        )
+
+    if "first_blood_award_archive" not in inspector.get_table_names():
+        op.create_table(
+            "first_blood_award_archive",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=False),
+            sa.Column("solve_id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("team_id", sa.Integer(), nullable=True),
+            sa.Column("solve_num", sa.Integer(), nullable=False),
+            sa.Column("bracket", sa.String(length=128), nullable=True),
+            sa.Column("value", sa.Integer(), nullable=False),
+            sa.Column("date", sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_first_blood_award_archive_challenge_id", "first_blood_award_archive", ["challenge_id"]
+        )
+
+
+def downgrade(op=None):
+    op.drop_table("first_blood_award_archive")
+    with op.batch_alter_table("first_blood_challenge") as batch_op:
+        batch_op.drop_column("first_blood_archived")
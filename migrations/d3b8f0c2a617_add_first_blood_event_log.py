@@ -0,0 +1,64 @@
+"""Add first blood award event log
+
+Revision ID: d3b8f0c2a617
+Revises: 9e6f3a1d5b28
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "d3b8f0c2a617"
+down_revision = "9e6f3a1d5b28"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    tables = sa.inspect(op.get_bind()).get_table_names()
+
+    if "first_blood_award_event" not in tables:
+        op.create_table(
+            "first_blood_award_event",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("kind", sa.SmallInteger(), nullable=False),
+            sa.Column("date", sa.DateTime(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=False),
+            sa.Column("solve_id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("team_id", sa.Integer(), nullable=True),
+            sa.Column("solve_num", sa.Integer(), nullable=True),
+            sa.Column("value", sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint("id"),
+        )
+        op.create_index(
+            "ix_first_blood_award_event_challenge_id", "first_blood_award_event", ["challenge_id"]
+        )
+        # Start the log with a grant for every existing award
+        op.execute(
+            "INSERT INTO first_blood_award_event (kind, date, challenge_id, solve_id, user_id, team_id, solve_num, value) "
+            "SELECT 1, awards.date, solves.challenge_id, first_blood_award.solve_id, awards.user_id, awards.team_id, "
+            "first_blood_award.solve_num, awards.value "
+            "FROM first_blood_award JOIN awards ON awards.id = first_blood_award.id "
+            "JOIN solves ON solves.id = first_blood_award.solve_id"
+        )
+
+    if "first_blood_checkpoint" not in tables:
+        op.create_table(
+            "first_blood_checkpoint",
+            sa.Column("solve_id", sa.Integer(), nullable=False),
+            sa.Column("challenge_id", sa.Integer(), nullable=False),
+            sa.Column("user_id", sa.Integer(), nullable=True),
+            sa.Column("team_id", sa.Integer(), nullable=True),
+            sa.Column("solve_num", sa.Integer(), nullable=False),
+            sa.Column("value", sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint("solve_id"),
+        )
+        op.create_index(
+            "ix_first_blood_checkpoint_challenge_id", "first_blood_checkpoint", ["challenge_id"]
+        )
+
+
+def downgrade(op=None):
+    op.drop_table("first_blood_checkpoint")
+    op.drop_table("first_blood_award_event")
@@ -0,0 +1,31 @@
+"""Add first blood brackets
+
+Revision ID: f1a9c3e7b240
+Revises: d3b8f0c2a617
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f1a9c3e7b240"
+down_revision = "d3b8f0c2a617"
+branch_labels = None
+depends_on = None
+
+BRACKET_TABLES = ["first_blood_award", "first_blood_award_event", "first_blood_checkpoint"]
+
+
+def upgrade(op=None):
+    inspector = sa.inspect(op.get_bind())
+    for table in BRACKET_TABLES:
+        # On SQLite, create_all() may have just created the table with the column already
+        columns = [column["name"] for column in inspector.get_columns(table)]
+        if "bracket" not in columns:
+            op.add_column(table, sa.Column("bracket", sa.String(length=128), nullable=True))
+
+
+def downgrade(op=None):
+    for table in BRACKET_TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column("bracket")
@@ -0,0 +1,184 @@
+import collections
+import datetime
+import functools
+import itertools
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from CTFd.models import Challenges, Awards, Solves, db
+from CTFd.utils.humanize.numbers import ordinalize
+
+
+# The columns of a solve that the award pipeline needs, without the weight of an ORM object
+# (namedtuples have no per-instance __dict__)
+SolveRecord = collections.namedtuple("SolveRecord", ["id", "user_id", "team_id", "date", "bracket"])
+
+# Brackets hold the value of an account attribute - the affiliation is the longest one CTFd has
+BRACKET_LENGTH = 128
+# Length of CTFd's Awards.name
+AWARD_NAME_LENGTH = 80
+
+
+@functools.lru_cache(maxsize=4096)
+def award_text(challenge_name, solve_num, bracket=None):
+    """
+    The name, description and icon of the award for the solve_num-th solver of a challenge (in a bracket).
+    Cached, so recalculations reuse the strings of every rank instead of formatting them again for each solve.
+    The name is cut to the length of the awards' name column, long challenge names and brackets don't fit in it.
+    """
+    if bracket is not None:
+        return (
+            '{0} blood for {1} ({2})'.format(ordinalize(solve_num), challenge_name, bracket)[:AWARD_NAME_LENGTH],
+            'Bonus points for being the {0} in {1} to solve the challenge'.format(ordinalize(solve_num), bracket),
+            'medal-{0}'.format(ordinalize(solve_num)) if solve_num <= 3 else 'medal',
+        )
+    return (
+        '{0} blood for {1}'.format(ordinalize(solve_num), challenge_name)[:AWARD_NAME_LENGTH],
+        'Bonus points for being the {0} to solve the challenge'.format(ordinalize(solve_num)),
+        'medal-{0}'.format(ordinalize(solve_num)) if solve_num <= 3 else 'medal',
+    )
+
+
+class FirstBloodChallenge(Challenges):
+    __mapper_args__ = {"polymorphic_identity": "firstblood"}
+    id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), primary_key=True
+    )
+    first_blood_bonus = db.Column(db.JSON)
+    # Archived challenges give out no awards, their awards are in first_blood_award_archive (see archive.py)
+    first_blood_archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    def __init__(self, *args, **kwargs):
+        # This is kind of a hack because serializeJSON in CTFd does not support arrays
+        first_blood_bonus = None
+        for attr, value in kwargs.items():
+            if attr.startswith('first_blood_bonus'):
+                first_blood_bonus = []
+        if first_blood_bonus is not None:
+            for i in itertools.count():
+                attr = 'first_blood_bonus[{0}]'.format(i)
+                if attr not in kwargs:
+                    break
+                first_blood_bonus.append(int(kwargs[attr]) if kwargs[attr] != '' else None)
+                del kwargs[attr]
+            while first_blood_bonus[-1] is None:
+                first_blood_bonus.pop()
+            kwargs['first_blood_bonus'] = first_blood_bonus
+    
+        super(FirstBloodChallenge, self).__init__(**kwargs)
+
+class FirstBloodAward(Awards):
+    __mapper_args__ = {"polymorphic_identity": "firstblood"}
+    id = db.Column(
+        db.Integer, db.ForeignKey("awards.id", ondelete="CASCADE"), primary_key=True
+    )
+    solve_id = db.Column(db.Integer, db.ForeignKey("solves.id", ondelete="RESTRICT"), index=True)  # It doesn't seem possible to do this well on the database level (FirstBloodAward always gets removed without the base Awards entry), so we do it on the application level
+    solve_num = db.Column(db.Integer, nullable=False)
+    bracket = db.Column(db.String(BRACKET_LENGTH))  # None unless FIRST_BLOOD_BRACKET_FIELD is set - solve_num is counted per bracket
+    
+    solve = db.relationship("Solves", foreign_keys="FirstBloodAward.solve_id", lazy="select")
+
+
+class FirstBloodSummary(db.Model):
+    """
+    Per-account number of first blood awards and bonus points, for each rank.
+    Maintained by the same code paths that create and remove FirstBloodAward rows, see summary.py
+    """
+    __tablename__ = "first_blood_summary"
+    account_id = db.Column(db.Integer, primary_key=True)
+    solve_num = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+
+
+class FirstBloodAwardEvent(db.Model):
+    """
+    Append-only log of every grant, shift (rank or value change) and revoke of a first blood award, see eventlog.py
+    There are deliberately no foreign keys - the log has to outlive the awards, solves and accounts it refers to
+    """
+    __tablename__ = "first_blood_award_event"
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.SmallInteger, nullable=False)
+    date = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    challenge_id = db.Column(db.Integer, nullable=False, index=True)
+    solve_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)
+    team_id = db.Column(db.Integer)
+    solve_num = db.Column(db.Integer)
+    bracket = db.Column(db.String(BRACKET_LENGTH))
+    value = db.Column(db.Integer)
+
+
+class FirstBloodCheckpoint(db.Model):
+    """
+    Snapshot of all awards folded from the event log up to some event, so that replays don't have to start from the
+    beginning of the log. The event id of the snapshot is stored in the first_blood_checkpoint config key
+    """
+    __tablename__ = "first_blood_checkpoint"
+    solve_id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer)
+    team_id = db.Column(db.Integer)
+    solve_num = db.Column(db.Integer, nullable=False)
+    bracket = db.Column(db.String(BRACKET_LENGTH))
+    value = db.Column(db.Integer, nullable=False)
+
+
+class FirstBloodAwardArchive(db.Model):
+    """
+    The first blood awards of archived challenges, moved out of the awards tables so that those stay small (see
+    archive.py). Only what is needed to restore an award is kept - the texts are generated again from the rank.
+    There are deliberately no foreign keys, like in the event log
+    """
+    __tablename__ = "first_blood_award_archive"
+    id = db.Column(db.Integer, primary_key=True)
+    challenge_id = db.Column(db.Integer, nullable=False, index=True)
+    solve_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer)
+    team_id = db.Column(db.Integer)
+    solve_num = db.Column(db.Integer, nullable=False)
+    bracket = db.Column(db.String(BRACKET_LENGTH))
+    value = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.DateTime)
+
+
+# CTFd's solves table is only indexed by (challenge_id, user_id) and (challenge_id, team_id), but awards are looked up
+# by account when it is hidden, unhidden or changes brackets. tests/test_first_blood.py checks the plans of these lookups
+SOLVES_ACCOUNT_INDEXES = [
+    db.Index("ix_first_blood_solves_user_id", Solves.__table__.c.user_id),
+    db.Index("ix_first_blood_solves_team_id", Solves.__table__.c.team_id),
+]
+
+
+# Columns that the migrations add to tables of earlier versions
+ADDED_COLUMNS = [
+    FirstBloodChallenge.__table__.c.first_blood_archived,
+    FirstBloodAward.__table__.c.bracket,
+    FirstBloodAwardEvent.__table__.c.bracket,
+    FirstBloodCheckpoint.__table__.c.bracket,
+]
+
+
+def ensure_columns(bind):
+    """
+    Add the columns of the plugin that are missing on existing tables, for the same reason as ensure_indexes()
+    """
+    inspector = inspect(bind)
+    for column in ADDED_COLUMNS:
+        if column.name not in {existing["name"] for existing in inspector.get_columns(column.table.name)}:
+            bind.execute("ALTER TABLE {0} ADD COLUMN {1}".format(
+                column.table.name, CreateColumn(column).compile(dialect=bind.dialect)
+            ))
+
+
+def ensure_indexes(bind):
+    """
+    Create the indexes of the plugin that are missing on existing tables. On SQLite CTFd only runs create_all()
+    instead of the migrations, which skips tables that already exist
+    """
+    inspector = inspect(bind)
+    for index in SOLVES_ACCOUNT_INDEXES + list(FirstBloodAward.__table__.indexes):
+        if index.name not in {existing["name"] for existing in inspector.get_indexes(index.table.name)}:
+            index.create(bind)
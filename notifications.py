@@ -0,0 +1,162 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+
+from CTFd.utils.humanize.numbers import ordinalize
+
+log = logging.getLogger(__name__)
+
+
+class FirstBloodAnnouncer(object):
+    """
+    Publishes "first blood on X by Y" announcements to the CTFd event manager and to outgoing webhooks.
+    Announcements are put on a bounded queue and delivered in batches by a background thread, so a slow or
+    unreachable webhook never adds latency to flag submission. If the queue is full, the announcement is dropped.
+    """
+
+    def __init__(self, app, webhooks=(), notify=True, max_queue=1000, batch_size=10, batch_delay=1.0,
+                 max_retries=3, retry_delay=1.0, timeout=5.0):
+        self.app = app
+        self.webhooks = list(webhooks)
+        self.notify = notify
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app):
+        webhooks = app.config.get("FIRST_BLOOD_WEBHOOKS") or ""
+        if isinstance(webhooks, str):
+            webhooks = [url.strip() for url in webhooks.split(",") if url.strip()]
+        return cls(
+            app,
+            webhooks=webhooks,
+            notify=str(app.config.get("FIRST_BLOOD_NOTIFY", True)).lower() not in ("0", "false", "no"),
+            max_queue=int(app.config.get("FIRST_BLOOD_ANNOUNCE_QUEUE_SIZE", 1000)),
+            batch_size=int(app.config.get("FIRST_BLOOD_ANNOUNCE_BATCH_SIZE", 10)),
+        )
+
+    @property
+    def enabled(self):
+        return self.notify or bool(self.webhooks)
+
+    def announce(self, challenge, award):
+        """
+        Queue an announcement for a freshly created award. Never blocks.
+        """
+        if not self.enabled:
+            return
+        solver = award.team if award.team_id is not None else award.user
+        message = {
+            "challenge_id": challenge.id,
+            "challenge": challenge.name,
+            "account": solver.name if solver is not None else None,
+            "solve_num": award.solve_num,
+            "value": award.value,
+            "text": "{0} blood on {1} by {2}!".format(
+                ordinalize(award.solve_num).capitalize() if award.solve_num > 1 else "First",
+                challenge.name,
+                solver.name if solver is not None else "unknown",
+            ),
+        }
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            log.warning("First blood announcement queue is full, dropping: %s", message["text"])
+
+    def flush(self, timeout=None):
+        """
+        Wait until all currently queued announcements have been delivered (or given up on)
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_started(self):
+        # The thread has to be (re)started lazily - gunicorn forks workers after the plugin is loaded
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="first-blood-announcer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(batch)
+            except Exception:
+                log.exception("Failed to deliver first blood announcements")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _deliver(self, batch):
+        if self.notify:
+            with self.app.app_context():
+                for message in batch:
+                    self.app.events_manager.publish(
+                        data={
+                            "title": "First Blood",
+                            "content": message["text"],
+                            "type": "toast",
+                            "sound": True,
+                        },
+                        type="notification",
+                    )
+
+        if self.webhooks:
+            text = "\n".join(message["text"] for message in batch)
+            # "content" is understood by Discord, "text" by Slack and Mattermost
+            payload = {"content": text, "text": text, "announcements": batch}
+            for url in self.webhooks:
+                self._post(url, payload)
+
+    def _post(self, url, payload):
+        for attempt in range(self.max_retries + 1):
+            try:
+                r = requests.post(url, json=payload, timeout=self.timeout)
+                if r.status_code < 500 and r.status_code != 429:
+                    if r.status_code >= 400:
+                        log.warning("First blood webhook %s rejected the announcement: HTTP %d", url, r.status_code)
+                    return True
+            except requests.RequestException as e:
+                log.debug("First blood webhook %s failed: %s", url, e)
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay * (2 ** attempt))
+        log.warning("Giving up on first blood webhook %s after %d attempts", url, self.max_retries + 1)
+        return False
+
+
+def announce_first_blood(app, challenge, award):
+    announcer = app.extensions.get("first_blood_announcer")
+    if announcer is not None:
+        announcer.announce(challenge, award)
@@ -0,0 +1,120 @@
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# One call counter per operation, shared by all threads - itertools.count() is atomic in CPython
+_counters = {}
+_local = threading.local()
+_instrumented_engines = set()
+
+
+def _config(key, default=None):
+    return current_app.config.get(key, default)
+
+
+def _instrument_engine(engine):
+    """
+    Time the SQL statements of the engine, but only while an operation is being profiled on the thread
+    """
+    if engine in _instrumented_engines:
+        return
+    _instrumented_engines.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if getattr(_local, 'stack', None):
+            conn.info.setdefault('first_blood_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('first_blood_query_start')
+        stack = getattr(_local, 'stack', None)
+        if stack and starts:
+            elapsed = time.perf_counter() - starts.pop()
+            # The query counts for the operation and all the operations it was called from
+            for timings in stack:
+                timings['sql'] += elapsed
+                timings['queries'] += 1
+
+
+def _rotate(directory, operation, keep):
+    profiles = sorted(
+        (name for name in os.listdir(directory) if name.startswith(operation + "-") and name.endswith(".json")),
+        reverse=True,
+    )
+    for name in profiles[keep:]:
+        for path in (name, name[:-len(".json")] + ".prof"):
+            try:
+                os.remove(os.path.join(directory, path))
+            except OSError:
+                pass
+
+
+def _dump(profiler, operation, sample, timings):
+    directory = _config("FIRST_BLOOD_PROFILE_DIR")
+    os.makedirs(directory, exist_ok=True)
+    # The timestamp first, so that the names sort chronologically
+    name = "{0}-{1}-{2}-{3}-{4:09d}".format(operation, time.strftime("%Y%m%d%H%M%S"), os.getpid(), threading.get_ident(), sample)
+    with open(os.path.join(directory, name + ".json"), "w") as f:
+        json.dump(timings, f)
+    if profiler is not None:
+        profiler.dump_stats(os.path.join(directory, name + ".prof"))
+    _rotate(directory, operation, int(_config("FIRST_BLOOD_PROFILE_KEEP", 100)))
+
+
+def profiled(operation):
+    """
+    Sample every FIRST_BLOOD_PROFILE_EVERY-th call of the decorated function with cProfile, if
+    FIRST_BLOOD_PROFILE_DIR is set. Each sample is written to that directory as <operation>-<time>-<pid>-<thread>-<n>.json
+    with the total, SQL and Python time of the call, next to a .prof (open it with pstats or snakeviz). Operations that
+    are called from another profiled operation only get the .json - their profile is part of the outer one.
+    Only the newest FIRST_BLOOD_PROFILE_KEEP samples of every operation are kept.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not has_app_context() or not _config("FIRST_BLOOD_PROFILE_DIR"):
+                return f(*args, **kwargs)
+            counter = _counters.setdefault(operation, itertools.count(1))
+            sample = next(counter)
+            if sample % max(int(_config("FIRST_BLOOD_PROFILE_EVERY", 100)), 1) != 0:
+                return f(*args, **kwargs)
+
+            from CTFd.models import db
+            _instrument_engine(db.engine)
+
+            if not hasattr(_local, 'stack'):
+                _local.stack = []
+            timings = {'operation': operation, 'sql': 0.0, 'queries': 0}
+            # cProfile can't nest
+            profiler = cProfile.Profile() if not _local.stack else None
+            _local.stack.append(timings)
+            start = time.perf_counter()
+            try:
+                if profiler is None:
+                    return f(*args, **kwargs)
+                return profiler.runcall(f, *args, **kwargs)
+            finally:
+                timings['total'] = time.perf_counter() - start
+                timings['python'] = timings['total'] - timings['sql']
+                _local.stack.pop()
+                try:
+                    _dump(profiler, operation, sample, timings)
+                    logger.info(
+                        "%s took %.1f ms: %.1f ms SQL in %d queries, %.1f ms Python", operation,
+                        timings['total'] * 1000, timings['sql'] * 1000, timings['queries'], timings['python'] * 1000,
+                    )
+                except OSError:
+                    logger.exception("Could not write the %s profile", operation)
+        return wrapper
+    return decorator
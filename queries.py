@@ -0,0 +1,159 @@
+from sqlalchemy import bindparam, func, literal
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session
+
+from CTFd.models import Challenges, Solves
+
+from .eligibility import eligibility_key, eligible_solve
+from .models import FirstBloodAward
+
+# The queries that run on every submission and recalculation are built and compiled once, then only re-executed
+# with new parameters. Anything a query closes over (the account model in the current user mode, the bracket
+# column, the eligibility rules) has to be part of the cache key, so it is passed along with every step.
+bakery = baked.bakery()
+
+
+def session_of(session):
+    """
+    The Session behind Flask-SQLAlchemy's scoped_session proxy (db.session). Baked queries need it, and so does any
+    state kept on the session, as the event listeners are given the Session itself.
+    """
+    return session() if isinstance(session, scoped_session) else session
+
+
+def count_eligible_solves_query(Model, bracket, bracket_value=None, locking=False):
+    """
+    The baked query behind count_eligible_solves(). With `locking`, it is a locking read (LOCK IN SHARE MODE)
+    """
+    query = bakery(lambda session: session.query(func.count(Solves.id), func.max(Solves.id)))
+    query += (lambda q: q.join(Model, Solves.account_id == Model.id).filter(
+        Solves.id <= bindparam("solve_id"),
+        Solves.challenge_id == bindparam("challenge_id"),
+    ), Model)
+    query += (lambda q: q.filter(eligible_solve(Model)), eligibility_key(Model))
+    if bracket is not None:
+        if bracket_value is not None:
+            query += (lambda q: q.filter(bracket == bindparam("bracket")), bracket)
+        else:
+            query += (lambda q: q.filter(bracket.is_(None)), bracket)
+    if locking:
+        query += lambda q: q.with_for_update(read=True)
+    return query
+
+
+def count_eligible_solves(session, Model, bracket, challenge_id, solve_id, bracket_value=None, locking=False):
+    """
+    (number, last id) of the eligible solves of the challenge up to (and including) solve_id - in the bracket, if one
+    is given. The solve itself is eligible if the last id is solve_id.
+    `bracket` is the bracket column of Model (or None), `bracket_value` the raw value of the solver's bracket.
+    With `locking`, the count sees the latest committed solves, even if the transaction read them before: on
+    MySQL/MariaDB, a plain read under the default REPEATABLE READ sees the snapshot of the transaction's first read,
+    so it is a locking read there. PostgreSQL reads the latest committed rows anyway (and doesn't allow FOR SHARE
+    with an aggregate), SQLite has only one writer.
+    """
+    session = session_of(session)
+    locking = locking and session.get_bind().dialect.name == "mysql"
+    params = {"solve_id": solve_id, "challenge_id": challenge_id}
+    if bracket is not None and bracket_value is not None:
+        params["bracket"] = bracket_value
+    return count_eligible_solves_query(Model, bracket, bracket_value, locking)(session).params(**params).one()
+
+
+def lock_challenge(session, challenge_id):
+    """
+    Lock the challenge row until the end of the transaction (SELECT ... FOR UPDATE - SQLite has no row locks, and
+    SQLAlchemy leaves the clause out there)
+    """
+    session.query(Challenges.id).filter(Challenges.id == challenge_id).with_for_update().one()
+
+
+def is_eligible_solve(session, Model, solve_id):
+    """
+    Whether the solve passes the eligibility rules - a lookup of the one solve, unlike count_eligible_solves()
+    """
+    query = bakery(lambda session: session.query(Solves.id))
+    query += (lambda q: q.join(Model, Solves.account_id == Model.id).filter(Solves.id == bindparam("solve_id")), Model)
+    query += (lambda q: q.filter(eligible_solve(Model)), eligibility_key(Model))
+    return query(session_of(session)).params(solve_id=solve_id).first() is not None
+
+
+def challenge_solves(session, Model, bracket, challenge_id):
+    """
+    (id, user_id, team_id, date, bracket) of the eligible solves of the challenge, in solve order
+    """
+    query = bakery(lambda session: session.query(
+        Solves.id,
+        Solves.user_id,
+        Solves.team_id,
+        Solves.date,
+        bracket if bracket is not None else literal(None),
+    ), Model, bracket)
+    query += (lambda q: q.join(Model, Solves.account_id == Model.id).filter(
+        Solves.challenge_id == bindparam("challenge_id"),
+    ).order_by(Solves.id), Model)
+    query += (lambda q: q.filter(eligible_solve(Model)), eligibility_key(Model))
+    return query(session_of(session)).params(challenge_id=challenge_id)
+
+
+def challenge_awards(session, challenge_id):
+    """
+    All first blood awards of the challenge
+    """
+    query = bakery(lambda session: session.query(FirstBloodAward))
+    query += lambda q: q.join(Solves, FirstBloodAward.solve_id == Solves.id).filter(
+        Solves.challenge_id == bindparam("challenge_id")
+    )
+    return query(session_of(session)).params(challenge_id=challenge_id)
+
+
+def solve_awards(session, solve_ids):
+    """
+    (award id, solve id) of the first blood awards of these solves
+    """
+    return session.query(FirstBloodAward.id, FirstBloodAward.solve_id).filter(FirstBloodAward.solve_id.in_(solve_ids))
+
+
+def challenge_award_accounts(session, challenge_id, limit):
+    """
+    (award id, user_id, team_id) of the first `limit` first blood awards of the challenge, in id order
+    """
+    return (
+        session.query(FirstBloodAward.id, FirstBloodAward.user_id, FirstBloodAward.team_id)
+        .join(Solves, FirstBloodAward.solve_id == Solves.id)
+        .filter(Solves.challenge_id == challenge_id)
+        .order_by(FirstBloodAward.id)
+        .limit(limit)
+    )
+
+
+def challenge_award_rows(session, challenge_id, limit):
+    """
+    The first `limit` first blood awards of the challenge in id order, with everything the archive keeps of them
+    """
+    return (
+        session.query(
+            FirstBloodAward.id,
+            FirstBloodAward.user_id,
+            FirstBloodAward.team_id,
+            FirstBloodAward.value,
+            FirstBloodAward.date,
+            FirstBloodAward.solve_id,
+            FirstBloodAward.solve_num,
+            FirstBloodAward.bracket,
+        )
+        .join(Solves, FirstBloodAward.solve_id == Solves.id)
+        .filter(Solves.challenge_id == challenge_id)
+        .order_by(FirstBloodAward.id)
+        .limit(limit)
+    )
+
+
+def account_first_blood_solves(session, account_id):
+    """
+    The solves of first blood challenges by the account (user or team, depending on the user mode)
+    """
+    return (
+        session.query(Solves)
+        .join(Challenges, Solves.challenge_id == Challenges.id)
+        .filter(Solves.account_id == account_id, Challenges.type == "firstblood")
+    )
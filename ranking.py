@@ -0,0 +1,190 @@
+import collections
+import threading
+import time
+import uuid
+
+from flask import current_app
+from sqlalchemy import literal
+
+from CTFd.cache import cache
+from CTFd.models import Solves, db
+from CTFd.utils.modes import get_model
+
+from .brackets import bracket_column, bracket_value
+from .eligibility import eligible_solve
+from .queries import session_of
+from .replica import note_write, read_session, replica_max_lag, use_replica
+
+# How many eligible solves (per bracket) are ranked at least, so that previews can look past the current bonus list
+DEFAULT_DEPTH = 10
+
+RankedSolve = collections.namedtuple("RankedSolve", ["solve_id", "account_id", "bracket", "solve_num", "date"])
+
+
+class RankingCache(object):
+    """
+    In-process LRU of the first eligible solves of every challenge. The entries are tagged with a generation token
+    that lives in the CTFd cache, so when that is Redis, invalidating a ranking in one worker invalidates it in all of them.
+    Rankings read from the replica may miss the latest writes, so they expire after the tolerated lag, and readers
+    that have to see their own writes skip them.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, app):
+        return cls(int(app.config.get("FIRST_BLOOD_RANKING_CACHE_SIZE", 256)))
+
+    def get(self, challenge_id, generation, depth, allow_replica=True):
+        with self._lock:
+            entry = self._entries.get(challenge_id)
+            if entry is None or entry[0] != generation or entry[1] < depth:
+                return None
+            expires = entry[3]
+            if expires is not None and (not allow_replica or expires <= time.time()):
+                return None
+            self._entries.move_to_end(challenge_id)
+            return entry[2]
+
+    def put(self, challenge_id, generation, depth, ranking, expires=None):
+        with self._lock:
+            self._entries[challenge_id] = (generation, depth, ranking, expires)
+            self._entries.move_to_end(challenge_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def discard(self, challenge_id):
+        with self._lock:
+            self._entries.pop(challenge_id, None)
+
+
+def _generation_key(challenge_id):
+    return "first_blood_ranking_generation_{0}".format(challenge_id)
+
+
+def _generation(challenge_id):
+    generation = cache.get(_generation_key(challenge_id))
+    if generation is None:
+        cache.add(_generation_key(challenge_id), uuid.uuid4().hex, timeout=0)
+        generation = cache.get(_generation_key(challenge_id))
+    return generation
+
+
+def _rankings():
+    return current_app.extensions["first_blood_rankings"]
+
+
+def compute_ranking(challenge, depth, session=None):
+    """
+    The first `depth` eligible solves of the challenge (in every bracket) from the database. Hidden and archived
+    challenges have none, as they give out no awards.
+    """
+    if challenge.state != 'visible' or challenge.first_blood_archived:
+        return ()
+    session = session or db.session
+    Model = get_model()
+
+    bracket = bracket_column(Model)
+    solves = (
+        session.query(Solves.id, Solves.account_id, Solves.date, bracket if bracket is not None else literal(None))
+        .join(Model, Solves.account_id == Model.id)
+        .filter(
+            Solves.challenge_id == challenge.id,
+            eligible_solve(Model),
+        )
+        .order_by(Solves.id)
+    )
+    if bracket is None:
+        solves = solves.limit(depth)
+
+    ranking = []
+    solve_nums = collections.Counter()
+    for solve_id, account_id, date, value in solves:
+        value = bracket_value(value)
+        solve_nums[value] += 1
+        if solve_nums[value] <= depth:
+            ranking.append(RankedSolve(solve_id, account_id, value, solve_nums[value], date))
+    return tuple(ranking)
+
+
+def get_ranking(challenge, depth=None):
+    """
+    The first eligible solves of the challenge as RankedSolves - at least as many as it has bonuses, and at least `depth`
+    """
+    depth = max(len(challenge.first_blood_bonus or []), int(current_app.config.get("FIRST_BLOOD_RANKING_DEPTH", DEFAULT_DEPTH)), depth or 0)
+    generation = _generation(challenge.id)
+    ranking = _rankings().get(challenge.id, generation, depth, allow_replica=use_replica())
+    if ranking is None:
+        # Only for display and previews, so this can come from the replica
+        with read_session() as session:
+            ranking = compute_ranking(challenge, depth, session)
+            expires = time.time() + replica_max_lag() if session is not db.session else None
+        _rankings().put(challenge.id, generation, depth, ranking, expires)
+    return ranking
+
+
+def invalidate_rankings(challenge_ids):
+    for challenge_id in challenge_ids:
+        cache.set(_generation_key(challenge_id), uuid.uuid4().hex, timeout=0)
+        _rankings().discard(challenge_id)
+
+
+def mark_rankings_stale(session, challenge_ids):
+    """
+    Invalidate the rankings of these challenges now, and again when the transaction ends - until then, other workers
+    can still read (and cache) the old state
+    """
+    challenge_ids = set(challenge_ids)
+    if not challenge_ids:
+        return
+    session = session_of(session)
+    invalidate_rankings(challenge_ids)
+    note_write(session)
+    if not hasattr(session, 'stale_rankings'):
+        session.stale_rankings = set()
+    session.stale_rankings.update(challenge_ids)
+
+
+def invalidate_stale_rankings(session):
+    stale = getattr(session, 'stale_rankings', None)
+    if not stale:
+        return
+    del session.stale_rankings
+    invalidate_rankings(stale)
+
+
+def preview_award_changes(challenge, first_blood_bonus):
+    """
+    What would change if the challenge had the given bonus list, from the cached ranking - nothing is written
+    """
+    ranking = get_ranking(challenge, len(first_blood_bonus))
+    current_bonus = challenge.first_blood_bonus or []
+
+    def points(bonus, solve_num):
+        return bonus[solve_num - 1] if solve_num <= len(bonus) else None
+
+    changes = []
+    current_total = proposed_total = 0
+    for solve in ranking:
+        current = points(current_bonus, solve.solve_num)
+        proposed = points(first_blood_bonus, solve.solve_num)
+        current_total += current or 0
+        proposed_total += proposed or 0
+        if current == proposed:
+            continue
+        changes.append({
+            'solve_id': solve.solve_id,
+            'account_id': solve.account_id,
+            'bracket': solve.bracket,
+            'solve_num': solve.solve_num,
+            'current': current,
+            'proposed': proposed,
+        })
+    return {
+        'changes': changes,
+        'current_total': current_total,
+        'proposed_total': proposed_total,
+    }
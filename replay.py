@@ -0,0 +1,133 @@
+from CTFd.models import Solves, db
+from CTFd.utils import get_config, set_config
+
+from .bulk import BATCH_SIZE, delete_awards, import_mode, insert_awards
+from .eventlog import REVOKE
+from .models import FirstBloodAwardEvent, FirstBloodChallenge, FirstBloodCheckpoint, award_text
+from .summary import rebuild_summaries
+
+CHECKPOINT_CONFIG_KEY = "first_blood_checkpoint"
+
+
+def fold_events(challenge_ids=None, from_checkpoint=True, session=None):
+    """
+    Fold the event log (optionally starting from the last checkpoint) into the awards it describes.
+    Returns ({solve_id: (challenge_id, user_id, team_id, solve_num, bracket, value)}, id of the last folded event)
+    """
+    session = session or db.session
+    state = {}
+    since = 0
+
+    if from_checkpoint:
+        since = int(get_config(CHECKPOINT_CONFIG_KEY) or 0)
+        rows = session.query(
+            FirstBloodCheckpoint.solve_id,
+            FirstBloodCheckpoint.challenge_id,
+            FirstBloodCheckpoint.user_id,
+            FirstBloodCheckpoint.team_id,
+            FirstBloodCheckpoint.solve_num,
+            FirstBloodCheckpoint.bracket,
+            FirstBloodCheckpoint.value,
+        )
+        if challenge_ids is not None:
+            rows = rows.filter(FirstBloodCheckpoint.challenge_id.in_(challenge_ids))
+        for row in rows:
+            state[row.solve_id] = (row.challenge_id, row.user_id, row.team_id, row.solve_num, row.bracket, row.value)
+
+    events = session.query(
+        FirstBloodAwardEvent.id,
+        FirstBloodAwardEvent.kind,
+        FirstBloodAwardEvent.challenge_id,
+        FirstBloodAwardEvent.solve_id,
+        FirstBloodAwardEvent.user_id,
+        FirstBloodAwardEvent.team_id,
+        FirstBloodAwardEvent.solve_num,
+        FirstBloodAwardEvent.bracket,
+        FirstBloodAwardEvent.value,
+    ).filter(FirstBloodAwardEvent.id > since)
+    if challenge_ids is not None:
+        events = events.filter(FirstBloodAwardEvent.challenge_id.in_(challenge_ids))
+
+    last = since
+    for e in events.order_by(FirstBloodAwardEvent.id).yield_per(BATCH_SIZE):
+        last = e.id
+        if e.kind == REVOKE:
+            state.pop(e.solve_id, None)
+        else:
+            state[e.solve_id] = (e.challenge_id, e.user_id, e.team_id, e.solve_num, e.bracket, e.value)
+    return state, last
+
+
+def create_checkpoint(session=None):
+    """
+    Snapshot the current state of the event log, so that later replays only need to read the events after it.
+    Commits the session.
+    """
+    session = session or db.session
+    state, last = fold_events(from_checkpoint=True, session=session)
+
+    checkpoint = FirstBloodCheckpoint.__table__
+    session.execute(checkpoint.delete())
+    rows = [
+        {'solve_id': solve_id, 'challenge_id': challenge_id, 'user_id': user_id, 'team_id': team_id,
+         'solve_num': solve_num, 'bracket': bracket, 'value': value}
+        for solve_id, (challenge_id, user_id, team_id, solve_num, bracket, value) in state.items()
+    ]
+    for i in range(0, len(rows), BATCH_SIZE):
+        session.execute(checkpoint.insert(), rows[i:i + BATCH_SIZE])
+    set_config(CHECKPOINT_CONFIG_KEY, last)
+    return last
+
+
+def replay(challenge_ids=None, from_checkpoint=True, session=None):
+    """
+    Rebuild the awards of all (or the given) first blood challenges from the event log, without rescanning the solves.
+    Awards whose solve no longer exists are skipped. Nothing is logged for the rebuilt awards.
+    You have to call db.session.commit() manually after this!
+    """
+    session = session or db.session
+
+    # The awards of archived challenges are in the archive, not in the awards tables
+    challenges = FirstBloodChallenge.query.filter(FirstBloodChallenge.first_blood_archived == False)
+    if challenge_ids is not None:
+        challenges = challenges.filter(FirstBloodChallenge.id.in_(challenge_ids))
+    challenges = {challenge.id: challenge for challenge in challenges}
+    if not challenges:
+        return 0
+
+    state, _ = fold_events(list(challenges) if challenge_ids is not None else None, from_checkpoint, session)
+    solve_ids = sorted(solve_id for solve_id, award in state.items() if award[0] in challenges)
+
+    with import_mode(session):
+        delete_awards(list(challenges), session, log=False)
+
+        # The awards are dated with their solve
+        solve_dates = {}
+        for i in range(0, len(solve_ids), BATCH_SIZE):
+            chunk = solve_ids[i:i + BATCH_SIZE]
+            solve_dates.update(session.query(Solves.id, Solves.date).filter(Solves.id.in_(chunk)))
+
+        def awards():
+            for solve_id in solve_ids:
+                if solve_id not in solve_dates:
+                    continue
+                challenge_id, user_id, team_id, solve_num, bracket, value = state[solve_id]
+                name, description, icon = award_text(challenges[challenge_id].name, solve_num, bracket)
+                yield challenge_id, {
+                    'user_id': user_id,
+                    'team_id': team_id,
+                    'name': name,
+                    'description': description,
+                    'category': 'First Blood',
+                    'date': solve_dates[solve_id],
+                    'value': value,
+                    'icon': icon,
+                    'solve_id': solve_id,
+                    'solve_num': solve_num,
+                    'bracket': bracket,
+                }
+
+        count = insert_awards(session, awards(), log=False)
+        rebuild_summaries(session)
+    session.expire_all()
+    return count
@@ -0,0 +1,100 @@
+import contextlib
+import math
+import threading
+import time
+
+from flask import current_app, has_request_context
+from flask import session as user_session
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from CTFd.cache import cache
+from CTFd.models import db
+
+from .queries import session_of
+
+# Writes made outside of a request (command line, background jobs), or by nobody in particular
+LAST_WRITE_KEY = "first_blood_last_write"
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def _replica_sessionmaker(uri):
+    with _engines_lock:
+        if uri not in _engines:
+            _engines[uri] = sessionmaker(bind=create_engine(uri, pool_pre_ping=True))
+        return _engines[uri]
+
+
+def replica_max_lag():
+    return float(current_app.config.get("FIRST_BLOOD_REPLICA_MAX_LAG", 5))
+
+
+def _last_write_keys():
+    """
+    The cache keys of the writes that the current reader has to see: the last write of the user making the request,
+    if there is one, and the last write that was made outside of any user's request
+    """
+    user_id = user_session.get("id") if has_request_context() else None
+    if user_id is None:
+        return [LAST_WRITE_KEY]
+    return [LAST_WRITE_KEY, "{0}_{1}".format(LAST_WRITE_KEY, user_id)]
+
+
+def note_write(session):
+    """
+    Record that this transaction changes first blood data (awards, or the solves they are ranked by)
+    """
+    session_of(session).first_blood_written = True
+
+
+def mark_written(session):
+    """
+    Called when the transaction ends. If it committed first blood changes, the reads of whoever made them stay on the
+    primary until the replica has caught up, so that they see their own writes. Everyone else keeps reading from the
+    replica, within the tolerated lag. The time of the write is stored in the CTFd cache, so all workers see it.
+    """
+    if getattr(session, 'first_blood_written', False):
+        del session.first_blood_written
+        # Once the replica has caught up, the key isn't needed anymore
+        cache.set(_last_write_keys()[-1], time.time(), timeout=max(int(math.ceil(replica_max_lag())), 1))
+
+
+def discard_written(session):
+    if hasattr(session, 'first_blood_written'):
+        del session.first_blood_written
+
+
+def use_replica():
+    """
+    Whether reads may go to FIRST_BLOOD_REPLICA_URI right now - only if it is configured, and if the current user
+    (and anything outside of a request) wrote nothing during the last FIRST_BLOOD_REPLICA_MAX_LAG seconds (the
+    replication lag that is tolerated, default 5)
+    """
+    if not current_app.config.get("FIRST_BLOOD_REPLICA_URI"):
+        return False
+    now = time.time()
+    max_lag = replica_max_lag()
+    for key in _last_write_keys():
+        last_write = cache.get(key)
+        if last_write is not None and now - last_write < max_lag:
+            return False
+    return True
+
+
+@contextlib.contextmanager
+def read_session():
+    """
+    A session for read-only queries that can tolerate some staleness (rankings for display, summaries, exports,
+    verification scans) - on the replica when use_replica() allows it, otherwise db.session.
+    Anything that assigns ranks or writes has to use db.session!
+    """
+    if not use_replica():
+        yield db.session
+        return
+    session = _replica_sessionmaker(current_app.config["FIRST_BLOOD_REPLICA_URI"])()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,223 @@
+from sqlalchemy import func
+
+from CTFd.models import Awards, Challenges, Solves, db
+from CTFd.utils.modes import get_model
+
+from .brackets import bracket_column, bracket_value
+from .eligibility import eligible_solve
+from .models import FirstBloodChallenge
+
+
+def _numpy():
+    # NumPy is only needed by this admin tool, so it isn't a hard dependency of the plugin
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("The bonus schedule simulator needs NumPy, install it with `pip install numpy`")
+    return numpy
+
+
+class SolveHistory(object):
+    """
+    The historical solves of all first blood challenges, loaded into NumPy arrays once so that any number of
+    bonus schedules can be simulated against them without touching the database (or the awards) again.
+    Only the first `max_rank` eligible solves of every challenge (and bracket) are kept, as only those can get a bonus.
+    """
+
+    def __init__(self, challenge_ids, current_bonus, account_ids, account_names, base_scores, last_solve,
+                 solve_challenge, solve_account, solve_rank):
+        self.challenge_ids = challenge_ids
+        self.current_bonus = current_bonus  # (challenges, ranks) - the bonus schedules that are configured now
+        self.account_ids = account_ids
+        self.account_names = account_names
+        self.base_scores = base_scores  # Score of every account without any first blood bonus
+        self.last_solve = last_solve  # Tie breaker - the account that reached its score first ranks higher
+        self.solve_challenge = solve_challenge
+        self.solve_account = solve_account
+        self.solve_rank = solve_rank  # 0 for the first blood, 1 for the second...
+
+    @classmethod
+    def load(cls, max_rank, until=None, session=None):
+        """
+        Load the solves (up to the `until` datetime, if given) of the visible first blood challenges that are not archived
+        """
+        np = _numpy()
+        session = session or db.session
+        Model = get_model()
+
+        challenges = (
+            FirstBloodChallenge.query.filter(
+                FirstBloodChallenge.state == 'visible', FirstBloodChallenge.first_blood_archived == False
+            )
+            .order_by(FirstBloodChallenge.id)
+            .all()
+        )
+        challenge_ids = np.array([c.id for c in challenges], dtype=np.int64)
+        width = max([max_rank] + [len(c.first_blood_bonus or []) for c in challenges])
+        current_bonus = np.zeros((len(challenges), width), dtype=np.int64)
+        for i, c in enumerate(challenges):
+            # Ranks without a bonus are stored as None
+            current_bonus[i, :len(c.first_blood_bonus or [])] = [points or 0 for points in c.first_blood_bonus or []]
+
+        # Only accounts that show up on the scoreboard
+        accounts = (
+            session.query(Model.id, Model.name)
+            .filter(Model.hidden == False, Model.banned == False)
+            .order_by(Model.id)
+            .all()
+        )
+        account_ids = np.array([a.id for a in accounts], dtype=np.int64)
+        account_names = [a.name for a in accounts]
+
+        def per_account(query, dtype):
+            # Rows of accounts that aren't on the scoreboard are dropped
+            result = np.zeros(len(account_ids), dtype=dtype)
+            index = {account_id: i for i, account_id in enumerate(account_ids.tolist())}
+            for account_id, value in query:
+                if account_id in index and value is not None:
+                    result[index[account_id]] = value
+            return result
+
+        solve_filter = [Challenges.state == 'visible']
+        award_filter = [Awards.type != 'firstblood']
+        if until is not None:
+            solve_filter.append(Solves.date <= until)
+            award_filter.append(Awards.date <= until)
+        base_scores = per_account(
+            session.query(Solves.account_id, func.sum(Challenges.value))
+            .join(Challenges, Solves.challenge_id == Challenges.id)
+            .filter(*solve_filter)
+            .group_by(Solves.account_id),
+            np.int64,
+        ) + per_account(
+            session.query(Awards.account_id, func.sum(Awards.value))
+            .filter(*award_filter)
+            .group_by(Awards.account_id),
+            np.int64,
+        )
+        last_solve = per_account(
+            session.query(Solves.account_id, func.max(Solves.id))
+            .filter(*solve_filter[1:])
+            .group_by(Solves.account_id),
+            np.int64,
+        )
+
+        columns = [Solves.id, Solves.challenge_id, Solves.account_id]
+        bracket = bracket_column(Model)
+        if bracket is not None:
+            columns.append(bracket)
+        solves = (
+            session.query(*columns)
+            .join(Model, Solves.account_id == Model.id)
+            .filter(
+                Solves.challenge_id.in_(challenge_ids.tolist()),
+                eligible_solve(Model),
+                *solve_filter[1:]
+            )
+            .order_by(Solves.id)
+            .all()
+        )
+
+        solve_challenge = np.searchsorted(challenge_ids, np.array([s[1] for s in solves], dtype=np.int64))
+        solve_account_ids = np.array([s[2] for s in solves], dtype=np.int64)
+        solve_account = np.searchsorted(account_ids, solve_account_ids)
+        # Every challenge (and bracket) is ranked separately
+        groups = solve_challenge
+        if bracket is not None:
+            _, bracket_codes = np.unique(np.array([str(bracket_value(s[3])) for s in solves]), return_inverse=True)
+            groups = solve_challenge * (bracket_codes.max(initial=0) + 1) + bracket_codes
+
+        # Rank the solves within their group - a stable sort keeps the solve order inside a group
+        order = np.argsort(groups, kind="stable")
+        sorted_groups = groups[order]
+        positions = np.arange(len(order))
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = sorted_groups[1:] != sorted_groups[:-1]
+        solve_rank = np.empty(len(order), dtype=np.int64)
+        solve_rank[order] = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+
+        # Depending on the eligibility rules, accounts that aren't on the scoreboard can still take a rank
+        keep = (solve_rank < width) & np.isin(solve_account_ids, account_ids)
+        return cls(
+            challenge_ids, current_bonus, account_ids, account_names, base_scores, last_solve,
+            solve_challenge[keep], solve_account[keep], solve_rank[keep],
+        )
+
+    def bonuses(self, schedules):
+        """
+        The first blood bonus of every account under each schedule, as an (schedules, accounts) array.
+        A schedule is a list of bonus points (1st, 2nd, ...) applied to every challenge, or None for the current ones.
+        """
+        np = _numpy()
+        width = self.current_bonus.shape[1]
+        matrix = np.zeros((len(schedules), width), dtype=np.int64)
+        current = []
+        for i, schedule in enumerate(schedules):
+            if schedule is None:
+                current.append(i)
+            else:
+                schedule = list(schedule)[:width]
+                matrix[i, :len(schedule)] = schedule
+
+        per_solve = matrix[:, self.solve_rank]  # (schedules, solves)
+        if current:
+            per_solve[current] = self.current_bonus[self.solve_challenge, self.solve_rank]
+
+        accounts = len(self.account_ids)
+        flat = (np.arange(len(schedules))[:, None] * accounts + self.solve_account[None, :]).ravel()
+        totals = np.bincount(flat, weights=per_solve.ravel(), minlength=len(schedules) * accounts)
+        return totals.reshape(len(schedules), accounts).astype(np.int64)
+
+    def places(self, scores):
+        """
+        Scoreboard place (0-based) of every account for each row of scores
+        """
+        np = _numpy()
+        tie_breaker = np.broadcast_to(self.last_solve, scores.shape)
+        order = np.lexsort((tie_breaker, -scores), axis=-1)
+        places = np.empty_like(order)
+        np.put_along_axis(places, order, np.arange(scores.shape[1])[None, :].repeat(scores.shape[0], axis=0), axis=-1)
+        return places
+
+
+def simulate(history, schedules, top=10):
+    """
+    Simulate the given bonus schedules (see SolveHistory.bonuses()) and compare the resulting scoreboards
+    to the one of the currently configured schedules. Returns one dict per schedule.
+    """
+    np = _numpy()
+    schedules = [None] + list(schedules)
+    bonuses = history.bonuses(schedules)
+    scores = history.base_scores[None, :] + bonuses
+    places = history.places(scores)
+    shifts = places - places[0]
+    awarded = (history.current_bonus[history.solve_challenge, history.solve_rank] > 0).sum()
+
+    results = []
+    for i, schedule in enumerate(schedules):
+        if schedule is None:
+            awards = int(awarded)
+        else:
+            awards = int((np.array(list(schedule) + [0])[np.minimum(history.solve_rank, len(schedule))] > 0).sum())
+        podium = np.argsort(places[i])[:top]
+        results.append({
+            "schedule": None if schedule is None else list(schedule),
+            "awards": awards,
+            "total_bonus": int(bonuses[i].sum()),
+            "moved": int(np.count_nonzero(shifts[i])),
+            "max_shift": int(np.abs(shifts[i]).max(initial=0)),
+            "top": [history.account_names[a] for a in podium],
+            "top_changed": int(np.count_nonzero(shifts[i][podium])) if len(podium) else 0,
+        })
+    return results
+
+
+def random_schedules(count, max_rank, max_bonus, seed=None):
+    """
+    Generate decreasing bonus schedules to explore, e.g. 40,25,10
+    """
+    np = _numpy()
+    rng = np.random.default_rng(seed)
+    ranks = rng.integers(1, max_rank + 1, size=count)
+    values = -np.sort(-rng.integers(1, max_bonus + 1, size=(count, max_rank)), axis=1)
+    return [values[i, :ranks[i]].tolist() for i in range(count)]
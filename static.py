@@ -0,0 +1,94 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Blueprint, Response, abort, current_app, request
+
+ASSETS_DIR = os.path.join(os.path.dirname(__file__), "assets")
+
+# Where the fingerprinted assets are served from - the plain files stay available under assets/ as well
+STATIC_ROUTE = "/plugins/CTFd_first_blood/static"
+
+# Fingerprinted URLs never change content, so browsers can keep them for a year without revalidating
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Don't bother compressing tiny files
+MIN_COMPRESS_SIZE = 256
+
+static_blueprint = Blueprint("first_blood_static", __name__)
+
+
+def _brotli():
+    # Brotli is optional - without it, only gzip variants are served
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class Asset(object):
+    """
+    One file of the assets directory, with its fingerprint and its precompressed variants
+    """
+
+    def __init__(self, name, content):
+        self.name = name
+        self.fingerprint = hashlib.sha256(content).hexdigest()[:12]
+        self.mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        # Content-Encoding -> body, best encoding first
+        self.variants = {}
+        if len(content) >= MIN_COMPRESS_SIZE:
+            brotli = _brotli()
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(content)
+            self.variants["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        self.variants = {encoding: body for encoding, body in self.variants.items() if len(body) < len(content)}
+        self.variants["identity"] = content
+
+    @property
+    def url(self):
+        return "{0}/{1}/{2}".format(STATIC_ROUTE, self.fingerprint, self.name)
+
+    def negotiate(self, accept_encoding):
+        """
+        (Content-Encoding, body) of the best variant the client accepts
+        """
+        accepted = {part.split(";")[0].strip() for part in (accept_encoding or "").split(",")}
+        for encoding, body in self.variants.items():
+            if encoding in accepted or encoding == "identity":
+                return encoding, body
+
+
+class AssetBundle(object):
+    """
+    The plugin's assets, read, fingerprinted and compressed once when CTFd starts
+    """
+
+    def __init__(self, directory=ASSETS_DIR):
+        self.assets = {}
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    self.assets[name] = Asset(name, f.read())
+
+    def url(self, name):
+        return self.assets[name].url
+
+
+@static_blueprint.route(STATIC_ROUTE + "/<fingerprint>/<name>")
+def serve_asset(fingerprint, name):
+    asset = current_app.extensions["first_blood_assets"].assets.get(name)
+    if asset is None:
+        abort(404)
+    encoding, body = asset.negotiate(request.headers.get("Accept-Encoding"))
+    response = Response(body, mimetype=asset.mimetype)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    # A page rendered before an upgrade can still ask for the old fingerprint - it gets the current file, but
+    # that must not be cached under the old URL
+    response.headers["Cache-Control"] = IMMUTABLE if fingerprint == asset.fingerprint else "no-cache"
+    return response
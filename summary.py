@@ -0,0 +1,92 @@
+from sqlalchemy import func, select
+
+from CTFd.models import Awards, Teams, db
+from CTFd.utils.modes import get_model
+
+from .models import FirstBloodAward, FirstBloodSummary
+from .replica import read_session
+
+
+def _award_account_column():
+    awards = Awards.__table__
+    return awards.c.team_id if get_model() is Teams else awards.c.user_id
+
+
+def award_account_id(award):
+    return award.team_id if get_model() is Teams else award.user_id
+
+
+def mark_accounts_for_refresh(session, account_ids):
+    """
+    Mark the summary of these accounts as stale. The summaries are rebuilt by after_flush_postexec
+    """
+    account_ids = set(account_ids) - {None}
+    if not account_ids:
+        return
+    if not hasattr(session, 'requires_summary_refresh'):
+        session.requires_summary_refresh = set()
+    session.requires_summary_refresh.update(account_ids)
+
+
+def _summary_select(account_ids=None):
+    awards = Awards.__table__
+    first_blood_awards = FirstBloodAward.__table__
+    account = _award_account_column()
+
+    query = (
+        select([account, first_blood_awards.c.solve_num, func.count(), func.sum(awards.c.value)])
+        .select_from(awards.join(first_blood_awards, awards.c.id == first_blood_awards.c.id))
+        .where(account.isnot(None))
+        .group_by(account, first_blood_awards.c.solve_num)
+    )
+    if account_ids is not None:
+        query = query.where(account.in_(account_ids))
+    return query
+
+
+def refresh_summaries(session, account_ids):
+    """
+    Rebuild the summary rows of the given accounts from their current awards
+    """
+    account_ids = sorted(account_ids)
+    if not account_ids:
+        return
+    summary = FirstBloodSummary.__table__
+    session.execute(summary.delete().where(summary.c.account_id.in_(account_ids)))
+    session.execute(
+        summary.insert().from_select(
+            [summary.c.account_id, summary.c.solve_num, summary.c.count, summary.c.value],
+            _summary_select(account_ids),
+        )
+    )
+
+
+def rebuild_summaries(session=None):
+    """
+    Rebuild the summary table for all accounts (e.g. after switching between user and team mode)
+    You have to call db.session.commit() manually after this!
+    """
+    session = session or db.session
+    summary = FirstBloodSummary.__table__
+    session.execute(summary.delete())
+    session.execute(
+        summary.insert().from_select(
+            [summary.c.account_id, summary.c.solve_num, summary.c.count, summary.c.value],
+            _summary_select(),
+        )
+    )
+
+
+def get_summary(account_id):
+    with read_session() as session:
+        rows = (
+            session.query(FirstBloodSummary).filter_by(account_id=account_id)
+            .order_by(FirstBloodSummary.solve_num)
+            .all()
+        )
+    return {
+        "account_id": account_id,
+        "ranks": [{"solve_num": row.solve_num, "count": row.count, "value": row.value} for row in rows],
+        "count": sum(row.count for row in rows),
+        "value": sum(row.value for row in rows),
+    }
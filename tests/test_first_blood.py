@@ -981,3 +981,1866 @@ def test_awards_recalculated_on_challenge_hidden():
         assert Awards.query.count() == 3
 
     destroy_ctfd(app)
+
+def test_first_blood_announced_to_webhook():
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from CTFd.plugins.CTFd_first_blood.notifications import FirstBloodAnnouncer
+
+    received = []
+
+    class WebhookStub(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), WebhookStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        announcer = FirstBloodAnnouncer(app, webhooks=["http://127.0.0.1:{0}/".format(server.server_port)], batch_delay=0.1)
+        app.extensions["first_blood_announcer"] = announcer
+
+        gen_user(app.db, name="user1", email="user1@ctfd.io")
+        gen_user(app.db, name="user2", email="user2@ctfd.io")
+        gen_user(app.db, name="user3", email="user3@ctfd.io")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        assert announcer.flush(timeout=10)
+        announcements = [a for payload in received for a in payload["announcements"]]
+        assert [a["account"] for a in announcements] == ["user1", "user2"]
+        assert [a["solve_num"] for a in announcements] == [1, 2]
+        assert announcements[0]["text"] == "First blood on name by user1!"
+        assert announcements[1]["text"] == "2nd blood on name by user2!"
+
+    server.shutdown()
+    destroy_ctfd(app)
+
+def test_verify_awards_detects_broken_ranks():
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io")
+        gen_user(app.db, name="user2", email="user2@ctfd.io")
+        gen_user(app.db, name="user3", email="user3@ctfd.io")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        award = FirstBloodAward.query.filter_by(solve_num=3).first()
+        award.solve_num = 2
+        app.db.session.commit()
+
+        problems = FirstBloodValueChallenge.verify_awards(challenge)
+        assert any("duplicate" in problem for problem in problems)
+        assert any("gaps" in problem for problem in problems)
+
+    destroy_ctfd(app)
+
+def test_summary_maintained_with_awards():
+    from CTFd.plugins.CTFd_first_blood.summary import get_summary, rebuild_summaries
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        user1 = gen_user(app.db, name="user1", email="user1@ctfd.io")
+        user2 = gen_user(app.db, name="user2", email="user2@ctfd.io")
+        user1_id, user2_id = user1.id, user2.id
+
+        challenge_ids = []
+        for name in ["chal1", "chal2"]:
+            challenge_data = {
+                "name": name,
+                "category": "category",
+                "description": "description",
+                "value": 100,
+                "first_blood_bonus[0]": 30,
+                "first_blood_bonus[1]": 20,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            req = FakeRequest(form=challenge_data)
+            challenge = FirstBloodValueChallenge.create(req)
+            gen_flag(app.db, challenge_id=challenge.id, content="flag")
+            challenge_ids.append(challenge.id)
+        app.db.session.commit()
+
+        for challenge_id in challenge_ids:
+            for user in ["user1", "user2"]:
+                client = login_as_user(app, name=user, password="password")
+                data = {"submission": "flag", "challenge_id": challenge_id}
+                r = client.post("/api/v1/challenges/attempt", json=data)
+                assert r.status_code == 200
+
+        summary = get_summary(user1_id)
+        assert summary["ranks"] == [{"solve_num": 1, "count": 2, "value": 60}]
+        assert summary["count"] == 2
+        assert summary["value"] == 60
+
+        client = login_as_user(app, name="user2", password="password")
+        r = client.get("/api/v1/firstblood/accounts/{0}/summary".format(user2_id))
+        assert r.status_code == 200
+        assert r.get_json()["data"]["ranks"] == [{"solve_num": 2, "count": 2, "value": 40}]
+
+        # Hiding user1 moves user2 up to first place
+        client = login_as_user(app, name="admin", password="password")
+        r = client.patch("/api/v1/users/{0}".format(user1_id), json={'hidden': True})
+        assert r.status_code == 200
+        assert get_summary(user1_id)["ranks"] == []
+        assert get_summary(user2_id)["ranks"] == [{"solve_num": 1, "count": 2, "value": 60}]
+
+        # Removing a challenge removes its awards from the summary
+        FirstBloodValueChallenge.delete(Challenges.query.get(challenge_ids[0]))
+        assert get_summary(user2_id)["ranks"] == [{"solve_num": 1, "count": 1, "value": 30}]
+
+        rebuild_summaries()
+        app.db.session.commit()
+        assert get_summary(user2_id)["ranks"] == [{"solve_num": 1, "count": 1, "value": 30}]
+
+    destroy_ctfd(app)
+
+def test_recalculation_skipped_while_other_worker_holds_lease():
+    from CTFd.cache import cache
+    from CTFd.plugins.CTFd_first_blood.leases import _dirty_key, _lease_key, pop_dirty
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+        user2 = Users.query.filter_by(name="user2").first()
+        user3 = Users.query.filter_by(name="user3").first()
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        # Another worker is recalculating this challenge right now - we only mark it dirty
+        cache.set(_lease_key(challenge.id), "other-worker")
+        user2.hidden = True
+        app.db.session.commit()
+        assert cache.get(_dirty_key(challenge.id))
+        _check_first_blood_awards_data(challenge, [
+            {"user": "user2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ])
+
+        # Once the lease is free, the next recalculation picks up both changes
+        cache.delete(_lease_key(challenge.id))
+        user3.hidden = True
+        app.db.session.commit()
+        assert not cache.get(_dirty_key(challenge.id))
+        assert not cache.get(_lease_key(challenge.id))
+        _check_first_blood_awards_data(challenge, [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": None},
+            {"user": "user3", "solved": True, "bonus_points": None},
+            {"user": "user4", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ])
+
+        # Checking the dirty mark consumes it
+        cache.set(_dirty_key(challenge.id), True)
+        assert pop_dirty(challenge.id)
+        assert not pop_dirty(challenge.id)
+
+    destroy_ctfd(app)
+
+def test_dirty_challenge_recalculated_after_lease_released():
+    from CTFd.cache import cache
+    from CTFd.plugins.CTFd_first_blood.leases import _dirty_key, _lease_key, acquire_lease
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        # Another transaction holds the lease, and is past its last check for dirty marks
+        other = app.db.session.session_factory()
+        assert acquire_lease(other, challenge.id)
+
+        # This change is only marked dirty, once it is committed
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.hidden = True
+        app.db.session.commit()
+        assert cache.get(_dirty_key(challenge.id))
+        _check_first_blood_awards_data(challenge, [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+        ])
+
+        # The holder recalculates it again once its transaction is over, in a new one
+        other.commit()
+        other.close()
+        # As the next request sees it
+        app.db.session.expire_all()
+        assert not cache.get(_dirty_key(challenge.id))
+        assert not cache.get(_lease_key(challenge.id))
+        _check_first_blood_awards_data(challenge, [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ])
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+    destroy_ctfd(app)
+
+
+def test_bulk_import_generates_awards():
+    from CTFd.plugins.CTFd_first_blood.bulk import generate_awards, import_solves
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        users = [gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i)) for i in range(1, 6)]
+        users[1].hidden = True
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        app.db.session.commit()
+
+        count = import_solves({"challenge_id": challenge.id, "user_id": user.id} for user in users)
+        assert count == 5
+        assert FirstBloodAward.query.count() == 0  # The per-solve hooks didn't run
+
+        assert generate_awards() == 3
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": None},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+            {"user": "user5", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        # Regenerating replaces the awards instead of duplicating them
+        assert generate_awards([challenge.id]) == 3
+        app.db.session.commit()
+        assert Awards.query.count() == 3
+
+    destroy_ctfd(app)
+
+def test_export_first_blood_results():
+    import json
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io")
+        gen_user(app.db, name="user2", email="user2@ctfd.io")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        r = client.get("/api/v1/firstblood/export?format=csv")
+        assert r.status_code == 403
+
+        client = login_as_user(app, name="admin", password="password")
+        r = client.get("/api/v1/firstblood/export?format=csv")
+        assert r.status_code == 200
+        lines = r.get_data(as_text=True).splitlines()
+        assert lines[0] == "challenge_id,challenge,category,solve_num,bracket,account_id,account,solve_id,solved_at,value,archived"
+        assert lines[1].startswith("{0},name,category,1,".format(challenge.id))
+        assert lines[1].endswith(",30,False")
+        assert len(lines) == 3
+
+        r = client.get("/api/v1/firstblood/export?format=jsonl")
+        assert r.status_code == 200
+        rows = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+        assert [(row["account"], row["solve_num"], row["value"]) for row in rows] == [("user1", 1, 30), ("user2", 2, 20)]
+
+    destroy_ctfd(app)
+
+def test_awards_rebuilt_from_event_log():
+    from CTFd.plugins.CTFd_first_blood.eventlog import GRANT, REVOKE, SHIFT, award_history
+    from CTFd.plugins.CTFd_first_blood.replay import create_checkpoint, replay
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+        user1 = Users.query.filter_by(name="user1").first()
+        user2 = Users.query.filter_by(name="user2").first()
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        user1.hidden = True
+        app.db.session.commit()
+        create_checkpoint()
+        user2.hidden = True
+        app.db.session.commit()
+
+        kinds = [e.kind for e in reversed(award_history(challenge_id=challenge.id))]
+        assert kinds.count(GRANT) == 4
+        assert kinds.count(REVOKE) == 2
+        assert kinds.count(SHIFT) == 2
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": None},
+            {"user": "user3", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user4", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+
+        # Lose all the awards, then restore them from the log - both from the checkpoint and from scratch
+        for from_checkpoint in [True, False]:
+            FirstBloodAward.query.delete()
+            Awards.query.delete()
+            app.db.session.commit()
+            assert replay(from_checkpoint=from_checkpoint) == 2
+            app.db.session.commit()
+            _check_first_blood_awards_data(challenge, expected_data)
+
+    destroy_ctfd(app)
+
+def test_awards_ranked_per_bracket():
+    from CTFd.plugins.CTFd_first_blood.bulk import generate_awards
+
+    app = create_ctfd(enable_plugins=True)
+    app.config["FIRST_BLOOD_BRACKET_FIELD"] = "affiliation"
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io", affiliation="Students")
+        gen_user(app.db, name="user2", email="user2@ctfd.io", affiliation="Professionals")
+        gen_user(app.db, name="user3", email="user3@ctfd.io", affiliation="Students")
+        gen_user(app.db, name="user4", email="user4@ctfd.io", affiliation="Professionals")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        def ranks():
+            return sorted(
+                (award.bracket, award.solve_num, award.value, award.name)
+                for award in FirstBloodAward.query.all()
+            )
+
+        expected = [
+            ("Professionals", 1, 30, "1st blood for name (Professionals)"),
+            ("Professionals", 2, 20, "2nd blood for name (Professionals)"),
+            ("Students", 1, 30, "1st blood for name (Students)"),
+            ("Students", 2, 20, "2nd blood for name (Students)"),
+        ]
+        assert ranks() == expected
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        # The set-based generation ranks the same way
+        generate_awards()
+        app.db.session.commit()
+        assert ranks() == expected
+
+        # Moving to another bracket re-ranks both brackets
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.affiliation = "Professionals"
+        app.db.session.commit()
+        assert ranks() == [
+            ("Professionals", 1, 30, "1st blood for name (Professionals)"),
+            ("Professionals", 2, 20, "2nd blood for name (Professionals)"),
+            ("Students", 1, 30, "1st blood for name (Students)"),
+        ]
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+    destroy_ctfd(app)
+
+def test_simulate_bonus_schedules():
+    pytest.importorskip("numpy")
+    from CTFd.plugins.CTFd_first_blood.archive import archive_challenges
+    from CTFd.plugins.CTFd_first_blood.simulate import SolveHistory, simulate
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+        award_count = FirstBloodAward.query.count()
+
+        history = SolveHistory.load(max_rank=3)
+        current, same, podium, none = simulate(history, [[30, 20], [10, 20, 30], [0]])
+        assert (current["awards"], current["total_bonus"], current["moved"]) == (2, 50, 0)
+        assert current["top"] == ["user1", "user2", "user3"]
+        assert (same["total_bonus"], same["moved"]) == (50, 0)
+        assert (podium["awards"], podium["total_bonus"], podium["moved"]) == (3, 60, 2)
+        assert podium["top"] == ["user3", "user2", "user1"]
+        assert (none["awards"], none["total_bonus"]) == (0, 0)
+
+        # The simulation never touches the awards
+        assert FirstBloodAward.query.count() == award_count
+
+        # A rank without a bonus
+        FirstBloodValueChallenge.update(challenge, FakeRequest(form={
+            "first_blood_bonus[0]": 30, "first_blood_bonus[1]": "", "first_blood_bonus[2]": 10
+        }))
+        current, = simulate(SolveHistory.load(max_rank=3), [])
+        assert (current["awards"], current["total_bonus"], current["moved"]) == (2, 40, 0)
+
+        # Archived challenges give out no awards
+        archive_challenges([challenge.id])
+        current, = simulate(SolveHistory.load(max_rank=3), [])
+        assert (current["awards"], current["total_bonus"]) == (0, 0)
+
+    destroy_ctfd(app)
+
+def test_profiling_samples_listeners(tmpdir):
+    import json
+    import os
+
+    app = create_ctfd(enable_plugins=True)
+    app.config["FIRST_BLOOD_PROFILE_DIR"] = str(tmpdir)
+    app.config["FIRST_BLOOD_PROFILE_EVERY"] = 1
+    app.config["FIRST_BLOOD_PROFILE_KEEP"] = 2
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.hidden = True
+        app.db.session.commit()
+
+        files = os.listdir(str(tmpdir))
+        for operation in ["before_flush", "after_flush_postexec"]:
+            samples = [f for f in files if f.startswith(operation + "-")]
+            # Rotated down to the newest two samples, each with a profile and the timings
+            assert len([f for f in samples if f.endswith(".prof")]) == 2
+            assert len([f for f in samples if f.endswith(".json")]) == 2
+
+        # The recalculation runs inside the flush, so it only gets its timings
+        recalculations = [f for f in files if f.startswith("recalculate_awards-")]
+        assert recalculations and all(f.endswith(".json") for f in recalculations)
+        with open(os.path.join(str(tmpdir), recalculations[0])) as f:
+            timings = json.load(f)
+        assert timings["queries"] > 0
+        assert timings["total"] == pytest.approx(timings["sql"] + timings["python"])
+
+    destroy_ctfd(app)
+
+def test_preview_award_changes():
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        user1 = Users.query.filter_by(name="user1").first()
+        user2 = Users.query.filter_by(name="user2").first()
+        user3 = Users.query.filter_by(name="user3").first()
+        ranks = FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]
+        assert [(rank["account_id"], rank["solve_num"]) for rank in ranks] == [(user1.id, 1), (user2.id, 2)]
+
+        client = login_as_user(app, name="admin", password="password")
+        r = client.post(
+            "/api/v1/firstblood/challenges/{0}/preview".format(challenge.id), json={"first_blood_bonus": [50, 20, 10]}
+        )
+        assert r.status_code == 200
+        data = r.get_json()["data"]
+        assert (data["current_total"], data["proposed_total"]) == (50, 80)
+        assert [(c["account_id"], c["current"], c["proposed"]) for c in data["changes"]] == [
+            (user1.id, 30, 50),
+            (user3.id, None, 10),
+        ]
+        # Nothing changed
+        assert [award.value for award in FirstBloodAward.query.order_by(FirstBloodAward.solve_num)] == [30, 20]
+
+        # The cached ranking follows the hooks
+        user1.hidden = True
+        app.db.session.commit()
+        ranks = FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]
+        assert [(rank["account_id"], rank["solve_num"]) for rank in ranks] == [(user2.id, 1), (user3.id, 2)]
+
+        r = client.post("/api/v1/firstblood/challenges/{0}/preview".format(challenge.id), json={"first_blood_bonus": "x"})
+        assert r.status_code == 400
+
+    destroy_ctfd(app)
+
+def test_solve_and_award_committed_together():
+    from sqlalchemy import event
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        # What every commit is about to make visible
+        committed = []
+
+        def before_commit(session):
+            committed.append((Solves.query.count(), FirstBloodAward.query.count()))
+
+        event.listen(app.db.session, "before_commit", before_commit)
+        try:
+            for user in ["user1", "user2", "user3"]:
+                client = login_as_user(app, name=user, password="password")
+                data = {"submission": "flag", "challenge_id": challenge.id}
+                r = client.post("/api/v1/challenges/attempt", json=data)
+                assert r.status_code == 200
+        finally:
+            event.remove(app.db.session, "before_commit", before_commit)
+
+        # A solve is never committed without its award
+        assert (3, 3) in committed
+        assert all(solves == awards for solves, awards in committed)
+
+    destroy_ctfd(app)
+
+def test_awards_recalculated_on_many_solves_removed():
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 6):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenges = []
+        for name in ["name1", "name2"]:
+            challenge_data = {
+                "name": name,
+                "category": "category",
+                "description": "description",
+                "value": 100,
+                "first_blood_bonus[0]": 30,
+                "first_blood_bonus[1]": 20,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            req = FakeRequest(form=challenge_data)
+            challenge = FirstBloodValueChallenge.create(req)
+            gen_flag(app.db, challenge_id=challenge.id, content="flag")
+            challenges.append(challenge)
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4", "user5"]:
+            client = login_as_user(app, name=user, password="password")
+            for challenge in challenges:
+                data = {"submission": "flag", "challenge_id": challenge.id}
+                r = client.post("/api/v1/challenges/attempt", json=data)
+                assert r.status_code == 200
+
+        # Remove the solves of two users on both challenges in a single flush
+        removed = Users.query.filter(Users.name.in_(["user1", "user3"])).all()
+        for solve in Solves.query.filter(Solves.user_id.in_([user.id for user in removed])).all():
+            app.db.session.delete(solve)
+        app.db.session.commit()
+
+        for challenge in challenges:
+            expected_data = [
+                {"user": "user1", "solved": False},
+                {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+                {"user": "user3", "solved": False},
+                {"user": "user4", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+                {"user": "user5", "solved": True, "bonus_points": None},
+            ]
+            _check_first_blood_awards_data(challenge, expected_data)
+
+    destroy_ctfd(app)
+
+def test_reads_routed_to_replica(tmpdir):
+    import sqlite3
+
+    from flask import session
+
+    from CTFd.cache import cache
+    from CTFd.plugins.CTFd_first_blood.replica import LAST_WRITE_KEY
+    from CTFd.plugins.CTFd_first_blood.summary import get_summary
+
+    app = create_ctfd(enable_plugins=True)
+    if app.db.engine.dialect.name != "sqlite":
+        destroy_ctfd(app)
+        pytest.skip("Copies the SQLite database to a file to act as the replica")
+    replica_path = str(tmpdir.join("replica.db"))
+    app.config["FIRST_BLOOD_REPLICA_URI"] = "sqlite:///" + replica_path
+    app.config["FIRST_BLOOD_REPLICA_MAX_LAG"] = 0
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        def submit(user):
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        submit("user1")
+        submit("user2")
+        # The replica is a snapshot that lags behind the last solve
+        connection = app.db.engine.raw_connection()
+        replica = sqlite3.connect(replica_path)
+        connection.connection.backup(replica)
+        replica.close()
+        connection.close()
+        submit("user3")
+
+        # Ranks are still assigned from the primary
+        user3 = Users.query.filter_by(name="user3").first()
+        assert FirstBloodAward.query.filter_by(user_id=user3.id).first().solve_num == 3
+
+        # ... but the reads come from the replica
+        assert get_summary(user3.id)["count"] == 0
+        assert len(FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]) == 2
+
+        # Right after a write, the user who made it reads from the primary for FIRST_BLOOD_REPLICA_MAX_LAG seconds,
+        # so that they see their own writes - everyone else keeps reading from the replica
+        app.config["FIRST_BLOOD_REPLICA_MAX_LAG"] = "60"
+        # As if the replica had caught up with the setup
+        cache.delete(LAST_WRITE_KEY)
+        with app.test_request_context():
+            session["id"] = user3.id
+            FirstBloodValueChallenge.recalculate_awards(challenge)
+            app.db.session.commit()
+
+        def reads(user=None):
+            with app.test_request_context():
+                if user is not None:
+                    session["id"] = user.id
+                return get_summary(user3.id)["count"], len(FirstBloodValueChallenge.read(challenge)["first_blood_ranks"])
+
+        assert reads() == (0, 2)
+        # The ranking that was cached from the replica isn't good enough for the writer
+        assert reads(user3) == (1, 3)
+
+        # Writes made outside of a request keep everyone on the primary
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+        app.db.session.commit()
+        assert reads() == (1, 3)
+        assert get_summary(user3.id)["count"] == 1
+        assert len(FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]) == 3
+
+    destroy_ctfd(app)
+
+
+def test_hot_queries_use_indexes():
+    """
+    The lookups that run on every solve, solve removal, challenge deletion and account hide/unhide must not
+    regress to full table scans - checked with EXPLAIN QUERY PLAN on SQLite
+    """
+    import re
+    from sqlalchemy import event
+    from CTFd.plugins.CTFd_first_blood.queries import (
+        account_first_blood_solves,
+        challenge_award_accounts,
+        count_eligible_solves,
+        solve_awards,
+    )
+
+    app = create_ctfd(enable_plugins=True)
+    if app.db.engine.dialect.name != "sqlite":
+        destroy_ctfd(app)
+        pytest.skip("Checks SQLite query plans")
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for i in range(1, 5):
+            client = login_as_user(app, name="user{0}".format(i), password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        user = Users.query.filter_by(name="user1").first()
+        solve_ids = [solve.id for solve in Solves.query.filter_by(challenge_id=challenge.id).all()]
+        queries = {
+            "solve rank": lambda: count_eligible_solves(app.db.session, get_model(), None, challenge.id, solve_ids[-1]),
+            "awards by solve": lambda: solve_awards(app.db.session, solve_ids).all(),
+            "challenge delete awards": lambda: challenge_award_accounts(app.db.session, challenge.id, 500).all(),
+            "account solves": lambda: account_first_blood_solves(app.db.session, user.id).all(),
+        }
+        for name, query in queries.items():
+            statements = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                statements.append((statement, parameters))
+
+            event.listen(app.db.engine, "before_cursor_execute", capture)
+            try:
+                query()
+            finally:
+                event.remove(app.db.engine, "before_cursor_execute", capture)
+            assert statements, name
+
+            for statement, parameters in statements:
+                plan = [row[-1] for row in app.db.engine.execute("EXPLAIN QUERY PLAN " + statement, parameters)]
+                # "SCAN solves" on newer SQLite versions, "SCAN TABLE solves" on older ones. Scanning a whole index
+                # ("SCAN solves USING INDEX ...") is no better than scanning the table
+                scans = [detail for detail in plan if re.match(r"SCAN (TABLE )?(solves|submissions|awards|first_blood_award)\b", detail)]
+                assert not scans, "{0}: {1}".format(name, plan)
+    destroy_ctfd(app)
+
+
+def test_eligibility_rules_exclude_admins_and_late_registrations():
+    import datetime
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        # user4 registered after the cutoff
+        cutoff = datetime.datetime.utcnow()
+        app.config["FIRST_BLOOD_REGISTRATION_CUTOFF"] = cutoff
+        user4 = Users.query.filter_by(name="user4").first()
+        user4.created = cutoff + datetime.timedelta(days=1)
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user4", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user3", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+            {"user": "user4", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+
+        # Making user1 an admin takes their award away
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.type = "admin"
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        # Without the cutoff, user4 is ranked as well
+        del app.config["FIRST_BLOOD_REGISTRATION_CUTOFF"]
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+            {"user": "user4", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+
+        # The cutoff can also be an ISO 8601 date, as it would be written in config.ini
+        app.config["FIRST_BLOOD_REGISTRATION_CUTOFF"] = cutoff.isoformat() + "Z"
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+
+    destroy_ctfd(app)
+
+
+def test_awards_recalculated_on_solve_without_bonus_removed():
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        # No bonus for the 2nd solve
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": "",
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+        # Rank 2 has no award, which is not a gap
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        # The solve of user2 has no award, but removing it still moves the later solves up
+        user2 = Users.query.filter_by(name="user2").first()
+        app.db.session.delete(Solves.query.filter_by(user_id=user2.id).first())
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": False},
+            {"user": "user3", "solved": True, "bonus_points": None},
+            {"user": "user4", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+    destroy_ctfd(app)
+
+
+def test_awards_match_reference_model():
+    """
+    A short run of the randomized differential test in tools/differential.py - run the tool itself for longer ones
+    """
+    from CTFd.plugins.CTFd_first_blood.tools.differential import check, generate
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        operations = generate(seed=0, count=300, accounts=6, challenges=2)
+        result = check(app, operations, accounts=6, challenges=2)
+        assert result is None, "Divergence: {0}".format(result)
+    destroy_ctfd(app)
+
+
+def test_memory_budgets():
+    """
+    A small run of tools/benchmark_memory.py - every scenario has to stay within the peak memory budget derived
+    from the size of the event
+    """
+    from CTFd.plugins.CTFd_first_blood.tools.benchmark_memory import build_event, event_budget, run
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        challenge_ids, account_ids = build_event(challenges=20, accounts=300, solve_rate=0.5, seed=0)
+        # 20 challenges of about 150 solves each
+        assert event_budget(challenge_ids) < 1
+        for name, peak, budget, _ in run(challenge_ids, account_ids):
+            assert peak <= budget, "{0} peaked at {1:.2f} MiB, over its budget of {2:.2f} MiB".format(name, peak, budget)
+    destroy_ctfd(app)
+
+
+def test_rank_allocator():
+    """
+    Solves ranked by the rank allocator get the same awards as ranked in the database, and a counter that drifted
+    from the database is reconciled
+    """
+    from CTFd.plugins.CTFd_first_blood.allocator import LocalCounters, RankAllocator
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        # The plugin is loaded by create_ctfd() already
+        allocator = RankAllocator(LocalCounters())
+        allocator.start()
+        app.extensions["first_blood_rank_allocator"] = allocator
+
+        for i in range(1, 6):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenges = []
+        for name in ["name1", "name2"]:
+            challenge_data = {
+                "name": name,
+                "category": "category",
+                "description": "description",
+                "value": 100,
+                "first_blood_bonus[0]": 30,
+                "first_blood_bonus[1]": 20,
+                "first_blood_bonus[2]": 10,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            req = FakeRequest(form=challenge_data)
+            challenge = FirstBloodValueChallenge.create(req)
+            gen_flag(app.db, challenge_id=challenge.id, content="flag")
+            challenges.append(challenge.id)
+        app.db.session.commit()
+
+        def attempt(user, challenge_id):
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge_id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            attempt(user, challenges[0])
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user3", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+            {"user": "user4", "solved": True, "bonus_points": None},
+            {"user": "user5", "solved": False},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenges[0]), expected_data)
+
+        # Hiding user1 recalculates the awards and reseeds the counter
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.hidden = True
+        app.db.session.commit()
+        attempt("user5", challenges[0])
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+            {"user": "user5", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenges[0]), expected_data)
+
+        # A counter that drifted past the last bonus is caught and the awards recalculated from the database
+        attempt("user2", challenges[1])
+        key = allocator._counter_key(challenges[1], None)
+        allocator.store.inc(key, 5)
+        attempt("user3", challenges[1])
+
+        expected_data = [
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": False},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenges[1]), expected_data)
+
+        attempt("user4", challenges[1])
+        assert FirstBloodValueChallenge.verify_awards(Challenges.query.get(challenges[1])) == []
+    destroy_ctfd(app)
+
+
+def test_rank_allocator_out_of_order_ranks_reconciled():
+    """
+    Concurrent solves can take their ranks from the allocator in a different order than their solve ids - every
+    solve ranked within the bonuses is checked against the database, not only the last one
+    """
+    from CTFd.plugins.CTFd_first_blood.allocator import LocalCounters, RankAllocator
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        allocator = RankAllocator(LocalCounters())
+        allocator.start()
+        app.extensions["first_blood_rank_allocator"] = allocator
+
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+        challenge_id = challenge.id
+
+        def attempt(user):
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge_id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        attempt("user1")
+        # user2 takes the 1st rank as if a concurrent solve with a higher id had taken the 2nd one before it
+        key = allocator._counter_key(challenge_id, None)
+        allocator.store.inc(key, -1)
+        attempt("user2")
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user3", "solved": False},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenge_id), expected_data)
+        assert FirstBloodValueChallenge.verify_awards(Challenges.query.get(challenge_id)) == []
+    destroy_ctfd(app)
+
+
+def test_fingerprinted_assets():
+    """
+    The templates, scripts and stylesheet are served from fingerprinted URLs with immutable caching, precompressed
+    """
+    import gzip
+
+    from CTFd.plugins.CTFd_first_blood.static import ASSETS_DIR, STATIC_ROUTE
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        client = login_as_user(app, name="user1", password="password")
+        data = {"submission": "flag", "challenge_id": challenge.id}
+        r = client.post("/api/v1/challenges/attempt", json=data)
+        assert r.status_code == 200
+
+        # The rank labels come from the server, view.js doesn't ordinalize them itself
+        ranks = FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]
+        assert [(rank["solve_num"], rank["label"]) for rank in ranks] == [(1, "1st")]
+
+        url = FirstBloodValueChallenge.scripts["view"]
+        assert url.startswith(STATIC_ROUTE + "/") and url.endswith("/view.js")
+        with open(ASSETS_DIR + "/view.js", "rb") as f:
+            content = f.read()
+        assert b"console.log" not in content
+
+        r = client.get(url, headers={"Accept-Encoding": "gzip, deflate"})
+        assert r.status_code == 200
+        assert r.headers["Content-Encoding"] == "gzip"
+        assert "immutable" in r.headers["Cache-Control"]
+        assert r.headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(r.get_data()) == content
+
+        r = client.get(url)
+        assert "Content-Encoding" not in r.headers
+        assert r.get_data() == content
+
+        # An outdated fingerprint gets the current file, but it must not be cached
+        r = client.get(url.replace(url.split("/")[-2], "0" * 12))
+        assert r.status_code == 200
+        assert r.headers["Cache-Control"] == "no-cache"
+
+        r = client.get(STATIC_ROUTE + "/0/missing.js")
+        assert r.status_code == 404
+    destroy_ctfd(app)
+
+
+def test_archive_and_restore_awards():
+    from sqlalchemy import event
+    from CTFd.plugins.CTFd_first_blood.archive import archive_challenges, restore_challenges
+    from CTFd.plugins.CTFd_first_blood.export import iter_results
+    from CTFd.plugins.CTFd_first_blood.models import FirstBloodAwardArchive, FirstBloodSummary
+
+    app = create_ctfd(enable_plugins=True)
+    # Small batches, so that archiving and restoring take several of them
+    app.config["FIRST_BLOOD_ARCHIVE_BATCH_SIZE"] = 2
+    with app.app_context():
+        for i in range(1, 5):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+        challenge_id = challenge.id
+
+        def attempt(user):
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge_id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        for user in ["user1", "user2", "user3"]:
+            attempt(user)
+
+        # The awards leave the live tables, but stay in the export
+        assert archive_challenges([challenge_id]) == 3
+        assert FirstBloodAward.query.count() == 0
+        assert Awards.query.count() == 0
+        assert FirstBloodSummary.query.count() == 0
+        assert FirstBloodAwardArchive.query.count() == 3
+        rows = list(iter_results(app.db.session))
+        assert [(row["account"], row["solve_num"], row["value"], row["archived"]) for row in rows] == [
+            ("user1", 1, 30, True), ("user2", 2, 20, True), ("user3", 3, 10, True)
+        ]
+
+        # An archived challenge gives out no awards, whatever happens to it
+        attempt("user4")
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.hidden = True
+        app.db.session.commit()
+        FirstBloodValueChallenge.update(Challenges.query.get(challenge_id), FakeRequest(form={"state": "visible"}))
+        assert FirstBloodAward.query.count() == 0
+        assert FirstBloodValueChallenge.verify_awards(Challenges.query.get(challenge_id)) == []
+
+        # Restoring brings the awards back, recalculated for what changed in the meantime. The database assigns
+        # the award ids, as solves may be inserting awards at the same time
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(app.db.engine, "before_cursor_execute", capture)
+        try:
+            assert restore_challenges([challenge_id]) == 3
+        finally:
+            event.remove(app.db.engine, "before_cursor_execute", capture)
+        assert not [statement for statement in statements if "max(awards.id)" in statement.lower()]
+        assert FirstBloodAwardArchive.query.count() == 0
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": None},
+            {"user": "user2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "user4", "solved": True, "bonus_points": 10, "bonus_num": 3, "bonus_name": "3rd"},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenge_id), expected_data)
+        assert FirstBloodValueChallenge.verify_awards(Challenges.query.get(challenge_id)) == []
+        assert FirstBloodSummary.query.count() == 3
+
+        # With FIRST_BLOOD_ARCHIVE_ON_HIDE, hiding a challenge archives its awards instead of removing them - but not
+        # if the update is invalid
+        app.config["FIRST_BLOOD_ARCHIVE_ON_HIDE"] = "1"
+        with pytest.raises(ValueError):
+            FirstBloodValueChallenge.update(
+                Challenges.query.get(challenge_id), FakeRequest(form={"state": "hidden", "first_blood_bonus[0]": "x"})
+            )
+        app.db.session.rollback()
+        assert not Challenges.query.get(challenge_id).first_blood_archived
+        assert FirstBloodAward.query.count() == 3
+        assert FirstBloodAwardArchive.query.count() == 0
+
+        FirstBloodValueChallenge.update(Challenges.query.get(challenge_id), FakeRequest(form={"state": "hidden"}))
+        assert Challenges.query.get(challenge_id).first_blood_archived
+        assert FirstBloodAward.query.count() == 0
+        assert FirstBloodAwardArchive.query.count() == 3
+        # A hidden challenge is only restored once it is visible again
+        assert restore_challenges([challenge_id]) == 0
+        FirstBloodValueChallenge.update(Challenges.query.get(challenge_id), FakeRequest(form={"state": "visible"}))
+        assert FirstBloodAward.query.count() == 0
+        assert restore_challenges([challenge_id]) == 3
+        assert FirstBloodAward.query.count() == 3
+        assert FirstBloodValueChallenge.verify_awards(Challenges.query.get(challenge_id)) == []
+
+        # "false" in config.ini turns it off
+        app.config["FIRST_BLOOD_ARCHIVE_ON_HIDE"] = "false"
+        FirstBloodValueChallenge.update(Challenges.query.get(challenge_id), FakeRequest(form={"state": "hidden"}))
+        assert not Challenges.query.get(challenge_id).first_blood_archived
+        assert FirstBloodAward.query.count() == 0
+        assert FirstBloodAwardArchive.query.count() == 0
+        FirstBloodValueChallenge.update(Challenges.query.get(challenge_id), FakeRequest(form={"state": "visible"}))
+        assert FirstBloodAward.query.count() == 3
+
+        # Deleting an archived challenge deletes its archived awards too
+        archive_challenges([challenge_id])
+        FirstBloodValueChallenge.delete(Challenges.query.get(challenge_id))
+        assert FirstBloodAwardArchive.query.count() == 0
+    destroy_ctfd(app)
+
+
+def test_challenge_deleted_in_batches():
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    from CTFd.plugins.CTFd_first_blood.models import FirstBloodSummary
+
+    app = create_ctfd(enable_plugins=True)
+    app.config["FIRST_BLOOD_DELETE_BATCH_SIZE"] = "2"
+    with app.app_context():
+        for i in range(1, 8):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenges = []
+        for name in ["name1", "name2"]:
+            challenge_data = {
+                "name": name,
+                "category": "category",
+                "description": "description",
+                "value": 100,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            for i in range(7):
+                challenge_data["first_blood_bonus[{0}]".format(i)] = 70 - 10 * i
+            req = FakeRequest(form=challenge_data)
+            challenge = FirstBloodValueChallenge.create(req)
+            gen_flag(app.db, challenge_id=challenge.id, content="flag")
+            challenges.append(challenge.id)
+        app.db.session.commit()
+
+        for i in range(1, 8):
+            client = login_as_user(app, name="user{0}".format(i), password="password")
+            data = {"submission": "flag", "challenge_id": challenges[0]}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+        client = login_as_user(app, name="user1", password="password")
+        data = {"submission": "flag", "challenge_id": challenges[1]}
+        r = client.post("/api/v1/challenges/attempt", json=data)
+        assert r.status_code == 200
+        assert FirstBloodAward.query.count() == 8
+
+        commits = []
+
+        def count_commit(session):
+            commits.append(session)
+
+        event.listen(Session, "after_commit", count_commit)
+        try:
+            FirstBloodValueChallenge.delete(Challenges.query.get(challenges[0]))
+        finally:
+            event.remove(Session, "after_commit", count_commit)
+        # 7 awards in batches of 2, each committed on its own
+        assert len(commits) >= 4
+
+        # Only the award of the other challenge is left, and the summaries agree
+        assert Challenges.query.get(challenges[0]) is None
+        assert [award.solve.challenge_id for award in FirstBloodAward.query.all()] == [challenges[1]]
+        user1 = Users.query.filter_by(name="user1").first()
+        assert [(row.account_id, row.solve_num, row.count, row.value) for row in FirstBloodSummary.query.all()] == [
+            (user1.id, 1, 1, 70)
+        ]
+    destroy_ctfd(app)
+
+
+def test_recalculation_reads_solve_records():
+    from CTFd.plugins.CTFd_first_blood.models import SolveRecord
+
+    app = create_ctfd(enable_plugins=True)
+    app.config["FIRST_BLOOD_BRACKET_FIELD"] = "affiliation"
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io", affiliation="Students")
+        gen_user(app.db, name="user2", email="user2@ctfd.io", affiliation="Students")
+        gen_user(app.db, name="user3", email="user3@ctfd.io")
+        gen_user(app.db, name="user4", email="user4@ctfd.io", affiliation="Professionals")
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3", "user4"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        users = {user.name: user for user in Users.query.filter(Users.name.like("user%"))}
+        users["user2"].hidden = True
+        users["user4"].banned = True
+        app.db.session.commit()
+
+        # The solve scan only returns the eligible solves, with their bracket
+        records = FirstBloodValueChallenge._solve_records(challenge)
+        assert all(isinstance(record, SolveRecord) for record in records)
+        assert [(record.user_id, record.bracket) for record in records] == [
+            (users["user1"].id, "Students"),
+            (users["user3"].id, None),
+        ]
+        assert [(award.user.name, award.solve_num, award.value) for award in FirstBloodAward.query.order_by(FirstBloodAward.id)] == [
+            ("user1", 1, 30),
+            ("user3", 1, 30),
+        ]
+
+        # Recalculating unchanged awards leaves them untouched
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+        assert not app.db.session.new
+        assert not app.db.session.dirty
+        assert not app.db.session.deleted
+
+        # Solves of a hidden challenge are never eligible
+        challenge.state = "hidden"
+        assert FirstBloodValueChallenge._solve_records(challenge) == []
+        FirstBloodValueChallenge.recalculate_awards(challenge)
+        app.db.session.commit()
+        assert FirstBloodAward.query.count() == 0
+    destroy_ctfd(app)
+
+
+def test_baked_queries_rerun_with_new_parameters():
+    from CTFd.plugins.CTFd_first_blood.brackets import bracket_column
+    from CTFd.plugins.CTFd_first_blood.queries import bakery, challenge_awards, challenge_solves, count_eligible_solves
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        gen_user(app.db, name="user1", email="user1@ctfd.io", affiliation="Students")
+        gen_user(app.db, name="user2", email="user2@ctfd.io", affiliation="Professionals")
+        gen_user(app.db, name="user3", email="user3@ctfd.io", affiliation="Students")
+
+        challenges = []
+        for name in ["name1", "name2"]:
+            challenge_data = {
+                "name": name,
+                "category": "category",
+                "description": "description",
+                "value": 100,
+                "first_blood_bonus[0]": 30,
+                "first_blood_bonus[1]": 20,
+                "first_blood_bonus[2]": 10,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            req = FakeRequest(form=challenge_data)
+            challenge = FirstBloodValueChallenge.create(req)
+            gen_flag(app.db, challenge_id=challenge.id, content="flag")
+            challenges.append(challenge.id)
+        app.db.session.commit()
+
+        for user, challenge_ids in [("user1", challenges), ("user2", challenges), ("user3", challenges[:1])]:
+            client = login_as_user(app, name=user, password="password")
+            for challenge_id in challenge_ids:
+                data = {"submission": "flag", "challenge_id": challenge_id}
+                r = client.post("/api/v1/challenges/attempt", json=data)
+                assert r.status_code == 200
+
+        solves = {
+            challenge_id: [solve.id for solve in Solves.query.filter_by(challenge_id=challenge_id).order_by(Solves.id)]
+            for challenge_id in challenges
+        }
+        session = app.db.session
+
+        # The first round bakes the queries, the second one only binds new parameters
+        for attempt in range(2):
+            cached = len(bakery.cache)
+            for challenge_id in challenges:
+                for rank, solve_id in enumerate(solves[challenge_id], 1):
+                    assert count_eligible_solves(session, Users, None, challenge_id, solve_id) == (rank, solve_id)
+                assert [row.id for row in challenge_solves(session, Users, None, challenge_id)] == solves[challenge_id]
+                assert sorted(award.solve_id for award in challenge_awards(session, challenge_id)) == solves[challenge_id]
+            if attempt:
+                assert len(bakery.cache) == cached
+
+        # The bracket is part of the cache key, its value is a parameter
+        app.config["FIRST_BLOOD_BRACKET_FIELD"] = "affiliation"
+        bracket = bracket_column(Users)
+        last = solves[challenges[0]][-1]
+        assert count_eligible_solves(session, Users, bracket, challenges[0], last, "Students") == (2, last)
+        assert count_eligible_solves(session, Users, bracket, challenges[0], last, "Professionals") == (1, solves[challenges[0]][1])
+        assert count_eligible_solves(session, Users, bracket, challenges[0], last, "Nobody") == (0, None)
+        assert count_eligible_solves(session, Users, bracket, challenges[0], last) == (0, None)
+        assert [row[-1] for row in challenge_solves(session, Users, bracket, challenges[1])] == ["Students", "Professionals"]
+        assert [row[-1] for row in challenge_solves(session, Users, None, challenges[1])] == [None, None]
+    destroy_ctfd(app)
+
+
+def test_first_blood_ranks_follow_visibility():
+    import calendar
+    import datetime
+
+    from CTFd.utils import set_config
+    from CTFd.plugins.CTFd_first_blood.archive import archive_challenges
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 4):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for day, user in enumerate(["user1", "user2", "user3"], start=10):
+            with freeze_time("2020-10-%02d 12:34:56" % day):
+                client = login_as_user(app, name=user, password="password")
+                with client.session_transaction():
+                    data = {"submission": "flag", "challenge_id": challenge.id}
+                    r = client.post("/api/v1/challenges/attempt", json=data)
+                    assert r.status_code == 200
+
+        def ranks():
+            # As seen by an anonymous visitor
+            with app.test_request_context():
+                return [rank["solve_num"] for rank in FirstBloodValueChallenge.read(challenge)["first_blood_ranks"]]
+
+        assert ranks() == [1, 2, 3]
+
+        set_config("score_visibility", "private")
+        assert ranks() == []
+        set_config("score_visibility", "public")
+
+        set_config("account_visibility", "private")
+        assert ranks() == []
+        set_config("account_visibility", "public")
+
+        # Solves after the freeze aren't shown
+        set_config("freeze", calendar.timegm(datetime.datetime(2020, 10, 11, 18).utctimetuple()))
+        assert ranks() == [1, 2]
+        set_config("freeze", None)
+        assert ranks() == [1, 2, 3]
+
+        # Archived challenges have no ranking
+        archive_challenges([challenge.id])
+        assert ranks() == []
+    destroy_ctfd(app)
+
+
+def test_award_names_fit_long_brackets():
+    app = create_ctfd(enable_plugins=True)
+    app.config["FIRST_BLOOD_BRACKET_FIELD"] = "affiliation"
+    with app.app_context():
+        # As long as CTFd allows both
+        gen_user(app.db, name="user1", email="user1@ctfd.io", affiliation="a" * 128)
+
+        challenge_data = {
+            "name": "n" * 80,
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        client = login_as_user(app, name="user1", password="password")
+        data = {"submission": "flag", "challenge_id": challenge.id}
+        r = client.post("/api/v1/challenges/attempt", json=data)
+        assert r.status_code == 200
+
+        award = FirstBloodAward.query.one()
+        assert award.bracket == "a" * 128
+        assert award.name == ("1st blood for " + "n" * 80)[:80]
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+    destroy_ctfd(app)
+
+
+def test_solve_locks_challenge_before_ranking():
+    """
+    Without a rank allocator, the challenge row is locked before the solve is written, so that concurrent solves of
+    the challenge are ranked one at a time. The allocator needs no lock.
+    """
+    from sqlalchemy import event
+    from sqlalchemy.dialects import mysql
+    from CTFd.plugins.CTFd_first_blood.allocator import LocalCounters, RankAllocator
+    from CTFd.plugins.CTFd_first_blood.queries import count_eligible_solves_query
+
+    app = create_ctfd(enable_plugins=True)
+    with app.app_context():
+        for i in range(1, 3):
+            gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        def attempt(user):
+            statements = []
+
+            def capture(conn, cursor, statement, parameters, context, executemany):
+                statements.append(" ".join(statement.split()))
+
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            event.listen(app.db.engine, "before_cursor_execute", capture)
+            try:
+                r = client.post("/api/v1/challenges/attempt", json=data)
+            finally:
+                event.remove(app.db.engine, "before_cursor_execute", capture)
+            assert r.status_code == 200
+            locks = [
+                i for i, statement in enumerate(statements)
+                if statement.startswith("SELECT challenges.id AS challenges_id FROM challenges WHERE challenges.id = ")
+            ]
+            inserts = [
+                i for i, statement in enumerate(statements)
+                if statement.startswith(("INSERT INTO submissions", "INSERT INTO solves"))
+            ]
+            assert inserts
+            return locks, inserts
+
+        locks, inserts = attempt("user1")
+        assert locks and locks[0] < inserts[0]
+
+        allocator = RankAllocator(LocalCounters())
+        allocator.start()
+        app.extensions["first_blood_rank_allocator"] = allocator
+        locks, inserts = attempt("user2")
+        assert locks == []
+
+        expected_data = [
+            {"user": "user1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "user2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ]
+        _check_first_blood_awards_data(Challenges.query.get(challenge.id), expected_data)
+
+        # The count after the lock is a locking read on MySQL/MariaDB, so that it sees the solves committed while
+        # waiting - their default REPEATABLE READ would read an older snapshot
+        def count_sql(locking):
+            query = count_eligible_solves_query(Users, None, locking=locking).to_query(app.db.session())
+            return str(query.statement.compile(dialect=mysql.dialect()))
+
+        assert count_sql(locking=True).endswith("LOCK IN SHARE MODE")
+        assert "LOCK IN SHARE MODE" not in count_sql(locking=False)
+    destroy_ctfd(app)
+
+
+def test_eligibility_rules_from_config_string_in_teams_mode():
+    """
+    FIRST_BLOOD_ELIGIBILITY_RULES can be a comma separated string, as it comes from config.ini, and promoting a team
+    member to admin takes the team's awards away
+    """
+    from CTFd.plugins.CTFd_first_blood.eligibility import check_rules
+
+    app = create_ctfd(enable_plugins=True, user_mode="teams")
+    app.config["FIRST_BLOOD_ELIGIBILITY_RULES"] = "not_hidden, not_banned,not_admin"
+    with app.app_context():
+        check_rules(app)
+        for i in range(1, 4):
+            user = gen_user(app.db, name="user{0}".format(i), email="user{0}@ctfd.io".format(i))
+            team = gen_team(app.db, name="team{0}".format(i), email="team{0}@ctfd.io".format(i))
+            user.team_id = team.id
+            team.members.append(user)
+
+        challenge_data = {
+            "name": "name",
+            "category": "category",
+            "description": "description",
+            "value": 100,
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        req = FakeRequest(form=challenge_data)
+        challenge = FirstBloodValueChallenge.create(req)
+        gen_flag(app.db, challenge_id=challenge.id, content="flag")
+        app.db.session.commit()
+
+        for user in ["user1", "user2", "user3"]:
+            client = login_as_user(app, name=user, password="password")
+            data = {"submission": "flag", "challenge_id": challenge.id}
+            r = client.post("/api/v1/challenges/attempt", json=data)
+            assert r.status_code == 200
+
+        expected_data = [
+            {"user": "team1", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "team2", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+            {"user": "team3", "solved": True, "bonus_points": None},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+
+        user1 = Users.query.filter_by(name="user1").first()
+        user1.type = "admin"
+        app.db.session.commit()
+
+        expected_data = [
+            {"user": "team1", "solved": True, "bonus_points": None},
+            {"user": "team2", "solved": True, "bonus_points": 30, "bonus_num": 1, "bonus_name": "1st"},
+            {"user": "team3", "solved": True, "bonus_points": 20, "bonus_num": 2, "bonus_name": "2nd"},
+        ]
+        _check_first_blood_awards_data(challenge, expected_data)
+        assert FirstBloodValueChallenge.verify_awards(challenge) == []
+
+        app.config["FIRST_BLOOD_ELIGIBILITY_RULES"] = "not_hidden,not_a_rule"
+        with pytest.raises(ValueError):
+            check_rules(app)
+    destroy_ctfd(app)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Peak memory benchmark of the first blood award maintenance on a synthetic large event.
+
+Builds an event with --challenges challenges and --accounts accounts that solve every challenge with
+probability --solve-rate, then measures the peak Python memory (with tracemalloc) of recalculating the awards
+of a challenge, of a bulk delete of an account's solves (the after_bulk_delete hook), of deleting an account
+the way the CTFd admin panel does, and of deleting a challenge. Exits with 1 if any peak is over its budget,
+which is derived from the size of the event (see event_budget()) unless given with --budget.
+
+Run it from the root of a CTFd checkout (it uses the CTFd test helpers):
+
+    python CTFd/plugins/CTFd_first_blood/tools/benchmark_memory.py --challenges 100 --accounts 5000
+    python CTFd/plugins/CTFd_first_blood/tools/benchmark_memory.py --user-mode teams --budget "team deletion=32"
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.getcwd())
+
+from tests.helpers import FakeRequest, create_ctfd, destroy_ctfd  # noqa: E402
+
+SCENARIOS = ["recalculate_awards", "after_bulk_delete", "user deletion", "team deletion", "challenge deletion"]
+
+# What a scenario may keep alive at its peak, in MiB: a fixed part (the session, compiled queries), one solve
+# record per solve of the largest challenge, and the lease and cache bookkeeping of every challenge. Measured
+# peaks stay well under half of it.
+BASE_MEMORY = 0.25
+SOLVE_MEMORY = 1 / 1024
+CHALLENGE_MEMORY = 1 / 1024
+HEADROOM = 2
+
+
+def build_event(challenges, accounts, solve_rate, seed, bonus_count=10):
+    """
+    Create the challenges, accounts (and their teams, in teams mode) and solves, with the awards generated in bulk.
+    Returns (challenge ids, account ids).
+    """
+    from CTFd.models import Teams, Users, db
+    from CTFd.plugins.CTFd_first_blood import FirstBloodValueChallenge
+    from CTFd.plugins.CTFd_first_blood.bulk import generate_awards, import_solves
+    from CTFd.utils.modes import get_model
+
+    rng = random.Random(seed)
+    challenge_ids = []
+    for i in range(challenges):
+        challenge_data = {
+            "name": "memory{0}".format(i),
+            "category": "memory",
+            "description": "memory",
+            "value": 100,
+            "state": "visible",
+            "type": "firstblood",
+        }
+        for j in range(bonus_count):
+            challenge_data["first_blood_bonus[{0}]".format(j)] = 10 * (bonus_count - j)
+        challenge_ids.append(FirstBloodValueChallenge.create(FakeRequest(form=challenge_data)).id)
+
+    # Accounts are inserted directly - gen_user() hashes a password for every one of them
+    teams_mode = get_model() is Teams
+    if teams_mode:
+        db.session.execute(Teams.__table__.insert(), [
+            {"name": "memory{0}".format(i)} for i in range(accounts)
+        ])
+        team_ids = [team_id for team_id, in db.session.query(Teams.id).filter(Teams.name.like("memory%")).order_by(Teams.id)]
+    db.session.execute(Users.__table__.insert(), [
+        {
+            "name": "memory{0}".format(i),
+            "email": "memory{0}@ctfd.io".format(i),
+            "team_id": team_ids[i] if teams_mode else None,
+        }
+        for i in range(accounts)
+    ])
+    user_ids = [user_id for user_id, in db.session.query(Users.id).filter(Users.name.like("memory%")).order_by(Users.id)]
+
+    solves = [
+        (challenge_id, i) for challenge_id in challenge_ids for i in range(accounts) if rng.random() < solve_rate
+    ]
+    rng.shuffle(solves)
+    import_solves(
+        {"challenge_id": challenge_id, "user_id": user_ids[i], "team_id": team_ids[i] if teams_mode else None}
+        for challenge_id, i in solves
+    )
+    generate_awards()
+    db.session.commit()
+    return challenge_ids, team_ids if teams_mode else user_ids
+
+
+def measure(operation):
+    """
+    Peak memory allocated while running operation(), in bytes
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def event_budget(challenge_ids):
+    """
+    Peak memory budget of every scenario on this event, in MiB
+    """
+    from sqlalchemy import func
+
+    from CTFd.models import Solves, db
+
+    largest = (
+        db.session.query(func.count(Solves.id))
+        .filter(Solves.challenge_id.in_(challenge_ids))
+        .group_by(Solves.challenge_id)
+        .order_by(func.count(Solves.id).desc())
+        .limit(1)
+        .scalar()
+    ) or 0
+    return HEADROOM * (BASE_MEMORY + largest * SOLVE_MEMORY + len(challenge_ids) * CHALLENGE_MEMORY)
+
+
+def scenarios(challenge_ids, account_ids):
+    """
+    (name, operation) of every scenario - each one removes different accounts and challenges, so they can run
+    one after the other on the same event
+    """
+    from CTFd.models import Challenges, Solves, Submissions, Teams, Users, db
+    from CTFd.plugins.CTFd_first_blood import FirstBloodValueChallenge
+    from CTFd.utils.modes import get_model
+
+    teams_mode = get_model() is Teams
+    accounts = iter(account_ids)
+
+    def recalculate_awards():
+        FirstBloodValueChallenge.recalculate_awards(Challenges.query.get(challenge_ids[0]))
+        db.session.commit()
+
+    def after_bulk_delete():
+        column = Solves.team_id if teams_mode else Solves.user_id
+        Solves.query.filter(column == next(accounts)).delete(synchronize_session=False)
+        db.session.commit()
+
+    def delete_user():
+        # What the admin panel does to delete a user
+        user_id = Users.query.filter_by(team_id=next(accounts)).first().id if teams_mode else next(accounts)
+        Submissions.query.filter_by(user_id=user_id).delete()
+        Solves.query.filter_by(user_id=user_id).delete()
+        Users.query.filter_by(id=user_id).delete()
+        db.session.commit()
+
+    def delete_team():
+        # What the admin panel does to delete a team
+        team = Teams.query.get(next(accounts))
+        for member in Users.query.filter_by(team_id=team.id):
+            member.team_id = None
+        db.session.delete(team)
+        db.session.commit()
+
+    def delete_challenge():
+        FirstBloodValueChallenge.delete(Challenges.query.get(challenge_ids[-1]))
+
+    result = [
+        ("recalculate_awards", recalculate_awards),
+        ("after_bulk_delete", after_bulk_delete),
+        ("user deletion", delete_user),
+    ]
+    if teams_mode:
+        result.append(("team deletion", delete_team))
+    result.append(("challenge deletion", delete_challenge))
+    return result
+
+
+def run(challenge_ids, account_ids, budgets=None):
+    """
+    Measure every scenario on a fresh session. Returns [(name, peak MiB, budget MiB, seconds)]
+    """
+    from CTFd.models import db
+
+    default = event_budget(challenge_ids)
+    budgets = dict({name: default for name in SCENARIOS}, **(budgets or {}))
+    results = []
+    for name, operation in scenarios(challenge_ids, account_ids):
+        # Nothing from the setup or the previous scenario is left in the session
+        db.session.remove()
+        start = time.perf_counter()
+        peak = measure(operation)
+        results.append((name, peak / 2 ** 20, budgets[name], time.perf_counter() - start))
+    return results
+
+
+def parse_budget(value):
+    name, _, budget = value.rpartition("=")
+    if name not in SCENARIOS:
+        raise argparse.ArgumentTypeError("unknown scenario {0!r}, one of: {1}".format(name, ", ".join(SCENARIOS)))
+    return name, float(budget)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--challenges", type=int, default=100, help="Number of challenges")
+    parser.add_argument("--accounts", type=int, default=5000, help="Number of accounts")
+    parser.add_argument("--solve-rate", type=float, default=0.3, help="Probability that an account solves a challenge")
+    parser.add_argument("--user-mode", choices=["users", "teams"], default="users")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--budget", type=parse_budget, action="append", default=[],
+        help="Peak memory budget of a scenario in MiB, as <scenario>=<MiB> (can be repeated)",
+    )
+    args = parser.parse_args()
+
+    app = create_ctfd(enable_plugins=True, user_mode=args.user_mode)
+    with app.app_context():
+        start = time.perf_counter()
+        challenge_ids, account_ids = build_event(args.challenges, args.accounts, args.solve_rate, args.seed)
+        print("Built the event in {0:.1f}s".format(time.perf_counter() - start))
+        results = run(challenge_ids, account_ids, dict(args.budget))
+    destroy_ctfd(app)
+
+    print("{0:20} {1:>10} {2:>10} {3:>8}".format("scenario", "peak MiB", "budget", "time (s)"))
+    over = False
+    for name, peak, budget, seconds in results:
+        print("{0:20} {1:10.2f} {2:10.2f} {3:8.2f}{4}".format(name, peak, budget, seconds, "  OVER BUDGET" if peak > budget else ""))
+        over = over or peak > budget
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the queries on the solve path of the first blood plugin.
+
+Times the baked queries in queries.py against the same queries built from scratch as Query objects on every
+call (which is what the plugin did before), on a challenge with --solves solves. Both return the same result,
+so the difference is the Python-side cost of building and compiling the query.
+
+Run it from the root of a CTFd checkout (it uses the CTFd test helpers):
+
+    python CTFd/plugins/CTFd_first_blood/tools/benchmark_queries.py --solves 200 --iterations 2000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from tests.helpers import create_ctfd, destroy_ctfd, gen_user  # noqa: E402
+
+
+def count_solves_query(Model, challenge_id, solve_id):
+    from CTFd.models import Solves
+
+    return (
+        Solves.query.join(Model, Solves.account_id == Model.id)
+        .filter(
+            Solves.id <= solve_id,
+            Solves.challenge_id == challenge_id,
+            Model.hidden == False,
+            Model.banned == False,
+        )
+        .count()
+    )
+
+
+def challenge_awards_query(challenge_id):
+    from CTFd.models import Solves
+    from CTFd.plugins.CTFd_first_blood import FirstBloodAward
+
+    return FirstBloodAward.query.join(Solves, FirstBloodAward.solve_id == Solves.id).filter(
+        Solves.challenge_id == challenge_id
+    ).all()
+
+
+def timed(f, iterations):
+    f()  # Warm up (and bake)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        f()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--solves", type=int, default=200, help="Number of solves of the challenge")
+    parser.add_argument("--iterations", type=int, default=2000, help="Number of calls to time per query")
+    args = parser.parse_args()
+
+    app = create_ctfd(enable_plugins=True, user_mode="users")
+    with app.app_context():
+        from CTFd.models import db
+        from CTFd.plugins.CTFd_first_blood import FirstBloodValueChallenge
+        from CTFd.plugins.CTFd_first_blood.bulk import generate_awards, import_solves
+        from CTFd.plugins.CTFd_first_blood.queries import challenge_awards, count_eligible_solves
+        from CTFd.utils.modes import get_model
+        from tests.helpers import FakeRequest
+
+        challenge = FirstBloodValueChallenge.create(FakeRequest(form={
+            "name": "benchmark",
+            "category": "misc",
+            "description": "benchmark",
+            "value": 100,
+            "state": "visible",
+            "type": "firstblood",
+            "first_blood_bonus[0]": 30,
+            "first_blood_bonus[1]": 20,
+            "first_blood_bonus[2]": 10,
+        }))
+        for i in range(args.solves):
+            gen_user(db, name="benchmark{0}".format(i), email="benchmark{0}@ctfd.io".format(i))
+        import_solves([{"challenge_id": challenge.id, "user_id": i + 2} for i in range(args.solves)])
+        generate_awards()
+        db.session.commit()
+
+        Model = get_model()
+        challenge_id = challenge.id
+        solve_id = args.solves // 2
+        assert count_solves_query(Model, challenge_id, solve_id) == count_eligible_solves(
+            db.session, Model, None, challenge_id, solve_id
+        )[0]
+
+        cases = [
+            (
+                "count eligible solves",
+                lambda: count_solves_query(Model, challenge_id, solve_id),
+                lambda: count_eligible_solves(db.session, Model, None, challenge_id, solve_id),
+            ),
+            (
+                "load challenge awards",
+                lambda: challenge_awards_query(challenge_id),
+                lambda: challenge_awards(db.session, challenge_id).all(),
+            ),
+        ]
+        print("{0:24} {1:>12} {2:>12} {3:>8}".format("query", "Query (us)", "baked (us)", "speedup"))
+        for name, before, after in cases:
+            before_time = timed(before, args.iterations)
+            after_time = timed(after, args.iterations)
+            print("{0:24} {1:12.1f} {2:12.1f} {3:7.1f}x".format(
+                name, before_time * 1e6, after_time * 1e6, before_time / after_time))
+    destroy_ctfd(app)
+
+
+if __name__ == "__main__":
+    main()
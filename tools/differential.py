@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Randomized differential test of the first blood awards.
+
+Generates a random sequence of operations (solves, solve deletions, hiding, banning and promoting accounts to
+admin, challenge state and bonus list changes), applies it through the plugin and to a pure-Python reference
+model of what recalculate_awards() should produce, and compares the FirstBloodAward rows with the reference
+after every operation. A divergence is shrunk to a minimal sequence of operations that still diverges, which is
+printed as JSON and can be replayed with --replay.
+
+Run it from the root of a CTFd checkout (it uses the CTFd test helpers):
+
+    python CTFd/plugins/CTFd_first_blood/tools/differential.py --operations 5000 --seed 1234
+    python CTFd/plugins/CTFd_first_blood/tools/differential.py --replay divergence.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.getcwd())
+
+from tests.helpers import FakeRequest, create_ctfd, destroy_ctfd, gen_user  # noqa: E402
+
+# Relative frequency of every kind of operation
+WEIGHTS = {
+    "solve": 50,
+    "unsolve": 10,
+    "hide": 8,
+    "ban": 8,
+    "admin": 4,
+    "state": 6,
+    "bonus": 14,
+}
+
+DEFAULT_BONUS = [30, 20, 10]
+
+
+def generate(seed, count, accounts, challenges):
+    """
+    `count` random operations on `accounts` accounts and `challenges` challenges - the same for the same seed.
+    Operations are JSON-friendly lists, with accounts and challenges referred to by index.
+    """
+    rng = random.Random(seed)
+    kinds = sorted(WEIGHTS)
+    weights = [WEIGHTS[kind] for kind in kinds]
+    operations = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind in ("solve", "unsolve"):
+            operations.append([kind, rng.randrange(accounts), rng.randrange(challenges)])
+        elif kind in ("hide", "ban", "admin"):
+            operations.append([kind, rng.randrange(accounts), rng.random() < 0.5])
+        elif kind == "state":
+            operations.append([kind, rng.randrange(challenges), rng.choice(["visible", "hidden"])])
+        else:
+            # Bonus lists may have gaps (ranks without a bonus), but never end in one
+            bonus = [rng.choice([None, rng.randint(1, 50)]) for _ in range(rng.randint(0, 4))]
+            operations.append([kind, rng.randrange(challenges), bonus + [rng.randint(1, 50)]])
+    return operations
+
+
+class Reference(object):
+    """
+    What the awards should be, computed from scratch from the solves after every operation
+    """
+
+    def __init__(self, accounts, challenge_names):
+        self.accounts = [{"hidden": False, "banned": False, "admin": False} for _ in range(accounts)]
+        self.challenges = [{"name": name, "state": "visible", "bonus": list(DEFAULT_BONUS)} for name in challenge_names]
+        # (account, challenge) in solve order
+        self.solves = []
+
+    def apply(self, operation):
+        kind, target, value = operation
+        if kind == "solve":
+            if (target, value) not in self.solves:
+                self.solves.append((target, value))
+        elif kind == "unsolve":
+            if (target, value) in self.solves:
+                self.solves.remove((target, value))
+        elif kind in ("hide", "ban", "admin"):
+            self.accounts[target][{"hide": "hidden", "ban": "banned", "admin": "admin"}[kind]] = value
+        elif kind == "state":
+            self.challenges[target]["state"] = value
+        elif kind == "bonus":
+            self.challenges[target]["bonus"] = value
+
+    def eligible(self, account):
+        return not any(self.accounts[account].values())
+
+    def awards(self):
+        """
+        {(challenge, account, solve_num, value, name)}
+        """
+        awards = set()
+        for challenge, data in enumerate(self.challenges):
+            if data["state"] != "visible":
+                continue
+            solvers = [account for account, solved in self.solves if solved == challenge and self.eligible(account)]
+            for solve_num, account in enumerate(solvers, 1):
+                value = data["bonus"][solve_num - 1] if solve_num <= len(data["bonus"]) else None
+                if value is not None:
+                    awards.add((challenge, account, solve_num, value, "{0} blood for {1}".format(ordinal(solve_num), data["name"])))
+        return awards
+
+
+def ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return "{0}{1}".format(n, suffix)
+
+
+class Harness(object):
+    """
+    Applies operations through the plugin. The accounts are created once (hashing their passwords is slow) and
+    reset before every run, the challenges are created fresh for every run.
+    """
+
+    def __init__(self, app, accounts, challenges):
+        from CTFd.models import Users
+
+        self.app = app
+        self.challenge_count = challenges
+        self.runs = itertools.count(1)
+        self.challenge_ids = []
+        for i in range(accounts):
+            gen_user(app.db, name="differential{0}".format(i), email="differential{0}@ctfd.io".format(i))
+        self.account_ids = [
+            Users.query.filter_by(name="differential{0}".format(i)).first().id for i in range(accounts)
+        ]
+
+    def reset(self):
+        """
+        Delete the challenges of the previous run (with their solves and awards) and return fresh ones
+        """
+        from CTFd.models import Users, db
+        from CTFd.plugins.CTFd_first_blood import FirstBloodChallenge, FirstBloodValueChallenge
+
+        for challenge in FirstBloodChallenge.query.filter(FirstBloodChallenge.id.in_(self.challenge_ids)).all():
+            FirstBloodValueChallenge.delete(challenge)
+        for user in Users.query.filter(Users.id.in_(self.account_ids)).all():
+            user.hidden = False
+            user.banned = False
+            user.type = "user"
+        db.session.commit()
+
+        run = next(self.runs)
+        names = ["run{0}-challenge{1}".format(run, i) for i in range(self.challenge_count)]
+        self.challenge_ids = []
+        for name in names:
+            challenge_data = {
+                "name": name,
+                "category": "differential",
+                "description": "differential",
+                "value": 100,
+                "state": "visible",
+                "type": "firstblood",
+            }
+            for i, bonus in enumerate(DEFAULT_BONUS):
+                challenge_data["first_blood_bonus[{0}]".format(i)] = bonus
+            self.challenge_ids.append(FirstBloodValueChallenge.create(FakeRequest(form=challenge_data)).id)
+        return names
+
+    def apply(self, operation):
+        from flask import request
+        from CTFd.models import Challenges, Solves, Users, db
+        from CTFd.plugins.CTFd_first_blood import FirstBloodValueChallenge
+
+        kind, target, value = operation
+        if kind in ("solve", "unsolve"):
+            user = Users.query.get(self.account_ids[target])
+            challenge = Challenges.query.get(self.challenge_ids[value])
+            solve = Solves.query.filter_by(user_id=user.id, challenge_id=challenge.id).first()
+            if kind == "solve" and solve is None:
+                # The plugin's solve() needs a real request for the submitter's IP
+                with self.app.test_request_context(json={"submission": "flag"}):
+                    FirstBloodValueChallenge.solve(user, None, challenge, request)
+            elif kind == "unsolve" and solve is not None:
+                db.session.delete(solve)
+                db.session.commit()
+        elif kind in ("hide", "ban", "admin"):
+            user = Users.query.get(self.account_ids[target])
+            if kind == "admin":
+                user.type = "admin" if value else "user"
+            else:
+                setattr(user, {"hide": "hidden", "ban": "banned"}[kind], value)
+            db.session.commit()
+        else:
+            challenge = Challenges.query.get(self.challenge_ids[target])
+            if kind == "state":
+                data = {"state": value}
+            else:
+                data = {
+                    "first_blood_bonus[{0}]".format(i): bonus if bonus is not None else ""
+                    for i, bonus in enumerate(value)
+                }
+            FirstBloodValueChallenge.update(challenge, FakeRequest(form=data))
+
+    def awards(self):
+        from CTFd.models import Solves, db
+        from CTFd.plugins.CTFd_first_blood import FirstBloodAward
+
+        challenges = {challenge_id: i for i, challenge_id in enumerate(self.challenge_ids)}
+        accounts = {account_id: i for i, account_id in enumerate(self.account_ids)}
+        rows = (
+            db.session.query(Solves.challenge_id, FirstBloodAward.user_id, FirstBloodAward.solve_num, FirstBloodAward.value, FirstBloodAward.name)
+            .join(Solves, FirstBloodAward.solve_id == Solves.id)
+            .filter(Solves.challenge_id.in_(self.challenge_ids))
+        )
+        return {
+            (challenges[challenge_id], accounts.get(user_id), solve_num, value, name)
+            for challenge_id, user_id, solve_num, value, name in rows
+        }
+
+    def first_divergence(self, operations):
+        """
+        (index of the first operation after which the plugin disagrees with the reference, description), or None
+        """
+        from CTFd.models import db
+
+        reference = Reference(len(self.account_ids), self.reset())
+        for i, operation in enumerate(operations):
+            reference.apply(operation)
+            try:
+                self.apply(operation)
+            except Exception as e:
+                db.session.rollback()
+                return i, "{0}: {1}".format(type(e).__name__, e)
+            # Compare what is in the database, not what is in the session
+            db.session.expire_all()
+            expected, actual = reference.awards(), self.awards()
+            if expected != actual:
+                return i, "missing {0}, unexpected {1}".format(sorted(expected - actual), sorted(actual - expected))
+        return None
+
+
+def shrink(harness, operations):
+    """
+    Remove operations (in halving chunks, down to single ones) as long as the rest still diverges
+    """
+    chunk = max(len(operations) // 2, 1)
+    while True:
+        i = 0
+        while i < len(operations):
+            candidate = operations[:i] + operations[i + chunk:]
+            if candidate and harness.first_divergence(candidate) is not None:
+                operations = candidate
+            else:
+                i += chunk
+        if chunk == 1:
+            return operations
+        chunk //= 2
+
+
+def check(app, operations, accounts, challenges, minimize=True):
+    """
+    Run the operations and return None if the plugin always agreed with the reference, otherwise
+    (minimal operations, description of the divergence)
+    """
+    harness = Harness(app, accounts, challenges)
+    divergence = harness.first_divergence(operations)
+    if divergence is None:
+        return None
+    # Nothing after the first divergence matters
+    operations = operations[:divergence[0] + 1]
+    if minimize:
+        operations = shrink(harness, operations)
+    return operations, harness.first_divergence(operations)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the operations (random by default)")
+    parser.add_argument("--operations", type=int, default=2000, help="Number of operations")
+    parser.add_argument("--accounts", type=int, default=8, help="Number of accounts")
+    parser.add_argument("--challenges", type=int, default=3, help="Number of challenges")
+    parser.add_argument("--replay", help="Replay the operations in this JSON file (as printed for a divergence)")
+    parser.add_argument("--no-shrink", action="store_true", help="Report the divergence without minimizing it")
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay) as f:
+            replay = json.load(f)
+        args.accounts, args.challenges, operations = replay["accounts"], replay["challenges"], replay["operations"]
+        print("Replaying {0} operations".format(len(operations)))
+    else:
+        if args.seed is None:
+            args.seed = random.randrange(2 ** 32)
+        operations = generate(args.seed, args.operations, args.accounts, args.challenges)
+        print("Seed {0}: {1} operations on {2} accounts and {3} challenges".format(
+            args.seed, args.operations, args.accounts, args.challenges))
+
+    app = create_ctfd(enable_plugins=True, user_mode="users")
+    with app.app_context():
+        start = time.perf_counter()
+        result = check(app, operations, args.accounts, args.challenges, minimize=not args.no_shrink)
+        print("Done in {0:.1f}s".format(time.perf_counter() - start))
+    destroy_ctfd(app)
+
+    if result is None:
+        print("No divergence")
+        return 0
+    operations, description = result
+    print("Divergence after {0} operations: {1}".format(len(operations), description))
+    print(json.dumps({"accounts": args.accounts, "challenges": args.challenges, "operations": operations}))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())